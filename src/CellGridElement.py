@@ -0,0 +1,65 @@
+import json
+import os
+
+import numpy as np
+from mesa.visualization.ModularVisualization import VisualizationElement
+
+
+class CellGridElement(VisualizationElement):
+    """Grid view that draws the number of agents of each state per cell.
+
+    A frame only carries the counts of the cells that changed since the previous
+    frame, unless more than half of the cells changed. Every keyframe_interval
+    frames, and after a reset, a keyframe with every cell is sent. The browser
+    then resyncs, e.g. when a second tab joins mid-run.
+    """
+
+    local_includes = ["CellGridModule.js"]
+    local_dir = os.path.dirname(__file__)
+
+    def __init__(
+        self,
+        colors: list[str],
+        grid_width: int,
+        grid_height: int,
+        canvas_width: int = 500,
+        canvas_height: int = 500,
+        keyframe_interval: int = 50,
+    ) -> None:
+        self.colors = colors
+        self.grid_width = grid_width
+        self.grid_height = grid_height
+        self.canvas_width = canvas_width
+        self.canvas_height = canvas_height
+        self.keyframe_interval = keyframe_interval
+        self.js_code = (
+            f"elements.push(new CellGridModule({canvas_width}, {canvas_height}, "
+            f"{grid_width}, {grid_height}, {json.dumps(colors)}));"
+        )
+        self._model = None
+        self._previous = None
+        self._frame = 0
+
+    def render(self, model) -> dict:
+        # (cells, channels), cells numbered x * grid_height + y
+        counts = model.cell_counts().reshape(self.grid_width * self.grid_height, -1)
+        self._frame += 1
+        frame = {"frame": self._frame, "channels": counts.shape[1]}
+        keyframe = (
+            model is not self._model
+            or self._previous is None
+            or self._frame % self.keyframe_interval == 0
+        )
+        self._model = model
+
+        if not keyframe:
+            changed = np.flatnonzero((counts != self._previous).any(axis=1))
+            keyframe = len(changed) > len(counts) // 2
+        if keyframe:
+            frame["counts"] = counts.ravel().tolist()
+        else:
+            frame["base"] = self._frame - 1
+            frame["cells"] = changed.tolist()
+            frame["counts"] = counts[changed].ravel().tolist()
+        self._previous = counts
+        return frame
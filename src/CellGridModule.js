@@ -0,0 +1,77 @@
+/*
+ * Grid of per-cell agent counts, drawn by CellGridElement.
+ *
+ * Each cell is split into horizontal bands, one per state, sized by the number
+ * of agents of that state in the cell. A last count channel outlines the cells
+ * that hold a medic. Frames without a "base" hold every cell. Frames with one
+ * only hold the cells that changed since that frame, and are ignored until the
+ * next full frame if that frame was never drawn here.
+ */
+const CellGridModule = function (
+  canvas_width,
+  canvas_height,
+  grid_width,
+  grid_height,
+  colors
+) {
+  const canvas = document.createElement("canvas");
+  Object.assign(canvas, {
+    width: canvas_width,
+    height: canvas_height,
+    className: "world-grid",
+  });
+  const parent = document.createElement("div");
+  parent.style.height = `${canvas_height}px`;
+  parent.className = "world-grid-parent";
+  parent.appendChild(canvas);
+  document.getElementById("elements").appendChild(parent);
+
+  const context = canvas.getContext("2d");
+  const cellWidth = Math.floor(canvas_width / grid_width);
+  const cellHeight = Math.floor(canvas_height / grid_height);
+  const states = colors.length;
+  let lastFrame = -1;
+
+  const drawCell = (cell, counts, offset) => {
+    const x = Math.floor(cell / grid_height) * cellWidth;
+    // canvas y grows downwards, grid y upwards
+    const y = (grid_height - 1 - (cell % grid_height)) * cellHeight;
+    context.clearRect(x, y, cellWidth, cellHeight);
+
+    let total = 0;
+    for (let s = 0; s < states; s++) total += counts[offset + s];
+    let top = y;
+    for (let s = 0; s < states && total > 0; s++) {
+      const height = (cellHeight * counts[offset + s]) / total;
+      context.fillStyle = colors[s];
+      context.fillRect(x, top, cellWidth, height);
+      top += height;
+    }
+    if (counts[offset + states] > 0) {
+      context.strokeStyle = "Grey";
+      context.lineWidth = 3;
+      context.strokeRect(x + 1.5, y + 1.5, cellWidth - 3, cellHeight - 3);
+    }
+    context.strokeStyle = "#eee";
+    context.lineWidth = 1;
+    context.strokeRect(x + 0.5, y + 0.5, cellWidth - 1, cellHeight - 1);
+  };
+
+  this.render = (data) => {
+    const channels = data.channels;
+    if (data.base === undefined) {
+      for (let cell = 0; cell < grid_width * grid_height; cell++)
+        drawCell(cell, data.counts, cell * channels);
+    } else if (data.base === lastFrame) {
+      data.cells.forEach((cell, i) => drawCell(cell, data.counts, i * channels));
+    } else {
+      return;
+    }
+    lastFrame = data.frame;
+  };
+
+  this.reset = () => {
+    context.clearRect(0, 0, canvas_width, canvas_height);
+    lastFrame = -1;
+  };
+};
@@ -0,0 +1,77 @@
+from mesa import Agent
+from mesa.model import Model
+from mesa.time import RandomActivation
+from agent import State
+
+
+class InfectionActivation(RandomActivation):
+    """Random activation followed by the model's cell-level infection phase.
+
+    The transitions due this step fire before the agents move, except for
+    releases from isolation, which fire after: a released agent only moves again
+    in the next step. The infection phase runs after every agent has moved but
+    before the time is advanced, so new infections are stamped with the current step.
+
+    Agents that can no longer change state are retired to an inert set: they are
+    no longer stepped, but still count as scheduled agents. Unless
+    dead_occupy_cells is set, deceased agents are also taken off the grid.
+    """
+
+    def __init__(self, model: Model, dead_occupy_cells: bool = True) -> None:
+        super().__init__(model)
+        self.dead_occupy_cells = dead_occupy_cells
+        self._inert: dict[int, Agent] = {}
+
+    def add_agents(self, agents: list[Agent]) -> None:
+        """Add many new agents at once"""
+        added = {agent.unique_id: agent for agent in agents}
+        if len(added) < len(agents) or not self._agents.keys().isdisjoint(added):
+            raise Exception("Agents with duplicate unique ids added to scheduler")
+        self._agents.update(added)
+
+    def retire(self, agent: Agent) -> None:
+        """Move an agent from the active to the inert set"""
+        if agent.unique_id not in self._agents:
+            return
+        del self._agents[agent.unique_id]
+        self._inert[agent.unique_id] = agent
+        if (
+            agent.state == State.DECEASED
+            and not self.dead_occupy_cells
+            and agent.pos is not None
+        ):
+            self.model.grid.remove_agent(agent)
+
+    def remove(self, agent: Agent) -> None:
+        if agent.unique_id in self._inert:
+            del self._inert[agent.unique_id]
+        else:
+            super().remove(agent)
+
+    def is_active(self, agent: Agent) -> bool:
+        return agent.unique_id in self._agents
+
+    def get_agent(self, unique_id: int) -> Agent:
+        """The agent with the given id, active or inert"""
+        agent = self._agents.get(unique_id)
+        return self._inert[unique_id] if agent is None else agent
+
+    def get_agent_count(self) -> int:
+        return len(self._agents) + len(self._inert)
+
+    @property
+    def agents(self) -> list[Agent]:
+        return list(self._agents.values()) + list(self._inert.values())
+
+    @property
+    def active_agents(self) -> list[Agent]:
+        return list(self._agents.values())
+
+    def step(self) -> None:
+        self.model.fire_transitions()
+        for agent in self.agent_buffer(shuffled=True):
+            agent.step()
+        self.model.release_isolated()
+        self.model.spread_infection()
+        self.steps += 1
+        self.time += 1
@@ -1,8 +1,7 @@
-from mesa import Agent
+from random import Random
 from mesa.model import Model
 from mesa.space import Position
 from mesa.datacollection import DataCollector
-import numpy as np
 
 
 class State:
@@ -13,54 +12,96 @@ class State:
     RECOVERED = 4
 
 
-class InfectableAgent(Agent):
-    """An agent that can get infected."""
+# states an agent can no longer leave
+INERT_STATES = (State.DECEASED, State.RECOVERED)
 
-    def __init__(self, unique_id: int, model: Model, medic: bool = False) -> None:
-        super().__init__(unique_id, model)
-        self.isMedic = medic
-        self.vaccinated = False
-        self.state = State.SUSCEPTIBLE
-        self.age = self.random.uniform(0, 99)
-        self.infection_time = 0
-        self.wear_mask = np.random.choice(
-            [False, True],
-            p=[1 - self.model.wear_mask_chance, self.model.wear_mask_chance],
-        )
-        self.isolation_time = 0
-        self.set_recovery_time()
+
+class SlottedAgent:
+    """Drop-in replacement for mesa.Agent that stores its attributes in slots.
+
+    mesa.Agent does not define __slots__, so every subclass instance would carry a
+    __dict__. This class provides the same interface used by the grid, the
+    scheduler and the visualization without it.
+    """
+
+    __slots__ = ("unique_id", "model", "pos")
+
+    def __init__(self, unique_id: int, model: Model) -> None:
+        self.unique_id = unique_id
+        self.model = model
+        self.pos: Position | None = None
 
     def step(self) -> None:
-        self.check_status()
+        """A single step of the agent."""
+
+    def advance(self) -> None:
+        pass
+
+    @property
+    def random(self) -> Random:
+        return self.model.random
+
+
+class InfectableAgent(SlottedAgent):
+    """An agent that can get infected. Agents are built by from_attributes, from
+    attributes drawn in bulk by the model or read from a population file.
+    """
+
+    __slots__ = (
+        "isMedic",
+        "vaccinated",
+        "_state",
+        "age",
+        "infection_time",
+        "wear_mask",
+        "recovery_time",
+    )
+
+    @classmethod
+    def from_attributes(
+        cls,
+        unique_id: int,
+        model: Model,
+        medic: bool,
+        age: float,
+        wear_mask: bool,
+        recovery_time: int,
+    ) -> "InfectableAgent":
+        """Susceptible agent with already drawn attributes, as built in bulk"""
+        agent = cls.__new__(cls)
+        agent.unique_id = unique_id
+        agent.model = model
+        agent.pos = None
+        agent.isMedic = medic
+        agent.vaccinated = False
+        agent._state = State.SUSCEPTIBLE
+        agent.age = age
+        agent.infection_time = 0
+        agent.wear_mask = wear_mask
+        agent.recovery_time = recovery_time
+        return agent
+
+    @property
+    def state(self) -> int:
+        return self._state
+
+    @state.setter
+    def state(self, state: int) -> None:
+        self.model.counters.update_state(self, self._state, state)
+        self._state = state
+        if state == State.DECEASED:
+            self.model.unvaccinated.discard(self)
+        if state in INERT_STATES:
+            self.model.schedule.retire(self)
+
+    def step(self) -> None:
+        # isolation, death and recovery are timed transitions queued by the model
         if self.state == State.ISOLATED:
-            self.isolation_time += 1
-            if self.isolation_time == self.model.isolation_duration:
-                self.state = State.INFECTED
-        elif self.model.social_distance > 0:
+            return
+        if self.model.social_distance > 0:
             self.move_with_distance()
         else:
             self.move()
-        self.contact()
-
-    def check_status(self) -> None:
-        """Check infection status"""
-        if self.state != State.INFECTED and self.state != State.ISOLATED:
-            return
-        if self.state != State.ISOLATED:
-            isolation_rate = self.model.isolation_chance
-            isolated = np.random.choice([0, 1], p=[isolation_rate, 1 - isolation_rate])
-            if isolated == 0:
-                self.isolation_time = 0
-                self.state = State.ISOLATED
-        death_rate = self.model.death_rate
-        alive = np.random.choice([0, 1], p=[death_rate, 1 - death_rate])
-        if alive == 0:
-            self.state = State.DECEASED
-            self.model.register_death(self)
-        else:
-            t = self.model.schedule.time - self.infection_time
-            if t >= self.recovery_time:
-                self.state = State.RECOVERED
 
     def move(self) -> None:
         """Move the agent"""
@@ -72,12 +113,13 @@ class InfectableAgent(Agent):
 
     def move_with_distance(self) -> None:
         """Move the agent with concern to social distance. Tries to maximize distance if model.social_distance is not possible."""
-        if self.random.random() > self.model.social_distance_chance:
+        if self.model.rng.random() > self.model.social_distance_chance:
             self.move()
             return
 
-        possible_steps = self.model.grid.get_neighborhood(
-            self.pos, moore=True, include_center=False
+        # copy, as the grid caches and reuses the neighbourhood list
+        possible_steps = list(
+            self.model.grid.get_neighborhood(self.pos, moore=True, include_center=False)
         )
         self.random.shuffle(possible_steps)
 
@@ -104,42 +146,16 @@ class InfectableAgent(Agent):
         self.model.grid.move_agent(self, new_pos)
 
     def check_social_distance(self, pos: Position, distance: int) -> bool:
-        cells_in_distance = self.model.grid.get_neighborhood(
-            pos,
-            moore=True,
-            include_center=True,
-            radius=distance - 1,  # -1 because the center is included
+        occupied_cells = self.model.grid.count_occupied_cells(
+            pos, distance - 1  # -1 because the center is included
         )
-        agents_in_distance = [
-            cell
-            for cell in cells_in_distance
-            if not self.model.grid.is_cell_empty(cell)
-        ]
-        return len(agents_in_distance) == 1  # only the agent itself
-
-    def contact(self) -> None:
-        """Find close agents and infect them"""
-        cellmates = self.model.grid.get_cell_list_contents([self.pos])
-        if len(cellmates) == 0:
-            return
-        for agent in cellmates:
-            if self.random.random() > self.get_infection_rate():
-                continue
-            if self.state is State.INFECTED and agent.state is State.SUSCEPTIBLE:
-                agent.state = State.INFECTED
-                agent.infection_time = self.model.schedule.time
-
-    def cure_adjacent(self) -> None:
-        cellmates = self.model.grid.get_cell_list_contents([self.pos])
-        if len(cellmates) == 0:
-            return
-        for agent in cellmates:
-            if self.random.random() > self.model.curing_chance:
-                continue
-            if self.state is State.INFECTED and agent.state is not State.DECEASED:
-                agent.state = State.RECOVERED
+        return occupied_cells == 1  # only the agent itself
 
     def boost_immunity(self):
+        if self.vaccinated:
+            return
+        self.model.counters.update_vaccinated(self)
+        self.model.unvaccinated.discard(self)
         self.vaccinated = True
 
     def get_infection_rate(self) -> float:
@@ -154,24 +170,3 @@ class InfectableAgent(Agent):
             return self.model.infection_rate * (1 - self.model.mask_effectiveness)
         else:
             return self.model.infection_rate
-
-    def set_recovery_time(self) -> None:
-        """Set recovery time"""
-        if self.age <= 12:
-            self.recovery_time = self.random.randint(2, 7)
-        elif self.age <= 19:
-            self.recovery_time = self.random.randint(4, 11)
-        elif self.age <= 29:
-            self.recovery_time = self.random.randint(5, 14)
-        elif self.age <= 39:
-            self.recovery_time = self.random.randint(7, 14)
-        elif self.age <= 59:
-            self.recovery_time = self.random.randint(8, 21)
-        elif self.age <= 79:
-            self.recovery_time = self.random.randint(14, 21)
-        else:
-            self.recovery_time = self.random.randint(14, 28)
-
-        self.recovery_time = int(
-            self.recovery_time * self.model.recovery_time_multiplier
-        )
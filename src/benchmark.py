@@ -0,0 +1,217 @@
+"""Benchmark suite: ticks per second and peak memory of the model across a matrix
+of population sizes, grid densities, social distances and interventions.
+
+Each case runs in a fresh process with a fixed seed. Results can be saved as a
+JSON baseline and later runs compared against it:
+
+    python benchmark.py --quick --save baseline.json
+    python benchmark.py --quick --compare baseline.json
+"""
+
+import argparse
+import json
+import math
+import multiprocessing
+import platform
+import resource
+import sys
+import time
+from typing import Any
+
+POPULATIONS = [10**2, 10**3, 10**4, 10**5, 10**6]
+QUICK_POPULATIONS = [10**2, 10**3, 10**4]
+# agents per grid cell; the reference density is 1
+DENSITIES = [0.25, 1.0, 4.0]
+SOCIAL_DISTANCES = [0, 1, 2, 3, 4, 5]
+# share of the population that the interventions apply to
+INTERVENTION_SHARE = 0.01
+
+# keep the epidemic going for the whole measurement
+BASE_PARAMS = {
+    "start_infection_rate": 0.05,
+    "death_rate": 0.01,
+    "recovery_time_multiplier": 5.0,
+    "isolation_chance": 0.05,
+    "vaccine_ready_time": 10**9,
+}
+
+
+def grid_side(num_agents: int, density: float) -> int:
+    """Side of a square grid holding num_agents at the given density"""
+    return max(1, round(math.sqrt(num_agents / density)))
+
+
+def case_id(params: dict) -> str:
+    """Short stable name of a case"""
+    return ",".join(f"{name}={value}" for name, value in sorted(params.items()))
+
+
+def benchmark_cases(populations: list[int]) -> list[dict]:
+    """Parameters of every case: per population a reference case, then one
+    variation at a time of the density, the social distance and the interventions
+    """
+    cases = []
+    for num_agents in populations:
+        share = max(1, int(num_agents * INTERVENTION_SHARE))
+        medics = {"num_medic_agents": share}
+        travellers = {"num_traveling_agents": share}
+        vaccination = {"vaccine_ready_time": 0, "vaccine_batch_size": share}
+        variations = [{}]
+        variations += [{"density": d} for d in DENSITIES if d != 1.0]
+        variations += [{"social_distance": d} for d in SOCIAL_DISTANCES if d != 0]
+        variations += [medics, travellers, vaccination]
+        variations.append({**medics, **travellers, **vaccination})
+
+        for variation in variations:
+            variation = dict(variation)
+            side = grid_side(num_agents, variation.pop("density", 1.0))
+            params = {"num_agents": num_agents, "width": side, "height": side}
+            cases.append({**params, **variation})
+    return cases
+
+
+def _measure(job: tuple) -> dict[str, Any]:
+    """Run one case, in its own process so that peak memory is its own.
+    Ticks per second is the best of the repeats, each on a fresh model.
+    """
+    params, engine, steps, warmup, repeats, seed = job
+    from runner import create_model
+
+    # load the engine before taking the memory baseline
+    create_model({"num_agents": 0}, seed, engine).close()
+    baseline_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    best = 0.0
+    for _ in range(repeats):
+        start = time.perf_counter()
+        model = create_model({**BASE_PARAMS, **params}, seed, engine)
+        setup = time.perf_counter() - start
+        for _ in range(warmup):
+            model.step()
+        start = time.perf_counter()
+        for _ in range(steps):
+            model.step()
+        best = max(best, steps / (time.perf_counter() - start))
+        model.close()
+        del model
+    peak_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return {
+        "params": params,
+        "setup_seconds": round(setup, 4),
+        "ticks_per_second": round(best, 3),
+        # ru_maxrss is in kilobytes on Linux
+        "peak_memory_mb": round((peak_kb - baseline_kb) / 1024, 1),
+    }
+
+
+def run_benchmarks(
+    cases: list[dict],
+    engine: str = "agent",
+    steps: int = 10,
+    warmup: int = 2,
+    repeats: int = 3,
+    seed: int = 0,
+    verbose: bool = True,
+) -> dict[str, Any]:
+    """Measure every case and return the results in baseline form"""
+    results = {}
+    context = multiprocessing.get_context()
+    with context.Pool(1, maxtasksperchild=1) as pool:
+        jobs = [(params, engine, steps, warmup, repeats, seed) for params in cases]
+        for result in pool.imap(_measure, jobs):
+            identifier = case_id(result["params"])
+            results[identifier] = result
+            if verbose:
+                print(
+                    f"{identifier}: {result['ticks_per_second']} ticks/s, "
+                    f"{result['peak_memory_mb']} MB"
+                )
+    return {
+        "engine": engine,
+        "steps": steps,
+        "repeats": repeats,
+        "seed": seed,
+        "machine": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "processor": platform.processor(),
+        },
+        "cases": results,
+    }
+
+
+def compare(
+    current: dict[str, Any], baseline: dict[str, Any], threshold: float = 0.1
+) -> list[str]:
+    """Cases that got slower, or used more memory, than the baseline by more than
+    threshold (a fraction of the baseline value)
+    """
+    regressions = []
+    for identifier, result in current["cases"].items():
+        reference = baseline["cases"].get(identifier)
+        if reference is None:
+            continue
+        speed = result["ticks_per_second"] / reference["ticks_per_second"]
+        if speed < 1 - threshold:
+            regressions.append(
+                f"{identifier}: {result['ticks_per_second']} ticks/s, "
+                f"{1 - speed:.0%} slower than {reference['ticks_per_second']}"
+            )
+        # ignore noise on cases that barely allocate
+        memory = max(reference["peak_memory_mb"], 1.0)
+        if result["peak_memory_mb"] > memory * (1 + threshold):
+            regressions.append(
+                f"{identifier}: {result['peak_memory_mb']} MB, "
+                f"up from {reference['peak_memory_mb']} MB"
+            )
+    return regressions
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("-e", "--engine", default="agent")
+    parser.add_argument("-n", "--steps", type=int, default=10)
+    parser.add_argument("-w", "--warmup", type=int, default=2)
+    parser.add_argument("-r", "--repeats", type=int, default=3)
+    parser.add_argument("-s", "--seed", type=int, default=0)
+    parser.add_argument(
+        "--quick",
+        action="store_true",
+        help=f"only populations up to {QUICK_POPULATIONS[-1]}",
+    )
+    parser.add_argument("--max-agents", type=int, help="skip larger populations")
+    parser.add_argument("-k", "--filter", help="only cases whose name contains this")
+    parser.add_argument("--save", help="write the results to this baseline file")
+    parser.add_argument("--compare", help="report regressions against this baseline")
+    parser.add_argument("--threshold", type=float, default=0.1)
+    args = parser.parse_args(argv)
+
+    populations = QUICK_POPULATIONS if args.quick else POPULATIONS
+    if args.max_agents is not None:
+        populations = [n for n in populations if n <= args.max_agents]
+    cases = benchmark_cases(populations)
+    if args.filter:
+        cases = [params for params in cases if args.filter in case_id(params)]
+
+    results = run_benchmarks(
+        cases, args.engine, args.steps, args.warmup, args.repeats, args.seed
+    )
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if baseline["engine"] != results["engine"]:
+            parser.error(f"baseline was measured on the {baseline['engine']} engine")
+        regressions = compare(results, baseline, args.threshold)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        print(f"{len(regressions)} regressions against {args.compare}")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,174 @@
+"""Content-addressed cache of finished runs.
+
+A run is keyed by its full parameter set (including the engine defaults), its
+seed, step limit and engine, the metadata (content digest and layer weights) of
+its population and contact layers files if it has them, and a hash of the model
+source code, so editing the model invalidates every entry. Each entry is one
+compressed .npz file holding the collector series as integer arrays next to the
+JSON summary. Entries are evicted least recently used first once the cache grows
+past its size cap.
+"""
+
+import functools
+import glob
+import hashlib
+import inspect
+import json
+import os
+from typing import Any
+
+import numpy as np
+
+from runner import COLLECTORS, model_class
+
+DEFAULT_DIRECTORY = os.path.join(os.path.expanduser("~"), ".cache", "asma_sim")
+DEFAULT_MAX_BYTES = 512 * 1024**2
+
+
+@functools.cache
+def code_version() -> str:
+    """Hash of the model sources, i.e. of every module next to this one"""
+    digest = hashlib.sha256()
+    directory = os.path.dirname(os.path.abspath(__file__))
+    for path in sorted(glob.glob(os.path.join(directory, "*.py"))):
+        digest.update(os.path.basename(path).encode())
+        with open(path, "rb") as f:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+
+def full_parameters(params: dict, engine: str) -> dict:
+    """The parameters with the engine's defaults filled in"""
+    signature = inspect.signature(model_class(engine).__init__)
+    defaults = {
+        name: parameter.default
+        for name, parameter in signature.parameters.items()
+        if parameter.default is not inspect.Parameter.empty and name != "seed"
+    }
+    return {**defaults, **params}
+
+
+def cache_key(
+    params: dict, max_steps: int | None, seed: int, engine: str = "agent"
+) -> str:
+    """Identifier of a run's result"""
+    params = full_parameters(params, engine)
+    files = {}
+    for name in ("population", "contact_layers"):
+        if params.get(name) is not None:
+            from population import read_meta
+
+            # key on the contents of the file rather than its path alone: the
+            # meta holds the digest of the arrays and the stored layer weights
+            files[name] = read_meta(params[name])
+    key = json.dumps(
+        {
+            "params": params,
+            "files": files,
+            "max_steps": max_steps,
+            "seed": seed,
+            "engine": engine,
+            "code": code_version(),
+        },
+        sort_keys=True,
+    )
+    return hashlib.sha256(key.encode()).hexdigest()
+
+
+def is_cacheable(params: dict, seed: int | None) -> bool:
+    """Unseeded runs differ every time, and runs with an output directory have
+    to write their collector files
+    """
+    return seed is not None and params.get("output_dir") is None
+
+
+class ResultCache:
+    """Directory of cached run results with a size cap and LRU eviction.
+    Entries are written atomically, so several processes can share a cache.
+    """
+
+    def __init__(
+        self, directory: str = DEFAULT_DIRECTORY, max_bytes: int = DEFAULT_MAX_BYTES
+    ) -> None:
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.npz")
+
+    def get(self, key: str) -> dict[str, Any] | None:
+        """The cached result, or None on a miss"""
+        path = self._path(key)
+        try:
+            with np.load(path) as entry:
+                meta = json.loads(entry["meta"].tobytes())
+                series = {
+                    name: dict(zip(meta["labels"][name], entry[name].tolist()))
+                    for name in COLLECTORS
+                }
+            # the modification time is the last use, for the LRU order
+            os.utime(path)
+        except (OSError, KeyError, ValueError):
+            # missing, evicted meanwhile or corrupt
+            return None
+        return {
+            "params": meta["params"],
+            "seed": meta["seed"],
+            "series": series,
+            "summary": meta["summary"],
+        }
+
+    def put(self, key: str, result: dict[str, Any]) -> None:
+        """Store a result of run_model and evict old entries if over the cap"""
+        meta = {
+            "params": result["params"],
+            "seed": result["seed"],
+            "summary": result["summary"],
+            "labels": {name: list(result["series"][name]) for name in COLLECTORS},
+        }
+        arrays = {
+            name: np.array(list(result["series"][name].values()), dtype=np.int64)
+            for name in COLLECTORS
+        }
+        path = self._path(key)
+        temporary = f"{path}.{os.getpid()}.tmp"
+        with open(temporary, "wb") as f:
+            np.savez_compressed(
+                f,
+                meta=np.frombuffer(json.dumps(meta).encode(), dtype=np.uint8),
+                **arrays,
+            )
+        os.replace(temporary, path)
+        self.evict()
+
+    def evict(self) -> None:
+        """Remove the least recently used entries until the cache fits its cap"""
+        entries = []
+        for path in glob.glob(os.path.join(self.directory, "*.npz")):
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
+
+    def size(self) -> int:
+        """Bytes used by the cache entries"""
+        return sum(
+            os.path.getsize(path)
+            for path in glob.glob(os.path.join(self.directory, "*.npz"))
+        )
+
+    def clear(self) -> None:
+        """Remove every entry"""
+        for path in glob.glob(os.path.join(self.directory, "*.npz")):
+            os.remove(path)
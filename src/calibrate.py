@@ -0,0 +1,310 @@
+"""Calibration: fit model parameters to an observed stateDataCollector curve with
+approximate Bayesian computation (ABC-SMC).
+
+Each generation keeps the particles whose simulated curves are within a distance
+epsilon of the target, and epsilon shrinks from generation to generation.
+Simulations run on a process pool. A run is abandoned as soon as its partial
+trajectory has drifted further than epsilon from the target, because the
+distance can only grow with more steps.
+
+    python calibrate.py observed.json --prior infection_rate=0.1:0.9 \\
+        --prior death_rate=0.005:0.1 --num_agents 500 --particles 100
+"""
+
+import json
+import math
+import os
+import sys
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from typing import Any
+
+import numpy as np
+
+from ensemble import replicate_seed
+
+TARGET_LABELS = ["Infected", "Deceased"]
+
+
+def load_target(path: str) -> dict[str, list[float]]:
+    """Read a target curve: a {label: series} JSON file, or the output of run.py"""
+    with open(path) as f:
+        data = json.load(f)
+    if "series" in data:
+        data = data["series"]["stateDataCollector"]
+    return data
+
+
+class TrajectoryDistance:
+    """Normalized root mean squared error between a run and the target series.
+
+    Each label is scaled by the peak of its target series. The distance is
+    accumulated step by step, so a run can be abandoned once its partial error
+    already exceeds the tolerance.
+    """
+
+    def __init__(self, target: dict[str, list[float]], labels: list[str]) -> None:
+        self.labels = labels
+        self.target = {label: np.asarray(target[label], float) for label in labels}
+        self.length = min(len(series) for series in self.target.values())
+        self.scale = {
+            label: max(float(np.abs(series).max()), 1.0)
+            for label, series in self.target.items()
+        }
+        self.points = self.length * len(labels)
+        self.squared_error = 0.0
+
+    def add(self, tick: int, values: dict[str, float]) -> float:
+        """Add the values of one tick and return the distance so far"""
+        for label in self.labels:
+            error = (values[label] - self.target[label][tick]) / self.scale[label]
+            self.squared_error += error * error
+        return math.sqrt(self.squared_error / self.points)
+
+
+def simulate(job: tuple) -> tuple[float, int]:
+    """Run one particle against the target; returns its distance, or inf if it
+    was abandoned, and the number of steps run
+    """
+    params, seed, target, labels, epsilon, engine = job
+    from runner import create_model
+
+    model = create_model(params, seed, engine)
+    distance = TrajectoryDistance(target, labels)
+    series = model.stateDataCollector.model_vars
+    try:
+        # the first row is recorded when the model is built, then one per step;
+        # a model that has ended keeps its last values, as in ensemble.bands
+        value = distance.add(0, {label: series[label][-1] for label in labels})
+        for tick in range(1, distance.length):
+            if value > epsilon:
+                return math.inf, tick - 1
+            if model.running:
+                model.step()
+            value = distance.add(tick, {label: series[label][-1] for label in labels})
+    finally:
+        model.close()
+    return (value if value <= epsilon else math.inf), distance.length - 1
+
+
+def parse_prior(assignments: list[str]) -> dict[str, tuple[float, float]]:
+    """Parse name=low:high uniform priors"""
+    prior = {}
+    for assignment in assignments:
+        name, bounds = assignment.split("=", 1)
+        low, high = (json.loads(v) for v in bounds.split(":"))
+        prior[name] = (low, high)
+    return prior
+
+
+class ABCSMC:
+    """ABC-SMC with uniform priors and a Gaussian perturbation kernel.
+
+    prior maps parameter names to (low, high) bounds. Integer bounds give an
+    integer parameter. params holds the fixed model parameters.
+    """
+
+    def __init__(
+        self,
+        target: dict[str, list[float]],
+        prior: dict[str, tuple[float, float]],
+        params: dict | None = None,
+        labels: list[str] = TARGET_LABELS,
+        particles: int = 100,
+        quantile: float = 0.5,
+        engine: str = "agent",
+        processes: int | None = None,
+        seed: int = 0,
+    ) -> None:
+        self.target = {label: list(target[label]) for label in labels}
+        self.prior = prior
+        self.names = list(prior)
+        self.low = np.array([prior[name][0] for name in self.names], float)
+        self.high = np.array([prior[name][1] for name in self.names], float)
+        self.integer = [
+            all(isinstance(b, int) for b in prior[name]) for name in self.names
+        ]
+        self.params = params or {}
+        self.labels = labels
+        self.particles = particles
+        self.quantile = quantile
+        self.engine = engine
+        self.processes = processes or os.cpu_count()
+        self.seed = seed
+        self.rng = np.random.default_rng(seed)
+        self.simulations = 0
+        self.abandoned = 0
+        self.saved_steps = 0
+        self.generations: list[dict[str, Any]] = []
+
+    def model_params(self, theta: np.ndarray) -> dict:
+        values = {
+            name: int(round(v)) if integer else float(v)
+            for name, v, integer in zip(self.names, theta, self.integer)
+        }
+        return {**self.params, **values}
+
+    def propose(self, previous: dict | None) -> np.ndarray:
+        """Draw a parameter vector from the prior, or perturb one of the previous
+        generation, until it falls within the prior bounds
+        """
+        if previous is None:
+            return self.rng.uniform(self.low, self.high)
+        while True:
+            index = self.rng.choice(len(previous["weights"]), p=previous["weights"])
+            theta = self.rng.normal(previous["theta"][index], previous["sigma"])
+            if np.all(theta >= self.low) and np.all(theta <= self.high):
+                return theta
+
+    def run_generation(
+        self, epsilon: float, previous: dict | None, max_simulations: int
+    ) -> dict:
+        """Collect particles within epsilon of the target"""
+        accepted, distances = [], []
+        length = min(len(series) for series in self.target.values()) - 1
+        with ProcessPoolExecutor(self.processes) as executor:
+            running = {}
+            started = 0
+            # keep every worker busy until enough particles are accepted
+            while len(accepted) < self.particles:
+                while len(running) < 2 * self.processes and started < max_simulations:
+                    theta = self.propose(previous)
+                    job = (
+                        self.model_params(theta),
+                        replicate_seed(self.seed, self.simulations + started),
+                        self.target,
+                        self.labels,
+                        epsilon,
+                        self.engine,
+                    )
+                    running[executor.submit(simulate, job)] = theta
+                    started += 1
+                if not running:
+                    break
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    theta = running.pop(future)
+                    distance, steps = future.result()
+                    if math.isinf(distance):
+                        self.abandoned += 1
+                        self.saved_steps += length - steps
+                    elif len(accepted) < self.particles:
+                        accepted.append(theta)
+                        distances.append(distance)
+            for future in running:
+                future.cancel()
+        self.simulations += started
+
+        theta = np.array(accepted).reshape(-1, len(self.names))
+        weights = self.weights(theta, previous)
+        generation = {
+            "epsilon": epsilon,
+            "theta": theta,
+            "weights": weights,
+            "distances": np.array(distances),
+            "simulations": started,
+        }
+        if len(theta) > 1:
+            # twice the weighted variance, the usual component-wise kernel
+            mean = weights @ theta
+            generation["sigma"] = np.sqrt(2 * (weights @ (theta - mean) ** 2)) + 1e-12
+        else:
+            generation["sigma"] = (self.high - self.low) / 10
+        return generation
+
+    def weights(self, theta: np.ndarray, previous: dict | None) -> np.ndarray:
+        """Importance weights of the accepted particles; the uniform prior cancels"""
+        if len(theta) == 0:
+            return np.zeros(0)
+        if previous is None:
+            return np.full(len(theta), 1 / len(theta))
+        diff = (theta[:, None, :] - previous["theta"][None, :, :]) / previous["sigma"]
+        kernel = np.exp(-0.5 * (diff**2).sum(axis=2))
+        weights = 1 / (kernel @ previous["weights"])
+        return weights / weights.sum()
+
+    def run(
+        self,
+        generations: int = 5,
+        min_epsilon: float = 0.0,
+        max_simulations: int = 10_000,
+    ) -> dict[str, Any]:
+        """Run up to the given number of generations and return the last population"""
+        epsilon = math.inf
+        previous = None
+        for _ in range(generations):
+            generation = self.run_generation(epsilon, previous, max_simulations)
+            if len(generation["theta"]) < self.particles:
+                # the budget ran out before epsilon could be reached
+                if previous is None:
+                    if len(generation["theta"]) == 0:
+                        raise ValueError(
+                            f"No particle was accepted within max_simulations="
+                            f"{max_simulations}"
+                        )
+                    previous = generation
+                break
+            self.generations.append(generation)
+            previous = generation
+            epsilon = float(np.quantile(generation["distances"], self.quantile))
+            if epsilon <= min_epsilon:
+                break
+        return self.result(previous)
+
+    def result(self, population: dict) -> dict[str, Any]:
+        theta, weights = population["theta"], population["weights"]
+        best = int(np.argmin(population["distances"]))
+        return {
+            "posterior_mean": self.model_params(weights @ theta),
+            "best": self.model_params(theta[best]),
+            "best_distance": float(population["distances"][best]),
+            "particles": [self.model_params(t) for t in theta],
+            "weights": weights.tolist(),
+            "distances": population["distances"].tolist(),
+            # the first generation accepts every particle
+            "epsilons": [
+                None if math.isinf(g["epsilon"]) else g["epsilon"]
+                for g in self.generations
+            ],
+            "simulations": self.simulations,
+            "abandoned": self.abandoned,
+            "saved_steps": self.saved_steps,
+        }
+
+
+def main(argv: list[str] | None = None) -> None:
+    from run import build_parser, parse_args
+
+    parser = build_parser(__doc__)
+    parser.add_argument("target", help="JSON file with the observed series")
+    parser.add_argument("--prior", action="append", required=True, help="name=low:high")
+    parser.add_argument("--labels", default=",".join(TARGET_LABELS))
+    parser.add_argument("--particles", type=int, default=100)
+    parser.add_argument("--generations", type=int, default=5)
+    parser.add_argument("--quantile", type=float, default=0.5)
+    parser.add_argument("--min-epsilon", type=float, default=0.0)
+    parser.add_argument("--max-simulations", type=int, default=10_000)
+    parser.add_argument("-j", "--processes", type=int)
+    args, params = parse_args(sys.argv[1:] if argv is None else argv, parser)
+
+    abc = ABCSMC(
+        load_target(args.target),
+        parse_prior(args.prior),
+        params,
+        args.labels.split(","),
+        args.particles,
+        args.quantile,
+        args.engine,
+        args.processes,
+        0 if args.seed is None else args.seed,
+    )
+    result = abc.run(args.generations, args.min_epsilon, args.max_simulations)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(result, f)
+    summary = ["posterior_mean", "best", "best_distance", "epsilons"]
+    summary += ["simulations", "abandoned"]
+    print(json.dumps({key: result[key] for key in summary}))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+"""Seeded agreement check of an engine against the agent engine.
+
+Every scenario runs over the same fixed seeds on both engines. The engines draw
+their random numbers differently, so runs are not compared one to one. Instead,
+the mean of each summary metric must agree within `--z` standard errors of the
+difference of the means. Exits with status 1 if any metric disagrees:
+
+    python check_engines.py --engine vectorized
+    python check_engines.py --engine hybrid --seeds 48
+"""
+
+import argparse
+import math
+import statistics
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+from runner import run_model
+
+BASE_PARAMS = {"num_agents": 400, "width": 25, "height": 25}
+# social distancing takes its own code path in every engine
+SCENARIOS = [{"social_distance": distance} for distance in (0, 1, 2)]
+METRICS = ["peak_infected", "Deceased", "Recovered"]
+
+
+def _run(job: tuple) -> dict:
+    params, seed, engine, max_steps = job
+    return run_model(params, max_steps, seed, engine)["summary"]
+
+
+def disagreements(
+    reference: list[dict], candidate: list[dict], z: float = 3.0
+) -> list[str]:
+    """Metrics whose means differ by more than z standard errors"""
+    found = []
+    for metric in METRICS:
+        a = [summary[metric] for summary in reference]
+        b = [summary[metric] for summary in candidate]
+        variance = statistics.variance(a) + statistics.variance(b)
+        error = max(math.sqrt(variance / len(a)), 1e-9)
+        difference = statistics.mean(b) - statistics.mean(a)
+        if abs(difference) > z * error:
+            found.append(
+                f"{metric}: {statistics.mean(b):.1f} against "
+                f"{statistics.mean(a):.1f} ({difference / error:+.1f} standard errors)"
+            )
+    return found
+
+
+def check_engine(
+    engine: str,
+    seeds: int = 24,
+    z: float = 3.0,
+    max_steps: int | None = 300,
+    processes: int | None = None,
+    verbose: bool = True,
+) -> list[str]:
+    """Disagreements of the engine with the agent engine over all scenarios"""
+    found = []
+    with ProcessPoolExecutor(processes) as executor:
+        for scenario in SCENARIOS:
+            params = {**BASE_PARAMS, **scenario}
+            runs = {}
+            for name in ("agent", engine):
+                jobs = [(params, seed, name, max_steps) for seed in range(seeds)]
+                runs[name] = list(executor.map(_run, jobs))
+            scenario_found = disagreements(runs["agent"], runs[engine], z)
+            if verbose:
+                peaks = {
+                    name: statistics.mean(s["peak_infected"] for s in runs[name])
+                    for name in runs
+                }
+                print(
+                    f"{scenario}: peak infected {peaks[engine]:.1f} "
+                    f"against {peaks['agent']:.1f}"
+                )
+            found += [f"{scenario} {message}" for message in scenario_found]
+    return found
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("-e", "--engine", default="vectorized")
+    parser.add_argument("--seeds", type=int, default=24)
+    parser.add_argument("--z", type=float, default=3.0)
+    parser.add_argument("-n", "--steps", type=int, default=300)
+    parser.add_argument("-j", "--processes", type=int)
+    args = parser.parse_args(argv)
+
+    found = check_engine(args.engine, args.seeds, args.z, args.steps, args.processes)
+    for message in found:
+        print(f"DISAGREEMENT {message}")
+    print(f"{len(found)} disagreements with the agent engine")
+    return 1 if found else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,148 @@
+import glob
+import json
+import os
+from typing import Callable, Iterator
+
+import numpy as np
+
+
+class SeriesView:
+    """Read-only, list-like view of one column of a ColumnarDataCollector"""
+
+    def __init__(self, collector: "ColumnarDataCollector", column: int) -> None:
+        self.collector = collector
+        self.column = column
+
+    def __len__(self) -> int:
+        return len(self.collector)
+
+    def __getitem__(self, index):
+        if isinstance(index, int) and index in (-1, len(self) - 1):
+            # latest value, as read by the chart modules on every render
+            return int(self.collector.last[self.column])
+        return self.collector.values(self.column)[index].tolist()
+
+    def __iter__(self) -> Iterator[int]:
+        return iter(self.collector.values(self.column).tolist())
+
+
+class ColumnarDataCollector:
+    """Model-level DataCollector that stores its series in typed arrays.
+
+    Values are written to a preallocated chunk of chunk_size rows. Full chunks
+    are flushed to path as one .npy file each, with one contiguous column per
+    reporter, or kept in memory when no path is given. Only every
+    sample_interval-th call to collect records a row.
+    """
+
+    def __init__(
+        self,
+        model_reporters: dict[str, Callable],
+        path: str | None = None,
+        chunk_size: int = 4096,
+        sample_interval: int = 1,
+        dtype: type = np.int64,
+    ) -> None:
+        self.model_reporters = model_reporters
+        self.names = list(model_reporters)
+        self.path = path
+        self.chunk_size = chunk_size
+        self.sample_interval = sample_interval
+        self.dtype = dtype
+        self.last = np.zeros(len(self.names), dtype=dtype)
+        self.model_vars = {
+            name: SeriesView(self, column) for column, name in enumerate(self.names)
+        }
+        self._buffer = np.zeros((len(self.names), chunk_size), dtype=dtype)
+        self._filled = 0
+        self._chunks: list[np.ndarray] = []
+        self._num_chunks = 0
+        self._calls = 0
+
+        if path is not None:
+            os.makedirs(path, exist_ok=True)
+            for chunk in glob.glob(os.path.join(path, "chunk_*.npy")):
+                os.remove(chunk)
+            with open(os.path.join(path, "columns.json"), "w") as f:
+                json.dump(self.names, f)
+
+    def __len__(self) -> int:
+        return self._num_chunks * self.chunk_size + self._filled
+
+    def collect(self, model) -> None:
+        """Record the current value of every reporter"""
+        self._calls += 1
+        if (self._calls - 1) % self.sample_interval != 0:
+            return
+        for column, reporter in enumerate(self.model_reporters.values()):
+            self.last[column] = reporter(model)
+        self._buffer[:, self._filled] = self.last
+        self._filled += 1
+        if self._filled == self.chunk_size:
+            self.flush()
+
+    def flush(self) -> None:
+        """Write the buffered rows out as a chunk.
+        A partial chunk is written to disk as well and rewritten until it is full.
+        """
+        if self._filled < self.chunk_size:
+            if self._filled > 0 and self.path is not None:
+                partial = self._buffer[:, : self._filled]
+                np.save(self._chunk_path(self._num_chunks), partial)
+            return
+        if self.path is None:
+            self._chunks.append(self._buffer.copy())
+        else:
+            np.save(self._chunk_path(self._num_chunks), self._buffer)
+        self._num_chunks += 1
+        self._filled = 0
+
+    def history(self) -> np.ndarray:
+        """All recorded rows, one row per reporter"""
+        return np.stack([self.values(column) for column in range(len(self.names))])
+
+    def load_history(self, history: np.ndarray, calls: int) -> None:
+        """Replace the recorded rows, e.g. when restoring a snapshot"""
+        self._chunks = []
+        self._num_chunks = 0
+        self._filled = 0
+        for start in range(0, history.shape[1], self.chunk_size):
+            rows = history[:, start : start + self.chunk_size]
+            self._buffer[:, : rows.shape[1]] = rows
+            self._filled = rows.shape[1]
+            self.flush()
+        if history.shape[1] > 0:
+            self.last[:] = history[:, -1]
+        self._calls = calls
+
+    def _chunk_path(self, index: int) -> str:
+        return os.path.join(self.path, f"chunk_{index:06d}.npy")
+
+    def values(self, column: int) -> np.ndarray:
+        """Full series of one reporter"""
+        if self.path is None:
+            chunks = [chunk[column] for chunk in self._chunks]
+        else:
+            chunks = [
+                np.load(self._chunk_path(i), mmap_mode="r")[column]
+                for i in range(self._num_chunks)
+            ]
+        return np.concatenate(chunks + [self._buffer[column, : self._filled]])
+
+    def get_model_vars_dataframe(self):
+        """Create a pandas DataFrame from the model variables."""
+        import pandas as pd
+
+        return pd.DataFrame(
+            {name: self.values(column) for column, name in enumerate(self.names)}
+        )
+
+
+def load_collector(path: str) -> dict[str, np.ndarray]:
+    """Read the series of a collector that was flushed to path"""
+    with open(os.path.join(path, "columns.json")) as f:
+        names = json.load(f)
+    files = sorted(glob.glob(os.path.join(path, "chunk_*.npy")))
+    chunks = [np.load(chunk) for chunk in files]
+    data = np.concatenate(chunks, axis=1) if chunks else np.zeros((len(names), 0))
+    return dict(zip(names, data))
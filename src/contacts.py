@@ -0,0 +1,258 @@
+"""Contact layers: fixed contact networks such as households, workplaces and
+schools, next to the same-cell contact on the grid.
+
+A layer is a compressed sparse row adjacency over the agent ids: the contacts of
+agent i are indices[indptr[i]:indptr[i + 1]]. In every contact phase, each
+infected agent that is not isolated infects each of its contacts with chance
+weight * its infection rate. A susceptible agent gets a single draw against its
+combined chance from its cellmates and all layers. Only the edges of the
+infected agents are visited, so a step costs their degree, not the size of the
+network.
+
+A contact layers file is a directory with an indptr and an indices array per
+layer and a meta.json with the layer weights. Loading memory-maps the arrays.
+"""
+
+import argparse
+import hashlib
+import json
+import os
+
+import numpy as np
+
+from population import Population, read_meta
+
+# ages (inclusive) of the agents that go to work and to school
+WORK_AGES = (20, 64)
+SCHOOL_AGES = (5, 19)
+
+# number of agents whose rows are built at once
+LAYER_CHUNK_SIZE = 1 << 18
+
+
+class ContactLayer:
+    """One contact network in compressed sparse row form"""
+
+    def __init__(
+        self, name: str, indptr: np.ndarray, indices: np.ndarray, weight: float
+    ) -> None:
+        if indptr[-1] != len(indices):
+            raise ValueError(f"layer {name} has {len(indices)} of {indptr[-1]} edges")
+        self.name = name
+        self.indptr = indptr
+        self.indices = indices
+        self.weight = weight
+
+    def __len__(self) -> int:
+        """Number of agents the layer covers"""
+        return len(self.indptr) - 1
+
+    @property
+    def num_edges(self) -> int:
+        return len(self.indices)
+
+    def edges_of(self, sources: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """Contacts of the given agents, and the position in sources each
+        contact belongs to
+        """
+        starts = self.indptr[sources]
+        degree = self.indptr[sources + 1] - starts
+        offsets = row_offsets(starts, degree)
+        return self.indices[offsets], np.repeat(np.arange(len(sources)), degree)
+
+
+def row_offsets(starts: np.ndarray, lengths: np.ndarray) -> np.ndarray:
+    """Concatenated ranges [starts[i], starts[i] + lengths[i])"""
+    ends = np.cumsum(lengths)
+    total = int(ends[-1]) if len(ends) else 0
+    return np.repeat(starts - (ends - lengths), lengths) + np.arange(total)
+
+
+def groups_to_layer(name: str, groups: np.ndarray, weight: float) -> ContactLayer:
+    """Layer in which the agents of each group all contact each other.
+    groups holds the group of every agent, or -1 for agents in no group.
+    """
+    members = np.flatnonzero(groups >= 0)
+    members = members[np.argsort(groups[members], kind="stable")]
+    group = groups[members]
+    starts = np.flatnonzero(np.r_[True, group[1:] != group[:-1]])
+    sizes = np.diff(np.r_[starts, len(members)])
+    # position of each agent's group among the sorted groups
+    label = np.full(len(groups), -1, dtype=np.int64)
+    label[members] = np.repeat(np.arange(len(starts)), sizes)
+
+    degree = np.zeros(len(groups), dtype=np.int64)
+    grouped = np.flatnonzero(label >= 0)
+    degree[grouped] = sizes[label[grouped]] - 1
+    indptr = np.concatenate([[0], np.cumsum(degree)])
+    indices = np.empty(indptr[-1], dtype=np.int32)
+    # the rows are filled in chunks of agents to bound the temporary arrays
+    for chunk in range(0, len(grouped), LAYER_CHUNK_SIZE):
+        agents = grouped[chunk : chunk + LAYER_CHUNK_SIZE]
+        row = label[agents]
+        targets = members[row_offsets(starts[row], sizes[row])]
+        own = targets != np.repeat(agents, sizes[row])
+        indices[indptr[agents[0]] : indptr[agents[-1] + 1]] = targets[own]
+    return ContactLayer(name, indptr, indices, weight)
+
+
+class ContactLayers:
+    """The contact layers of a model"""
+
+    def __init__(self, layers: list[ContactLayer], digest: str | None = None) -> None:
+        sizes = {len(layer) for layer in layers}
+        if len(sizes) > 1:
+            raise ValueError("contact layers cover different numbers of agents")
+        self.layers = layers
+        self.digest = digest
+
+    def __len__(self) -> int:
+        """Number of agents the layers cover"""
+        return len(self.layers[0]) if self.layers else 0
+
+    def log_escape(
+        self, sources: np.ndarray, rates: np.ndarray, count: int
+    ) -> np.ndarray:
+        """Log of the chance of each of count agents to escape infection along the
+        layers, from the given infected agents with the given infection rates
+        """
+        log_escape = np.zeros(max(count, len(self)))
+        # agents added after the layers were built have no contacts
+        covered = sources < len(self)
+        sources, rates = sources[covered], rates[covered]
+        if len(sources) == 0:
+            return log_escape
+        for layer in self.layers:
+            if layer.weight <= 0:
+                continue
+            chance = np.clip(layer.weight * rates, 0.0, 1.0)
+            targets, source = layer.edges_of(sources)
+            if len(targets) == 0:
+                continue
+            with np.errstate(divide="ignore"):
+                log_escape += np.bincount(
+                    targets,
+                    weights=np.log1p(-chance)[source],
+                    minlength=len(log_escape),
+                )
+        return log_escape
+
+    def save(self, path: str) -> None:
+        """Write the layers to a contact layers file"""
+        os.makedirs(path, exist_ok=True)
+        digest = hashlib.sha256()
+        for layer in self.layers:
+            for part in ("indptr", "indices"):
+                array = np.ascontiguousarray(getattr(layer, part))
+                digest.update(f"{layer.name}.{part}".encode())
+                digest.update(array.tobytes())
+                np.save(os.path.join(path, f"{layer.name}.{part}.npy"), array)
+        weights = {layer.name: layer.weight for layer in self.layers}
+        digest.update(json.dumps(weights, sort_keys=True).encode())
+        self.digest = digest.hexdigest()
+        meta = {"weights": weights, "digest": self.digest}
+        # the meta file comes last, so layers without one are incomplete
+        with open(os.path.join(path, "meta.json"), "w") as f:
+            json.dump(meta, f)
+
+    @classmethod
+    def load(
+        cls, path: str, weights: dict[str, float] | None = None, mmap: bool = True
+    ) -> "ContactLayers":
+        """Read a contact layers file, memory-mapping its arrays unless mmap is off.
+        weights overrides the stored weights of some layers.
+        """
+        meta = read_meta(path)
+        weights = {**meta["weights"], **(weights or {})}
+        unknown = set(weights) - set(meta["weights"])
+        if unknown:
+            raise ValueError(f"Unknown contact layers: {', '.join(sorted(unknown))}")
+        mode = "r" if mmap else None
+        layers = [
+            ContactLayer(
+                name,
+                np.load(os.path.join(path, f"{name}.indptr.npy"), mmap_mode=mode),
+                np.load(os.path.join(path, f"{name}.indices.npy"), mmap_mode=mode),
+                weight,
+            )
+            for name, weight in weights.items()
+        ]
+        return cls(layers, meta["digest"])
+
+
+def random_groups(
+    rng: np.random.Generator, eligible: np.ndarray, mean_size: float
+) -> np.ndarray:
+    """Assign the eligible agents to groups of the given mean size at random"""
+    groups = np.full(len(eligible), -1, dtype=np.int64)
+    count = int(np.count_nonzero(eligible))
+    num_groups = max(1, round(count / mean_size))
+    groups[eligible] = rng.integers(0, num_groups, count)
+    return groups
+
+
+def draw_layers(
+    age: np.ndarray,
+    household_size: float = 3.0,
+    workplace_size: float = 20.0,
+    school_size: float = 25.0,
+    household_weight: float = 0.1,
+    workplace_weight: float = 0.01,
+    school_weight: float = 0.01,
+    seed: int | None = None,
+) -> ContactLayers:
+    """Households of everyone, workplaces of the working ages and schools of the
+    school ages, for agents of the given ages
+    """
+    rng = np.random.default_rng(seed)
+    everyone = np.ones(len(age), dtype=bool)
+    working = (age >= WORK_AGES[0]) & (age < WORK_AGES[1] + 1)
+    schooling = (age >= SCHOOL_AGES[0]) & (age < SCHOOL_AGES[1] + 1)
+    return ContactLayers(
+        [
+            groups_to_layer(
+                "households",
+                random_groups(rng, everyone, household_size),
+                household_weight,
+            ),
+            groups_to_layer(
+                "workplaces",
+                random_groups(rng, working, workplace_size),
+                workplace_weight,
+            ),
+            groups_to_layer(
+                "schools", random_groups(rng, schooling, school_size), school_weight
+            ),
+        ]
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Draw households, workplaces and schools for a population file"
+    )
+    parser.add_argument("path", help="output directory")
+    parser.add_argument("--population", required=True, help="population file")
+    parser.add_argument("--household_size", type=float, default=3.0)
+    parser.add_argument("--workplace_size", type=float, default=20.0)
+    parser.add_argument("--school_size", type=float, default=25.0)
+    parser.add_argument("--household_weight", type=float, default=0.1)
+    parser.add_argument("--workplace_weight", type=float, default=0.01)
+    parser.add_argument("--school_weight", type=float, default=0.01)
+    parser.add_argument("-s", "--seed", type=int)
+    args = parser.parse_args()
+
+    population = Population.load(args.population)
+    layers = draw_layers(
+        population.arrays["age"],
+        args.household_size,
+        args.workplace_size,
+        args.school_size,
+        args.household_weight,
+        args.workplace_weight,
+        args.school_weight,
+        args.seed,
+    )
+    layers.save(args.path)
+    for layer in layers.layers:
+        print(f"{layer.name}: {layer.num_edges} edges")
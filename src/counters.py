@@ -0,0 +1,76 @@
+from agent import State
+import numpy as np
+
+NUM_STATES = 5
+NUM_AGE_BINS = 10
+
+
+def age_bin(age: float) -> int | None:
+    """Index of the 10-year bin the age falls into, if any.
+    Bins are inclusive on both ends ([0, 9], [10, 19], ...), like InfectionModel.count_age.
+    """
+    index = int(age // 10)
+    if age <= index * 10 + 9 and index < NUM_AGE_BINS:
+        return index
+    return None
+
+
+class PopulationCounters:
+    """Population tallies kept up to date by the agents as they change.
+
+    Per-state counts cover every agent, while the age, mask and vaccination
+    tallies only cover living agents, matching the collector reporters.
+    """
+
+    def __init__(self) -> None:
+        self.state = [0] * NUM_STATES
+        self.age = [0] * NUM_AGE_BINS
+        self.mask = [0, 0]
+        self.vaccinated = [0, 0]
+
+    def add(self, agent) -> None:
+        """Start tracking an agent"""
+        self.state[agent.state] += 1
+        if agent.state != State.DECEASED:
+            self._count_living(agent, 1)
+
+    def add_susceptible(self, age: np.ndarray, wear_mask: np.ndarray) -> None:
+        """Start tracking new susceptible, unvaccinated agents in bulk"""
+        self.state[State.SUSCEPTIBLE] += len(age)
+        index = (age // 10).astype(np.int64)
+        binned = (age <= index * 10 + 9) & (index < NUM_AGE_BINS)
+        counts = np.bincount(index[binned], minlength=NUM_AGE_BINS)
+        self.age = [a + c for a, c in zip(self.age, counts.tolist())]
+        masked = int(np.count_nonzero(wear_mask))
+        self.mask[True] += masked
+        self.mask[False] += len(age) - masked
+        self.vaccinated[False] += len(age)
+
+    def update_state(self, agent, old: int, new: int) -> None:
+        """Move an agent from one state tally to another"""
+        if old == new:
+            return
+        self.state[old] -= 1
+        self.state[new] += 1
+        if new == State.DECEASED:
+            self._count_living(agent, -1)
+        elif old == State.DECEASED:
+            self._count_living(agent, 1)
+
+    def update_vaccinated(self, agent) -> None:
+        """Record the vaccination of an agent"""
+        if agent.state == State.DECEASED:
+            return
+        self.vaccinated[False] -= 1
+        self.vaccinated[True] += 1
+
+    def _count_living(self, agent, delta: int) -> None:
+        bin = age_bin(agent.age)
+        if bin is not None:
+            self.age[bin] += delta
+        self.mask[bool(agent.wear_mask)] += delta
+        self.vaccinated[agent.vaccinated] += delta
+
+    def count_age(self, minAge: int, maxAge: int) -> int:
+        """Count living agents in the 10-year bins between minAge and maxAge"""
+        return sum(self.age[minAge // 10 : maxAge // 10 + 1])
@@ -0,0 +1,233 @@
+"""Monte Carlo ensembles: replicates of one or more parameter sets, summarized
+as per-tick mean and quantile bands of every collector series.
+
+Replicates are added in batches on a process pool until the confidence
+interval of a chosen metric is tight enough. Replicate r of every setting uses
+the same seed, so compared settings share their random numbers (common random
+numbers) and their differences are estimated from paired runs.
+
+    python ensemble.py --num_agents 500 --metric Deceased --tolerance 0.05
+"""
+
+import json
+import math
+import os
+import statistics
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Callable
+
+import numpy as np
+
+from runner import COLLECTORS, run_model
+
+QUANTILES = (0.05, 0.25, 0.5, 0.75, 0.95)
+
+
+def replicate_seed(seed: int, replicate: int) -> int:
+    """Seed of a replicate; independent of the parameters, for common random numbers"""
+    return int(np.random.SeedSequence([seed, replicate]).generate_state(1)[0])
+
+
+def t_quantile(p: float, df: int) -> float:
+    """Quantile of Student's t distribution (Cornish-Fisher expansion around the
+    normal quantile, accurate to about 1e-3 from 5 degrees of freedom up)
+    """
+    z = statistics.NormalDist().inv_cdf(p)
+    return (
+        z
+        + (z**3 + z) / (4 * df)
+        + (5 * z**5 + 16 * z**3 + 3 * z) / (96 * df**2)
+        + (3 * z**7 + 19 * z**5 + 17 * z**3 - 15 * z) / (384 * df**3)
+    )
+
+
+def confidence_interval(values: list[float], confidence: float = 0.95) -> dict:
+    """Mean of the values and the half width of its confidence interval"""
+    mean = statistics.fmean(values)
+    if len(values) < 2:
+        return {"mean": mean, "half_width": math.inf}
+    t = t_quantile(0.5 + confidence / 2, len(values) - 1)
+    half_width = t * statistics.stdev(values) / math.sqrt(len(values))
+    return {"mean": mean, "half_width": half_width}
+
+
+def metric_value(result: dict, metric: str | Callable[[dict], float]) -> float:
+    """A summary value of a run, e.g. "peak_infected" or "Deceased", or a function of it"""
+    if callable(metric):
+        return float(metric(result))
+    return float(result["summary"][metric])
+
+
+def bands(series: list[list[int]], quantiles=QUANTILES) -> dict[str, list[float]]:
+    """Per-tick mean and quantiles of the series of several runs.
+    Runs that ended early keep their last value, as their model does.
+    """
+    length = max(len(values) for values in series)
+    padded = np.array(
+        [values + values[-1:] * (length - len(values)) for values in series],
+        dtype=np.float64,
+    )
+    result = {"mean": padded.mean(axis=0).tolist()}
+    for q, values in zip(quantiles, np.quantile(padded, quantiles, axis=0)):
+        result[f"q{round(q * 100):02d}"] = values.tolist()
+    return result
+
+
+def _run(job: tuple) -> dict:
+    params, seed, max_steps, engine, cache = job
+    return run_model(params, max_steps, seed, engine, cache=cache)
+
+
+def summarize(
+    runs: list[dict], metric, confidence: float, quantiles=QUANTILES
+) -> dict[str, Any]:
+    values = [metric_value(run, metric) for run in runs]
+    return {
+        "replicates": len(runs),
+        "metric": {**confidence_interval(values, confidence), "values": values},
+        "series": {
+            name: {
+                label: bands([run["series"][name][label] for run in runs], quantiles)
+                for label in runs[0]["series"][name]
+            }
+            for name in COLLECTORS
+        },
+    }
+
+
+def is_tight(interval: dict, tolerance: float, absolute_tolerance: float) -> bool:
+    """Whether the half width is within tolerance of the mean, or absolute_tolerance"""
+    limit = max(tolerance * abs(interval["mean"]), absolute_tolerance)
+    return interval["half_width"] <= limit
+
+
+def compare(
+    settings: dict[str, dict],
+    metric: str | Callable[[dict], float] = "peak_infected",
+    tolerance: float = 0.05,
+    absolute_tolerance: float = 1.0,
+    confidence: float = 0.95,
+    min_replicates: int = 10,
+    max_replicates: int = 200,
+    batch_size: int | None = None,
+    max_steps: int | None = 200,
+    seed: int = 0,
+    engine: str = "agent",
+    processes: int | None = None,
+    quantiles=QUANTILES,
+    cache=None,
+) -> dict[str, Any]:
+    """Run ensembles of several named parameter sets with common random numbers.
+
+    Batches of replicates are added until, for every setting, the confidence
+    interval of the metric is within tolerance (relative to its mean) or
+    absolute_tolerance, or max_replicates is reached. Every setting after the
+    first also gets the paired difference of its metric to the first setting.
+    Replicates are reused from a cache.ResultCache if one is given.
+    """
+    if batch_size is None:
+        batch_size = processes or os.cpu_count()
+    runs = {name: [] for name in settings}
+    done = 0
+    with ProcessPoolExecutor(processes) as executor:
+        while done < max_replicates:
+            count = min(max(batch_size, min_replicates - done), max_replicates - done)
+            jobs = [
+                (params, replicate_seed(seed, replicate), max_steps, engine, cache)
+                for replicate in range(done, done + count)
+                for params in settings.values()
+            ]
+            # map keeps the job order: replicate by replicate, setting by setting
+            results = iter(executor.map(_run, jobs))
+            for _ in range(count):
+                for name in settings:
+                    runs[name].append(next(results))
+            done += count
+
+            intervals = [
+                confidence_interval(
+                    [metric_value(run, metric) for run in runs[name]], confidence
+                )
+                for name in settings
+            ]
+            if done >= min_replicates and all(
+                is_tight(interval, tolerance, absolute_tolerance)
+                for interval in intervals
+            ):
+                break
+
+    summaries = {
+        name: {
+            "params": settings[name],
+            **summarize(runs[name], metric, confidence, quantiles),
+        }
+        for name in settings
+    }
+    reference, *others = settings
+    reference_values = summaries[reference]["metric"]["values"]
+    for name in others:
+        values = summaries[name]["metric"]["values"]
+        differences = [a - b for a, b in zip(values, reference_values)]
+        summaries[name]["difference"] = confidence_interval(differences, confidence)
+    converged = all(
+        is_tight(summary["metric"], tolerance, absolute_tolerance)
+        for summary in summaries.values()
+    )
+    return {"replicates": done, "converged": converged, "settings": summaries}
+
+
+def ensemble(params: dict, **options) -> dict[str, Any]:
+    """Run replicates of one parameter set until the metric's confidence interval
+    is tight enough; options are those of compare
+    """
+    result = compare({"ensemble": params}, **options)
+    return {"converged": result["converged"], **result["settings"]["ensemble"]}
+
+
+def main(argv: list[str] | None = None) -> None:
+    from run import add_cache_arguments, build_parser, open_cache, parse_args
+
+    parser = build_parser(__doc__)
+    add_cache_arguments(parser)
+    parser.add_argument("-m", "--metric", default="peak_infected")
+    parser.add_argument("--tolerance", type=float, default=0.05)
+    parser.add_argument("--absolute-tolerance", type=float, default=1.0)
+    parser.add_argument("--confidence", type=float, default=0.95)
+    parser.add_argument("--min-replicates", type=int, default=10)
+    parser.add_argument("--max-replicates", type=int, default=200)
+    parser.add_argument("-j", "--processes", type=int)
+    args, params = parse_args(sys.argv[1:] if argv is None else argv, parser)
+
+    result = ensemble(
+        params,
+        metric=args.metric,
+        tolerance=args.tolerance,
+        absolute_tolerance=args.absolute_tolerance,
+        confidence=args.confidence,
+        min_replicates=args.min_replicates,
+        max_replicates=args.max_replicates,
+        max_steps=200 if args.steps is None else args.steps,
+        seed=0 if args.seed is None else args.seed,
+        engine=args.engine,
+        processes=args.processes,
+        cache=open_cache(args),
+    )
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(result, f)
+    metric = result["metric"]
+    print(
+        json.dumps(
+            {
+                "replicates": result["replicates"],
+                "converged": result["converged"],
+                args.metric: metric["mean"],
+                "half_width": metric["half_width"],
+            }
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
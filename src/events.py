@@ -0,0 +1,46 @@
+from typing import Iterator
+
+# kinds of transitions, in the order they fire within a tick
+ISOLATE = 0
+DIE = 1
+RECOVER = 2
+RELEASE = 0
+
+
+class TransitionQueue:
+    """Calendar queue of timed agent transitions, bucketed by the tick they fire at.
+
+    Each bucket holds one list of agents per kind of transition. Transitions are
+    not removed when an agent changes state in the meantime. Instead, the model
+    checks that they still apply when they fire.
+    """
+
+    def __init__(self, kinds: int) -> None:
+        self.kinds = kinds
+        self._calendar: dict[int, list[list]] = {}
+
+    def push(self, tick: int, kind: int, agent) -> None:
+        """Queue a transition of an agent at the given tick"""
+        bucket = self._calendar.get(tick)
+        if bucket is None:
+            bucket = self._calendar[tick] = [[] for _ in range(self.kinds)]
+        bucket[kind].append(agent)
+
+    def pop(self, tick: int) -> list[list]:
+        """Remove and return the agents of every kind due at the given tick"""
+        bucket = self._calendar.pop(tick, None)
+        if bucket is None:
+            return [[] for _ in range(self.kinds)]
+        return bucket
+
+    def entries(self) -> Iterator[tuple[int, int, object]]:
+        """(tick, kind, agent) of every queued transition, in firing order"""
+        for tick in sorted(self._calendar):
+            for kind, agents in enumerate(self._calendar[tick]):
+                for agent in agents:
+                    yield tick, kind, agent
+
+    def __len__(self) -> int:
+        return sum(
+            len(agents) for bucket in self._calendar.values() for agents in bucket
+        )
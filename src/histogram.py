@@ -0,0 +1,59 @@
+import numpy as np
+
+
+class BinnedHistogram:
+    """Fixed-width histogram with cumulative counts for O(1) range queries.
+
+    Bin k covers [start + k * bin_width, start + (k + 1) * bin_width - 1]. Values
+    below start are counted in the first bin and values past the last regular
+    bin in a final open-ended bin.
+    """
+
+    def __init__(self, start: int = 1, bin_width: int = 3, num_bins: int = 10) -> None:
+        self.start = start
+        self.bin_width = bin_width
+        self.num_bins = num_bins
+        self.counts = np.zeros(num_bins + 1, dtype=np.int64)
+        # cumulative[k] is the number of values in the bins before bin k
+        self.cumulative = np.zeros(num_bins + 2, dtype=np.int64)
+
+    def labels(self) -> list[str]:
+        """Labels of the regular bins followed by the open-ended bin"""
+        labels = [
+            f"{low}-{low + self.bin_width - 1}"
+            for low in range(self.start, self.end, self.bin_width)
+        ]
+        return labels + [f"{self.end}+"]
+
+    @property
+    def end(self) -> int:
+        """First value of the open-ended bin"""
+        return self.start + self.num_bins * self.bin_width
+
+    def bin(self, value: int) -> int:
+        """Index of the bin the value falls into"""
+        index = (value - self.start) // self.bin_width
+        return min(max(index, 0), self.num_bins)
+
+    def add(self, value: int, count: int = 1) -> None:
+        index = self.bin(value)
+        self.counts[index] += count
+        self.cumulative[index + 1 :] += count
+
+    def set_counts(self, counts: np.ndarray) -> None:
+        self.counts[:] = counts
+        self.cumulative[1:] = np.cumsum(self.counts)
+
+    def add_many(self, values: np.ndarray) -> None:
+        indices = np.clip((values - self.start) // self.bin_width, 0, self.num_bins)
+        counts = np.bincount(indices, minlength=self.num_bins + 1)
+        self.counts += counts
+        self.cumulative[1:] += np.cumsum(counts)
+
+    def count_bins(self, first: int, last: int) -> int:
+        """Number of values in bins first through last"""
+        return int(self.cumulative[last + 1] - self.cumulative[first])
+
+    def count_range(self, low: int, high: int) -> int:
+        """Number of values in the bins covering low through high"""
+        return self.count_bins(self.bin(low), self.bin(high))
@@ -0,0 +1,842 @@
+import math
+
+import numpy as np
+from mesa.model import Model
+
+from agent import State
+from population import (
+    RECOVERY_AGE_EDGES,
+    RECOVERY_TIME_HIGH,
+    RECOVERY_TIME_LOW,
+    scale_recovery_times,
+)
+from vectorized import (
+    MOORE_DX,
+    MOORE_DY,
+    VectorizedInfectionModel,
+    draw_recovery_times,
+    infection_rates,
+)
+
+# per-agent arrays of VectorizedInfectionModel
+AGENT_FIELDS = [
+    "state",
+    "age",
+    "wear_mask",
+    "vaccinated",
+    "is_medic",
+    "infection_time",
+    "recovery_time",
+    "isolation_time",
+    "x",
+    "y",
+]
+
+# age classes: the ranges between the bounds of the age collector brackets and of
+# the recovery time brackets, so each class lies within one of each
+AGE_BOUNDS = np.unique(
+    np.concatenate(
+        [np.arange(0, 100, 10), np.arange(9, 100, 10), RECOVERY_AGE_EDGES, [99]]
+    )
+)
+AGE_LOW = AGE_BOUNDS[:-1]
+AGE_HIGH = AGE_BOUNDS[1:]
+NUM_AGE_CLASSES = len(AGE_LOW)
+# recovery time bracket of every age class
+AGE_CLASS_BRACKET = np.searchsorted(RECOVERY_AGE_EDGES, (AGE_LOW + AGE_HIGH) / 2)
+
+# kinds of agents: 2 * wear_mask + vaccinated
+NUM_KINDS = 4
+UNVACCINATED_KINDS = [0, 2]
+
+
+def age_classes(age: np.ndarray) -> np.ndarray:
+    """Age class of every age"""
+    index = np.searchsorted(AGE_BOUNDS, age, side="right") - 1
+    return np.clip(index, 0, NUM_AGE_CLASSES - 1)
+
+
+def sample_counts(rng: np.random.Generator, counts: np.ndarray, count: int):
+    """Numbers of count items drawn without replacement from bins holding the
+    given numbers of items; cheaper than a multivariate hypergeometric draw when
+    there are many bins
+    """
+    picked = rng.choice(int(counts.sum()), count, replace=False)
+    bins = np.searchsorted(np.cumsum(counts), picked, side="right")
+    return np.bincount(bins, minlength=len(counts))
+
+
+def draw_class_counts(rng: np.random.Generator, pool: np.ndarray, count: int):
+    """Age classes of count agents drawn without replacement from a pool of class
+    counts; the pool is updated in place
+    """
+    drawn = rng.multivariate_hypergeometric(pool, count)
+    pool -= drawn
+    return drawn
+
+
+def spread_evenly(totals: np.ndarray, groups: np.ndarray) -> np.ndarray:
+    """Split totals[g] over the items of group g as evenly as integers allow,
+    giving the remainder to the first items of each group
+    """
+    sizes = np.bincount(groups, minlength=len(totals))
+    order = np.argsort(groups, kind="stable")
+    rank = np.empty(len(groups), dtype=np.int64)
+    rank[order] = np.arange(len(groups)) - np.repeat(np.cumsum(sizes) - sizes, sizes)
+    share, remainder = np.divmod(totals, np.maximum(sizes, 1))
+    return share[groups] + (rank < remainder[groups])
+
+
+def recovery_time_chances(multiplier: float) -> np.ndarray:
+    """Chance of every recovery time, after the multiplier, for each age class"""
+    longest = int(scale_recovery_times(RECOVERY_TIME_HIGH, multiplier).max())
+    chances = np.zeros((NUM_AGE_CLASSES, longest + 1))
+    for age_class, bracket in enumerate(AGE_CLASS_BRACKET):
+        base = np.arange(RECOVERY_TIME_LOW[bracket], RECOVERY_TIME_HIGH[bracket] + 1)
+        np.add.at(
+            chances[age_class], scale_recovery_times(base, multiplier), 1 / len(base)
+        )
+    return chances
+
+
+def take_within_groups(
+    rng: np.random.Generator,
+    groups: np.ndarray,
+    counts: np.ndarray,
+    taken: np.ndarray,
+) -> np.ndarray:
+    """Numbers of items taken from each row when taken[g] items are drawn without
+    replacement from the rows of group g, which hold counts items
+    """
+    result = np.zeros(len(counts), dtype=np.int64)
+    order = np.argsort(groups, kind="stable")
+    bounds = np.searchsorted(groups[order], np.arange(len(taken) + 1))
+    for group in np.flatnonzero(taken).tolist():
+        rows = order[bounds[group] : bounds[group + 1]]
+        if taken[group] == counts[rows].sum():
+            result[rows] = counts[rows]
+        else:
+            result[rows] = sample_counts(rng, counts[rows], int(taken[group]))
+    return result
+
+
+class CountTable:
+    """Numbers of agents per combination of integer attributes, in parallel
+    arrays that hold one row per combination after compact()
+    """
+
+    def __init__(self, names: list[str]) -> None:
+        self.names = names
+        self.columns = {name: np.zeros(0, dtype=np.int64) for name in names}
+        self.count = np.zeros(0, dtype=np.int64)
+
+    def __len__(self) -> int:
+        return len(self.count)
+
+    def __getitem__(self, name: str) -> np.ndarray:
+        return self.columns[name]
+
+    def add(self, count: np.ndarray, **columns) -> None:
+        """Append rows with the given counts and attributes; an attribute can be a
+        single value for all rows
+        """
+        count = np.asarray(count, dtype=np.int64)
+        added = count > 0
+        for name in self.names:
+            values = np.broadcast_to(columns[name], count.shape)[added]
+            self.columns[name] = np.concatenate([self.columns[name], values])
+        self.count = np.concatenate([self.count, count[added]])
+
+    def compact(self) -> None:
+        """Merge the rows with equal attributes and drop the empty ones"""
+        kept = self.count > 0
+        key = np.zeros(np.count_nonzero(kept), dtype=np.int64)
+        for name in self.names:
+            values = self.columns[name][kept]
+            if len(values) > 0:
+                low = values.min()
+                key = key * (values.max() - low + 1) + (values - low)
+        key, first, inverse = np.unique(key, return_index=True, return_inverse=True)
+        self.count = np.bincount(
+            inverse, weights=self.count[kept], minlength=len(key)
+        ).astype(np.int64)
+        for name in self.names:
+            self.columns[name] = self.columns[name][kept][first]
+
+
+class HybridInfectionModel(VectorizedInfectionModel):
+    """VectorizedInfectionModel that fast-forwards with counts instead of agents
+    while many agents are sick.
+
+    While at least mean_field_threshold agents are infected or isolated, every
+    agent but the travelling agents and medics is folded into counts, which are
+    advanced with binomial and multinomial draws, a tau-leaping update. The model
+    switches back to individual agents once fewer than half that many are sick,
+    so small outbreaks and their extinction are simulated agent by agent.
+
+    The grid is split into squares of region_size cells, and the counted agents
+    of a region are assumed to be spread uniformly over it. The susceptible,
+    infected and isolated agents are counted per region and kind (mask,
+    vaccinated). The ages of the susceptible agents are class counts per kind.
+    The sick agents are also counted per kind, age class, infection time,
+    recovery time and isolation time, which drive isolation, death, recovery and
+    vaccination. The agents these remove from the region counts are drawn
+    uniformly from all regions, so the region counts do not remember when their
+    agents were infected. Recovered and deceased agents are only counted per
+    kind and age class, and get new uniform positions when they are unfolded.
+    Social distancing needs exact positions, so a model with a social distance
+    never fast-forwards.
+    """
+
+    def __init__(
+        self,
+        num_agents: int = 10,
+        num_traveling_agents: int = 0,
+        num_medic_agents: int = 0,
+        width: int = 10,
+        height: int = 10,
+        infection_rate: float = 0.4,
+        death_rate: float = 0.02,
+        start_infection_rate: float = 0.02,
+        wear_mask_chance: float = 0.5,
+        mask_effectiveness: float = 0.5,
+        recovery_time_multiplier: float = 1.0,
+        social_distance: int = 0,
+        social_distance_chance: float = 0.5,
+        isolation_duration: int = 7,
+        isolation_chance: float = 0.1,
+        curing_chance: float = 0.9,
+        vaccine_ready_time: int = 15,
+        vaccine_batch_size: int = 10,
+        vaccine_effectiveness: float = 0.5,
+        dead_occupy_cells: bool = True,
+        mean_field_threshold: int | None = 1000,
+        region_size: int = 4,
+        population: str | None = None,
+        output_dir: str | None = None,
+        sample_interval: int = 1,
+        seed: int | None = None,
+    ) -> None:
+        self.mean_field_threshold = mean_field_threshold
+        self.region_size = region_size
+        self.fast_forward = False
+        super().__init__(
+            num_agents,
+            num_traveling_agents,
+            num_medic_agents,
+            width,
+            height,
+            infection_rate,
+            death_rate,
+            start_infection_rate,
+            wear_mask_chance,
+            mask_effectiveness,
+            recovery_time_multiplier,
+            social_distance,
+            social_distance_chance,
+            isolation_duration,
+            isolation_chance,
+            curing_chance,
+            vaccine_ready_time,
+            vaccine_batch_size,
+            vaccine_effectiveness,
+            dead_occupy_cells,
+            population=population,
+            output_dir=output_dir,
+            sample_interval=sample_interval,
+            seed=seed,
+        )
+        self.recovery_time_chances = recovery_time_chances(recovery_time_multiplier)
+        self.build_regions()
+
+    def build_regions(self) -> None:
+        """Region layout and the chances of moving to each neighbouring region"""
+        size = self.region_size
+        self.regions_x = math.ceil(self.width / size)
+        self.regions_y = math.ceil(self.height / size)
+        num_regions = self.regions_x * self.regions_y
+        # regions along the far edges are cut off by the grid
+        side_x = np.minimum(size, self.width - size * np.arange(self.regions_x))
+        side_y = np.minimum(size, self.height - size * np.arange(self.regions_y))
+        self.region_origin_x = np.repeat(
+            size * np.arange(self.regions_x), self.regions_y
+        )
+        self.region_origin_y = np.tile(size * np.arange(self.regions_y), self.regions_x)
+        self.region_side_x = np.repeat(side_x, self.regions_y)
+        self.region_side_y = np.tile(side_y, self.regions_x)
+        self.region_area = self.region_side_x * self.region_side_y
+
+        # a uniformly placed agent leaves its region along x with chance
+        # 1 / side_x when its step has an x component, and likewise along y
+        offsets = [(ox, oy) for ox in (-1, 0, 1) for oy in (-1, 0, 1)]
+        self.migration = np.zeros((num_regions, len(offsets)))
+        leave_x = 1 / self.region_side_x
+        leave_y = 1 / self.region_side_y
+        for dx, dy in zip(MOORE_DX, MOORE_DY):
+            for ox in {0, dx}:
+                chance_x = 1.0 if dx == 0 else (leave_x if ox else 1 - leave_x)
+                for oy in {0, dy}:
+                    chance_y = 1.0 if dy == 0 else (leave_y if oy else 1 - leave_y)
+                    column = offsets.index((ox, oy))
+                    self.migration[:, column] += chance_x * chance_y / len(MOORE_DX)
+
+        region_x = np.arange(num_regions) // self.regions_y
+        region_y = np.arange(num_regions) % self.regions_y
+        self.migration_target = np.stack(
+            [
+                ((region_x + ox) % self.regions_x) * self.regions_y
+                + (region_y + oy) % self.regions_y
+                for ox, oy in offsets
+            ],
+            axis=1,
+        )
+
+    def region_of(self, x: np.ndarray, y: np.ndarray) -> np.ndarray:
+        """Region of the given cells"""
+        return (x // self.region_size) * self.regions_y + y // self.region_size
+
+    def step(self) -> None:
+        """Advance the model by one step, switching modes first if needed"""
+        if self.mean_field_threshold is not None and self.social_distance == 0:
+            sick = self.count_state(self, State.INFECTED)
+            sick += self.count_state(self, State.ISOLATED)
+            if self.fast_forward and 2 * sick < self.mean_field_threshold:
+                self.unfold()
+            elif not self.fast_forward and sick >= self.mean_field_threshold:
+                self.fold()
+        super().step()
+        if not self.running and self.fast_forward:
+            self.unfold()
+
+    def fold(self) -> None:
+        """Switch to fast-forwarding: count the agents that need not be individual"""
+        individual = np.zeros(len(self.state), dtype=bool)
+        individual[self.travelling_agents] = True
+        individual[self.medic_agents] = True
+        kind = 2 * self.wear_mask.astype(np.int64) + self.vaccinated
+        classes = kind * NUM_AGE_CLASSES + age_classes(self.age)
+        regions = self.region_of(self.x, self.y)
+        size = NUM_KINDS * NUM_AGE_CLASSES
+
+        for name, state in (
+            ("susceptible", State.SUSCEPTIBLE),
+            ("infected", State.INFECTED),
+            ("isolated", State.ISOLATED),
+        ):
+            selected = ~individual & (self.state == state)
+            counts = np.bincount(
+                regions[selected] * NUM_KINDS + kind[selected],
+                minlength=len(self.region_area) * NUM_KINDS,
+            )
+            setattr(self, name, counts.reshape(-1, NUM_KINDS))
+        susceptible = ~individual & (self.state == State.SUSCEPTIBLE)
+        self.susceptible_ages = np.bincount(
+            classes[susceptible], minlength=size
+        ).reshape(NUM_KINDS, -1)
+
+        # the isolation time is -1 while an agent is not isolated
+        sick = ~individual & (
+            (self.state == State.INFECTED) | (self.state == State.ISOLATED)
+        )
+        self.sick_classes = CountTable(
+            ["kind", "age_class", "infection_time", "recovery_time", "isolation_time"]
+        )
+        self.sick_classes.add(
+            np.ones(np.count_nonzero(sick), dtype=np.int64),
+            kind=kind[sick],
+            age_class=age_classes(self.age[sick]),
+            infection_time=self.infection_time[sick],
+            recovery_time=self.recovery_time[sick],
+            isolation_time=np.where(
+                self.state == State.ISOLATED, self.isolation_time, -1
+            )[sick],
+        )
+        self.sick_classes.compact()
+
+        self.recovered_ages = np.zeros((NUM_KINDS, NUM_AGE_CLASSES), dtype=np.int64)
+        self.deceased_ages = np.zeros((NUM_KINDS, NUM_AGE_CLASSES), dtype=np.int64)
+        self.fast_forward = True
+        self.fold_removed(~individual)
+        self.keep_agents(individual)
+
+    def fold_removed(self, agents: np.ndarray) -> None:
+        """Add the recovered and deceased agents of a mask to the class counts"""
+        kind = 2 * self.wear_mask.astype(np.int64) + self.vaccinated
+        classes = kind * NUM_AGE_CLASSES + age_classes(self.age)
+        size = NUM_KINDS * NUM_AGE_CLASSES
+        for state, counts in (
+            (State.RECOVERED, self.recovered_ages),
+            (State.DECEASED, self.deceased_ages),
+        ):
+            selected = agents & (self.state == state)
+            counts += np.bincount(classes[selected], minlength=size).reshape(
+                NUM_KINDS, -1
+            )
+
+    def keep_agents(self, keep: np.ndarray) -> None:
+        """Drop the individual agents outside the mask, renumbering the rest"""
+        new_id = np.cumsum(keep) - 1
+        for field in AGENT_FIELDS:
+            setattr(self, field, getattr(self, field)[keep])
+        self.travelling_agents = new_id[self.travelling_agents]
+        self.medic_agents = new_id[self.medic_agents]
+
+    def unfold(self) -> None:
+        """Switch back to individual agents, drawing positions and ages for the
+        counted ones
+        """
+        kinds, regions, classes, states = [], [], [], []
+        for kind in range(NUM_KINDS):
+            count = int(self.susceptible[:, kind].sum())
+            kinds.append(np.full(count, kind))
+            regions.append(
+                np.repeat(np.arange(len(self.region_area)), self.susceptible[:, kind])
+            )
+            classes.append(
+                self.rng.permutation(
+                    np.repeat(np.arange(NUM_AGE_CLASSES), self.susceptible_ages[kind])
+                )
+            )
+            states.append(np.full(count, State.SUSCEPTIBLE))
+        for state, counts in (
+            (State.RECOVERED, self.recovered_ages),
+            (State.DECEASED, self.deceased_ages),
+        ):
+            for kind in range(NUM_KINDS):
+                count = int(counts[kind].sum())
+                kinds.append(np.full(count, kind))
+                # only living agents keep their region
+                regions.append(np.full(count, -1))
+                classes.append(np.repeat(np.arange(NUM_AGE_CLASSES), counts[kind]))
+                states.append(np.full(count, state))
+        x, y = self.place_in_regions(np.concatenate(regions))
+
+        # pair the sick agents counted in each region at random with the rows of
+        # sick_classes of the same kind and isolation
+        table = self.sick_classes
+        rows = []
+        sick_regions = []
+        for counts, isolated in ((self.infected, False), (self.isolated, True)):
+            for kind in range(NUM_KINDS):
+                selected = (table["kind"] == kind) & (
+                    (table["isolation_time"] >= 0) == isolated
+                )
+                units = np.repeat(np.flatnonzero(selected), table.count[selected])
+                rows.append(self.rng.permutation(units))
+                sick_regions.append(
+                    np.repeat(np.arange(len(self.region_area)), counts[:, kind])
+                )
+        rows = np.concatenate(rows)
+        sick_x, sick_y = self.place_in_regions(np.concatenate(sick_regions))
+        isolation_time = table["isolation_time"][rows]
+
+        self.fast_forward = False
+        self.add_folded_agents(
+            np.concatenate(kinds),
+            np.concatenate(classes),
+            np.concatenate(states),
+            x,
+            y,
+        )
+        self.add_folded_agents(
+            table["kind"][rows],
+            table["age_class"][rows],
+            np.where(isolation_time < 0, State.INFECTED, State.ISOLATED),
+            sick_x,
+            sick_y,
+            table["infection_time"][rows],
+            table["recovery_time"][rows],
+            np.maximum(isolation_time, 0),
+        )
+        del self.susceptible, self.infected, self.isolated, self.sick_classes
+        del self.susceptible_ages, self.recovered_ages, self.deceased_ages
+
+    def place_in_regions(self, regions: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """Uniformly drawn cells within the given regions, or anywhere for -1"""
+        anywhere = regions < 0
+        x = np.empty(len(regions), dtype=np.int32)
+        y = np.empty(len(regions), dtype=np.int32)
+        x[anywhere], y[anywhere] = self.random_positions(int(anywhere.sum()))
+        placed = regions[~anywhere]
+        x[~anywhere] = self.region_origin_x[placed] + self.rng.integers(
+            0, self.region_side_x[placed]
+        )
+        y[~anywhere] = self.region_origin_y[placed] + self.rng.integers(
+            0, self.region_side_y[placed]
+        )
+        return x, y
+
+    def add_folded_agents(
+        self,
+        kinds: np.ndarray,
+        classes: np.ndarray,
+        states: np.ndarray,
+        x: np.ndarray,
+        y: np.ndarray,
+        infection_time: np.ndarray | None = None,
+        recovery_time: np.ndarray | None = None,
+        isolation_time: np.ndarray | None = None,
+    ) -> np.ndarray:
+        """Append individual agents for counted ones, with ages uniform within
+        their class. Unless they are given, the infection time is now, the
+        recovery time is drawn and the isolation time is 0.
+        """
+        count = len(kinds)
+        age = self.rng.uniform(AGE_LOW[classes], AGE_HIGH[classes]).astype(np.float32)
+        if infection_time is None:
+            infection_time = np.full(count, self.time)
+        if recovery_time is None:
+            recovery_time = draw_recovery_times(
+                self.rng, age, self.recovery_time_multiplier
+            )
+        if isolation_time is None:
+            isolation_time = np.zeros(count)
+        values = {
+            "state": states.astype(np.int8),
+            "age": age,
+            "wear_mask": kinds >= 2,
+            "vaccinated": kinds % 2 == 1,
+            "is_medic": np.zeros(count, bool),
+            "infection_time": infection_time,
+            "recovery_time": recovery_time,
+            "isolation_time": isolation_time,
+            "x": x,
+            "y": y,
+        }
+        start = len(self.state)
+        for field in AGENT_FIELDS:
+            merged = np.concatenate([getattr(self, field), values[field]])
+            setattr(self, field, merged.astype(getattr(self, field).dtype))
+        return np.arange(start, start + count)
+
+    def sick_totals(self, taken: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """Totals per kind of numbers taken from the rows of sick_classes, for the
+        infected and for the isolated rows
+        """
+        table = self.sick_classes
+        isolated = table["isolation_time"] >= 0
+        totals = np.bincount(
+            2 * table["kind"] + isolated, weights=taken, minlength=2 * NUM_KINDS
+        )
+        totals = totals.astype(np.int64).reshape(NUM_KINDS, 2)
+        return totals[:, 0], totals[:, 1]
+
+    def take_from_regions(self, counts: np.ndarray, taken: np.ndarray) -> np.ndarray:
+        """Remove taken[k] agents of each kind k, drawn uniformly, from region
+        counts, and return the numbers taken per region and kind
+        """
+        drawn = np.zeros_like(counts)
+        for kind in np.flatnonzero(taken).tolist():
+            drawn[:, kind] = sample_counts(self.rng, counts[:, kind], int(taken[kind]))
+        counts -= drawn
+        return drawn
+
+    def remove_sick(self, taken: np.ndarray) -> None:
+        """Remove the taken agents from the rows of sick_classes, and as many
+        agents of each kind from the infected or isolated region counts
+        """
+        infected, isolated = self.sick_totals(taken)
+        self.sick_classes.count = self.sick_classes.count - taken
+        self.take_from_regions(self.infected, infected)
+        self.take_from_regions(self.isolated, isolated)
+
+    def deploy_vaccine(self) -> None:
+        """Vaccinate a batch drawn from the individual and the counted living,
+        unvaccinated agents
+        """
+        if not self.fast_forward:
+            return super().deploy_vaccine()
+        eligible = np.flatnonzero(~self.vaccinated & (self.state != State.DECEASED))
+        table = self.sick_classes
+        sick = np.flatnonzero(table["kind"] % 2 == 0)
+        pools = np.concatenate(
+            [
+                [len(eligible)],
+                self.susceptible[:, UNVACCINATED_KINDS].ravel(),
+                self.recovered_ages[UNVACCINATED_KINDS].ravel(),
+                table.count[sick],
+            ]
+        )
+        batch = min(self.vaccine_batch_size, int(pools.sum()))
+        drawn = sample_counts(self.rng, pools, batch)
+        self.vaccinated[self.rng.choice(eligible, drawn[0], False)] = True
+
+        num_regions = len(self.region_area)
+        end = 1 + 2 * num_regions + 2 * NUM_AGE_CLASSES
+        susceptible = drawn[1 : 1 + 2 * num_regions].reshape(num_regions, 2)
+        recovered = drawn[1 + 2 * num_regions : end].reshape(2, NUM_AGE_CLASSES)
+        for column, kind in enumerate(UNVACCINATED_KINDS):
+            self.susceptible[:, kind] -= susceptible[:, column]
+            self.susceptible[:, kind + 1] += susceptible[:, column]
+            self.susceptible_ages[kind + 1] += draw_class_counts(
+                self.rng, self.susceptible_ages[kind], int(susceptible[:, column].sum())
+            )
+            self.recovered_ages[kind] -= recovered[column]
+            self.recovered_ages[kind + 1] += recovered[column]
+
+        # the vaccinated sick agents of the region counts are drawn uniformly
+        vaccinated = np.zeros(len(table), dtype=np.int64)
+        vaccinated[sick] = drawn[end:]
+        for counts, totals in zip(
+            (self.infected, self.isolated), self.sick_totals(vaccinated)
+        ):
+            counts[:, 1::2] += self.take_from_regions(counts, totals)[:, ::2]
+        table.count = table.count - vaccinated
+        table.add(vaccinated, **{**table.columns, "kind": table["kind"] + 1})
+        table.compact()
+
+    def cure(self) -> None:
+        """Let infected medics cure the agents sharing their cell, where the
+        counted agents of a region are in a medic's cell with the share of the
+        region's cells that medic stands on
+        """
+        medics = self.medic_agents[self.state[self.medic_agents] == State.INFECTED]
+        super().cure()
+        if not self.fast_forward or len(medics) == 0:
+            return
+        cells, per_cell = np.unique(self.cell_index()[medics], return_counts=True)
+        cure_chance = 1 - (1 - self.curing_chance) ** per_cell
+        chance = np.bincount(
+            self.region_of(cells // self.height, cells % self.height),
+            weights=cure_chance,
+            minlength=len(self.region_area),
+        )
+        chance /= self.region_area
+        cured = self.rng.binomial(self.susceptible, chance[:, None])
+        self.susceptible -= cured
+        for kind in range(NUM_KINDS):
+            self.recovered_ages[kind] += draw_class_counts(
+                self.rng, self.susceptible_ages[kind], int(cured[:, kind].sum())
+            )
+
+        # the cured sick agents of every kind and isolation are drawn uniformly
+        # from the matching rows of sick_classes
+        totals = np.zeros((NUM_KINDS, 2), dtype=np.int64)
+        for column, counts in enumerate((self.infected, self.isolated)):
+            cured = self.rng.binomial(counts, chance[:, None])
+            counts -= cured
+            totals[:, column] = cured.sum(axis=0)
+        table = self.sick_classes
+        groups = 2 * table["kind"] + (table["isolation_time"] >= 0)
+        recovered = take_within_groups(self.rng, groups, table.count, totals.ravel())
+        np.add.at(self.recovered_ages, (table["kind"], table["age_class"]), recovered)
+        table.count = table.count - recovered
+        table.compact()
+
+    def check_status(self) -> None:
+        """Apply isolation, death and recovery to the individual and the counted
+        sick agents
+        """
+        super().check_status()
+        if not self.fast_forward:
+            return
+        table = self.sick_classes
+        isolated = np.where(
+            table["isolation_time"] < 0,
+            self.rng.binomial(table.count, self.isolation_chance),
+            0,
+        )
+        totals, _ = self.sick_totals(isolated)
+        self.isolated += self.take_from_regions(self.infected, totals)
+        table.count = table.count - isolated
+        table.add(isolated, **{**table.columns, "isolation_time": 0})
+
+        dead = self.rng.binomial(table.count, self.death_rate)
+        np.add.at(self.deceased_ages, (table["kind"], table["age_class"]), dead)
+        self.death_times.add_many(np.repeat(self.time - table["infection_time"], dead))
+        self.remove_sick(dead)
+
+        sick_for = self.time - table["infection_time"]
+        recovered = np.where(sick_for >= table["recovery_time"], table.count, 0)
+        np.add.at(self.recovered_ages, (table["kind"], table["age_class"]), recovered)
+        self.remove_sick(recovered)
+        table.compact()
+
+    def migrate(self, counts: np.ndarray) -> None:
+        """Move the agents of region counts to neighbouring regions"""
+        flows = self.rng.multinomial(counts, self.migration[:, None, :])
+        targets = self.migration_target.ravel()
+        for kind in range(NUM_KINDS):
+            counts[:, kind] = np.bincount(
+                targets,
+                weights=flows[:, kind, :].ravel(),
+                minlength=len(self.region_area),
+            ).astype(np.int64)
+
+    def move(self, agents: np.ndarray) -> None:
+        """Move the individual agents, and the counted susceptible and infected
+        agents to neighbouring regions
+        """
+        super().move(agents)
+        if not self.fast_forward:
+            return
+        self.migrate(self.susceptible)
+        self.migrate(self.infected)
+
+        # the counted agents released from isolation in this step only move from
+        # the next one on, so their isolation advances after the movement
+        table = self.sick_classes
+        isolation_time = table["isolation_time"]
+        isolation_time = np.where(isolation_time >= 0, isolation_time + 1, -1)
+        released = isolation_time == self.isolation_duration
+        _, totals = self.sick_totals(np.where(released, table.count, 0))
+        self.infected += self.take_from_regions(self.isolated, totals)
+        table.columns["isolation_time"] = np.where(released, -1, isolation_time)
+        table.compact()
+
+    def contact(self) -> None:
+        """Infect susceptible agents sharing a cell with infected agents"""
+        if not self.fast_forward:
+            return super().contact()
+        num_regions = len(self.region_area)
+        # log of the chance of an agent in each region to escape the counted
+        # infected agents, which are spread uniformly over the region
+        kinds = np.arange(NUM_KINDS)
+        rates = infection_rates(self, kinds >= 2, kinds % 2 == 1)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            escape = self.infected * np.log1p(-rates / self.region_area[:, None])
+        counted_escape = np.where(self.infected > 0, escape, 0.0).sum(axis=1)
+
+        # log of the chance to escape the individual infected agents of each cell
+        infected = np.flatnonzero(self.state == State.INFECTED)
+        rates = infection_rates(
+            self, self.wear_mask[infected], self.vaccinated[infected]
+        )
+        cells, index = np.unique(self.cell_index()[infected], return_inverse=True)
+        with np.errstate(divide="ignore"):
+            cell_escape = np.bincount(
+                index, weights=np.log1p(-rates), minlength=len(cells)
+            )
+        # chance of a uniformly placed agent in each region to be infected by
+        # the individual infected agents, from those before this contact phase
+        individual = np.bincount(
+            self.region_of(cells // self.height, cells % self.height),
+            weights=-np.expm1(cell_escape),
+            minlength=num_regions,
+        )
+        with np.errstate(divide="ignore"):
+            region_escape = counted_escape + np.log1p(
+                -np.minimum(individual / self.region_area, 1.0)
+            )
+        newly_infected = self.rng.binomial(
+            self.susceptible, -np.expm1(region_escape)[:, None]
+        )
+
+        susceptible = np.flatnonzero(self.state == State.SUSCEPTIBLE)
+        log_escape = counted_escape[
+            self.region_of(self.x[susceptible], self.y[susceptible])
+        ]
+        if len(cells) > 0:
+            agent_cells = self.cell_index()[susceptible]
+            position = np.minimum(np.searchsorted(cells, agent_cells), len(cells) - 1)
+            shared = cells[position] == agent_cells
+            log_escape = log_escape + np.where(shared, cell_escape[position], 0.0)
+        caught = susceptible[self.rng.random(len(susceptible)) < -np.expm1(log_escape)]
+        self.state[caught] = State.INFECTED
+        self.infection_time[caught] = self.time
+
+        self.susceptible -= newly_infected
+        self.infected += newly_infected
+        for kind in range(NUM_KINDS):
+            drawn = draw_class_counts(
+                self.rng,
+                self.susceptible_ages[kind],
+                int(newly_infected[:, kind].sum()),
+            )
+            recovery = self.rng.multinomial(drawn, self.recovery_time_chances)
+            age_class, recovery_time = np.nonzero(recovery)
+            self.sick_classes.add(
+                recovery[age_class, recovery_time],
+                kind=kind,
+                age_class=age_class,
+                infection_time=self.time,
+                recovery_time=recovery_time,
+                isolation_time=-1,
+            )
+        self.sick_classes.compact()
+
+    def cell_counts(self) -> np.ndarray:
+        """Cell counts of the individual agents. While fast-forwarding, the
+        counted living agents are spread evenly over the cells of their region,
+        and the counted recovered and deceased agents over the grid. The deceased
+        are left out unless dead_occupy_cells is set.
+        """
+        counts = super().cell_counts()
+        if not self.fast_forward:
+            return counts
+        x, y = np.divmod(np.arange(self.width * self.height), self.height)
+        cell_region = self.region_of(x, y)
+        shape = (self.width, self.height)
+        for state, regional in (
+            (State.SUSCEPTIBLE, self.susceptible),
+            (State.INFECTED, self.infected),
+            (State.ISOLATED, self.isolated),
+        ):
+            counts[:, :, state] += spread_evenly(
+                regional.sum(axis=1), cell_region
+            ).reshape(shape)
+        anywhere = np.zeros(len(x), dtype=np.int64)
+        removed = [(State.RECOVERED, self.recovered_ages)]
+        if self.dead_occupy_cells:
+            removed.append((State.DECEASED, self.deceased_ages))
+        for state, ages in removed:
+            counts[:, :, state] += spread_evenly(
+                np.array([ages.sum()]), anywhere
+            ).reshape(shape)
+        return counts
+
+    def count_state(self, model: Model, state: State) -> int:
+        """Count agents with a given state in the given model"""
+        count = super().count_state(model, state)
+        if not self.fast_forward:
+            return count
+        if state == State.SUSCEPTIBLE:
+            return count + int(self.susceptible.sum())
+        if state == State.INFECTED:
+            return count + int(self.infected.sum())
+        if state == State.ISOLATED:
+            return count + int(self.isolated.sum())
+        if state == State.RECOVERED:
+            return count + int(self.recovered_ages.sum())
+        if state == State.DECEASED:
+            return count + int(self.deceased_ages.sum())
+        return count
+
+    def check_end(self) -> bool:
+        if self.fast_forward and self.infected.sum() > 0:
+            return False
+        return super().check_end()
+
+    def living_ages(self) -> np.ndarray:
+        """Counted living agents per kind and age class"""
+        table = self.sick_classes
+        sick = np.bincount(
+            table["kind"] * NUM_AGE_CLASSES + table["age_class"],
+            weights=table.count,
+            minlength=NUM_KINDS * NUM_AGE_CLASSES,
+        ).reshape(NUM_KINDS, -1)
+        return self.susceptible_ages + self.recovered_ages + sick.astype(np.int64)
+
+    def count_age(self, model: Model, minAge: int, maxAge: int) -> int:
+        """Count agents with a given age in the given model"""
+        count = super().count_age(model, minAge, maxAge)
+        if not self.fast_forward:
+            return count
+        within = (AGE_LOW >= minAge) & (AGE_HIGH <= maxAge)
+        return count + int(self.living_ages()[:, within].sum())
+
+    def count_mask(self, model: Model, wearing: bool) -> int:
+        """Count agents who are wearing/not wearing a mask in the given model"""
+        count = super().count_mask(model, wearing)
+        if not self.fast_forward:
+            return count
+        kinds = [2, 3] if wearing else [0, 1]
+        return count + int(self.living_ages()[kinds].sum())
+
+    def count_vaccinated(self, model: Model, vaccinated: bool) -> int:
+        """Count agents who are vaccinated in the given model"""
+        count = super().count_vaccinated(model, vaccinated)
+        if not self.fast_forward:
+            return count
+        kinds = [1, 3] if vaccinated else [0, 2]
+        return count + int(self.living_ages()[kinds].sum())
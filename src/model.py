@@ -1,9 +1,17 @@
-import random
+import os
+from collections import Counter, defaultdict
 from mesa import Model
 from agent import InfectableAgent, State
-from mesa.space import MultiGrid
-from mesa.time import RandomActivation
-from mesa.datacollection import DataCollector
+from counters import NUM_STATES, PopulationCounters
+from occupancy import OccupancyGrid
+from pools import SamplingPool
+from histogram import BinnedHistogram
+from events import DIE, ISOLATE, RECOVER, RELEASE, TransitionQueue
+from collector import ColumnarDataCollector
+from rng import BlockRandom
+from activation import InfectionActivation
+from contacts import ContactLayers
+from population import GROUPS, Population, draw_attributes, scale_recovery_times
 import numpy as np
 
 
@@ -31,7 +39,25 @@ class InfectionModel(Model):
         vaccine_ready_time: int = 15,
         vaccine_batch_size: int = 10,
         vaccine_effectiveness: float = 0.5,
+        dead_occupy_cells: bool = True,
+        population: str | None = None,
+        contact_layers: str | None = None,
+        contact_weights: dict[str, float] | None = None,
+        output_dir: str | None = None,
+        sample_interval: int = 1,
+        seed: int | None = None,
     ) -> None:
+        self.reset_randomizer(seed)
+        self.rng = BlockRandom(seed)
+        self.population = population
+        source = None
+        if population is not None:
+            # the population file fixes the agents and the grid they live on
+            source = Population.load(population)
+            num_agents = source.num_agents
+            num_traveling_agents = source.num_traveling_agents
+            num_medic_agents = source.num_medic_agents
+            width, height = source.width, source.height
         self.num_agents = num_agents
         self.num_traveling_agents = num_traveling_agents
         self.num_medic_agents = num_medic_agents
@@ -49,53 +75,64 @@ class InfectionModel(Model):
         self.vaccine_ready_time = vaccine_ready_time
         self.vaccine_batch_size = vaccine_batch_size
         self.vaccine_effectiveness = vaccine_effectiveness
-        self.grid = MultiGrid(width, height, True)
-        self.schedule = RandomActivation(self)
+        self.output_dir = output_dir
+        self.sample_interval = sample_interval
+        self.grid = OccupancyGrid(width, height, True)
+        self.schedule = InfectionActivation(self, dead_occupy_cells)
         self.running = True
-        self.death_time_freqs = {}
+        self.death_times = BinnedHistogram()
+        self.counters = PopulationCounters()
+        self.unvaccinated = SamplingPool()
+        # isolation, death and recovery, and the releases from isolation
+        self.transitions = TransitionQueue(3)
+        self.releases = TransitionQueue(1)
 
-        self.stateDataCollector = DataCollector(
+        self.stateDataCollector = self.create_collector(
+            "stateDataCollector",
             {
                 "Susceptible": lambda m: self.count_state(m, State.SUSCEPTIBLE),
                 "Infected": lambda m: self.count_state(m, State.INFECTED),
                 "Isolated": lambda m: self.count_state(m, State.ISOLATED),
                 "Recovered": lambda m: self.count_state(m, State.RECOVERED),
                 "Deceased": lambda m: self.count_state(m, State.DECEASED),
-            }
+            },
         )
-        self.protectionDataCollector = DataCollector(
+        self.protectionDataCollector = self.create_collector(
+            "protectionDataCollector",
             {
                 "Wearing Mask": lambda m: self.count_mask(m, True),
                 "Not Wearing Mask": lambda m: self.count_mask(m, False),
                 "Vaccinated": lambda m: self.count_vaccinated(m, True),
                 "Not Vaccinated": lambda m: self.count_vaccinated(m, False),
-            }
+            },
+        )
+        self.ageDataCollector = self.create_collector(
+            "ageDataCollector", self.build_age_collector()
+        )
+        self.deathDataCollector = self.create_collector(
+            "deathDataCollector", self.build_death_collector()
         )
-        self.ageDataCollector = DataCollector(self.build_age_collector())
-        self.deathDataCollector = DataCollector(self.build_death_collector())
-
-        for i in range(self.num_agents):
-            a = InfectableAgent(i, self)
-            self.add_agent(a)
 
-        self.travelling_agents = []
-        for i in range(self.num_traveling_agents):
-            a = InfectableAgent(i + self.num_agents, self)
-            self.add_agent(a)
-            self.travelling_agents.append(a)
+        groups = {}
+        if source is not None:
+            groups = {name: source.group(name) for name in GROUPS}
+        self.add_agents(self.num_agents, attributes=groups.get("num_agents"))
+        self.travelling_agents = self.add_agents(
+            self.num_traveling_agents, attributes=groups.get("num_traveling_agents")
+        )
 
         self.stateDataCollector.collect(self)
         self.protectionDataCollector.collect(self)
         self.ageDataCollector.collect(self)
         self.deathDataCollector.collect(self)
 
-        self.medic_agents = []
-        for i in range(self.num_medic_agents):
-            a = InfectableAgent(
-                i + self.num_agents + self.num_traveling_agents, self, True
-            )
-            self.add_agent(a)
-            self.medic_agents.append(a)
+        self.medic_agents = self.add_agents(
+            self.num_medic_agents, True, groups.get("num_medic_agents")
+        )
+
+        self.contact_layers = contact_layers
+        self.contact_weights = contact_weights
+        self.contacts = self.load_contacts()
 
     def step(self) -> None:
         """Advance the model by one step."""
@@ -117,110 +154,265 @@ class InfectionModel(Model):
         self.schedule.step()
         if self.check_end():
             self.running = False
+            self.flush_collectors()
+
+    def create_collector(self, name: str, reporters: dict) -> ColumnarDataCollector:
+        """Create a collector that writes to output_dir/name if an output directory is set"""
+        path = None if self.output_dir is None else os.path.join(self.output_dir, name)
+        return ColumnarDataCollector(
+            reporters, path, sample_interval=self.sample_interval
+        )
+
+    def flush_collectors(self) -> None:
+        """Write the buffered collector rows to the output directory"""
+        self.stateDataCollector.flush()
+        self.protectionDataCollector.flush()
+        self.ageDataCollector.flush()
+        self.deathDataCollector.flush()
+
+    def close(self) -> None:
+        """Release resources held by the model, such as worker processes"""
 
     def deploy_vaccine(self) -> None:
-        agents = random.sample(self.schedule.agents, self.vaccine_batch_size)
+        """Vaccinate a batch of living, not yet vaccinated agents"""
+        agents = self.unvaccinated.sample(self.vaccine_batch_size, self.rng)
         for agent in agents:
             agent.boost_immunity()
 
     def travel(self) -> None:
         """Move traveling agents to random locations"""
         for agent in self.travelling_agents:
-            self.place_agent(agent)
+            if self.schedule.is_active(agent):
+                self.grid.move_agent(agent, self.random_position())
 
     def cure(self) -> None:
-        for agent in self.medic_agents:
-            agent.cure_adjacent()
+        """Let medics cure the agents sharing their cell"""
+        # medics only cure while they are infected themselves
+        medics_per_cell = Counter(
+            medic.pos for medic in self.medic_agents if medic.state == State.INFECTED
+        )
+        for pos, medics in medics_per_cell.items():
+            # every medic in the cell gets its own attempt
+            not_cured_chance = (1 - self.curing_chance) ** medics
+            for agent in self.grid[pos]:
+                if agent.state == State.DECEASED:
+                    continue
+                if self.rng.random() >= not_cured_chance:
+                    agent.state = State.RECOVERED
+
+    def spread_infection(self) -> None:
+        """Infect susceptible agents sharing a cell or a contact layer with
+        infected agents
+        """
+        escape_chance = defaultdict(lambda: 1.0)
+        infected = []
+        for agent in self.schedule.active_agents:
+            if agent.state == State.INFECTED:
+                rate = max(agent.get_infection_rate(), 0)
+                escape_chance[agent.pos] *= 1 - rate
+                infected.append((agent.unique_id, rate))
+        layer_escape = self.layer_escape(infected)
+        for pos, chance in escape_chance.items():
+            # one draw per susceptible agent against all infected cellmates
+            # and contacts
+            for agent in self.grid[pos]:
+                if agent.state != State.SUSCEPTIBLE:
+                    continue
+                chance_with_layers = chance * layer_escape.pop(agent.unique_id, 1.0)
+                if self.rng.random() >= chance_with_layers:
+                    # the new infection is first checked in the next step
+                    self.infect(agent, self.schedule.time + 1)
+        # agents with infected contacts but no infected cellmates
+        for unique_id, chance in layer_escape.items():
+            agent = self.schedule.get_agent(unique_id)
+            if agent.state == State.SUSCEPTIBLE and self.rng.random() >= chance:
+                self.infect(agent, self.schedule.time + 1)
+
+    def load_contacts(self) -> ContactLayers | None:
+        """The contact layers of the model, which must cover all of its agents"""
+        if self.contact_layers is None:
+            return None
+        contacts = ContactLayers.load(self.contact_layers, self.contact_weights)
+        count = self.num_agents + self.num_traveling_agents + self.num_medic_agents
+        if len(contacts) != count:
+            raise ValueError(
+                f"contact layers cover {len(contacts)} agents, the model has {count}"
+            )
+        return contacts
+
+    def layer_escape(self, infected: list[tuple[int, float]]) -> dict[int, float]:
+        """Chance of the agents with infected contacts to escape infection along
+        the contact layers, by unique id, from (unique id, infection rate) pairs
+        """
+        if self.contacts is None or not infected:
+            return {}
+        sources, rates = zip(*infected)
+        log_escape = self.contacts.log_escape(
+            np.array(sources, dtype=np.int64),
+            np.array(rates),
+            self.schedule.get_agent_count(),
+        )
+        exposed = np.flatnonzero(log_escape < 0)
+        return dict(zip(exposed.tolist(), np.exp(log_escape[exposed]).tolist()))
+
+    def infect(self, agent: InfectableAgent, first_tick: int) -> None:
+        """Infect an agent and queue its timed transitions.
+
+        Death and isolation are Bernoulli draws in every step from first_tick on,
+        so their waiting times are geometric. Recovery is due recovery_time steps
+        after the infection. Transitions that would come after the recovery are
+        not queued.
+        """
+        agent.infection_time = self.schedule.time
+        agent.state = State.INFECTED
+        recovery = max(first_tick, agent.infection_time + agent.recovery_time)
+        self.transitions.push(recovery, RECOVER, agent)
+        wait = self.rng.geometric(self.death_rate)
+        if wait is not None and first_tick + wait - 1 <= recovery:
+            self.transitions.push(first_tick + wait - 1, DIE, agent)
+        self.queue_isolation(agent, first_tick)
+
+    def queue_isolation(self, agent: InfectableAgent, first_tick: int) -> None:
+        """Queue the isolation of an infected agent, drawn from first_tick on"""
+        wait = self.rng.geometric(self.isolation_chance)
+        recovery = max(first_tick, agent.infection_time + agent.recovery_time)
+        if wait is not None and first_tick + wait - 1 <= recovery:
+            self.transitions.push(first_tick + wait - 1, ISOLATE, agent)
+
+    def fire_transitions(self) -> None:
+        """Isolate, kill and recover the agents whose transition is due this step"""
+        tick = self.schedule.time
+        isolated, died, recovered = self.transitions.pop(tick)
+        for agent in isolated:
+            if agent.state == State.INFECTED:
+                agent.state = State.ISOLATED
+                # an isolation of 0 steps never ends
+                if self.isolation_duration > 0:
+                    release = tick + self.isolation_duration - 1
+                    self.releases.push(release, RELEASE, agent)
+        for agent in died:
+            if agent.state == State.INFECTED or agent.state == State.ISOLATED:
+                agent.state = State.DECEASED
+                self.register_death(agent)
+        for agent in recovered:
+            if agent.state == State.INFECTED or agent.state == State.ISOLATED:
+                agent.state = State.RECOVERED
+
+    def release_isolated(self) -> None:
+        """End the isolations that are over this step"""
+        tick = self.schedule.time
+        (released,) = self.releases.pop(tick)
+        for agent in released:
+            if agent.state == State.ISOLATED:
+                agent.state = State.INFECTED
+                self.queue_isolation(agent, tick + 1)
 
     def count_state(self, model: Model, state: State) -> int:
         """Count agents with a given state in the given model"""
-        return len([a for a in model.schedule.agents if a.state is state])
+        return model.counters.state[state]
 
     def count_age(self, model: Model, minAge: int, maxAge: int) -> int:
         """Count agents with a given age in the given model"""
-        return len(
-            [
-                a
-                for a in model.schedule.agents
-                if a.age >= minAge and a.age <= maxAge and a.state is not State.DECEASED
-            ]
-        )
+        return model.counters.count_age(minAge, maxAge)
 
     def count_death(self, model: Model, minDays: int, maxDays: int) -> int:
         """Count agents who died within a given time frame in the given model"""
-        freqs = [
-            self.death_time_freqs[t]
-            for t in range(minDays, maxDays + 1)
-            if t in self.death_time_freqs
-        ]
-        return sum(freqs)
+        return model.death_times.count_range(minDays, maxDays)
 
     def count_mask(self, model: Model, wearing: bool) -> int:
         """Count agents who are wearing/not wearing a mask in the given model"""
-        return len(
-            [
-                a
-                for a in model.schedule.agents
-                if a.wear_mask == wearing and a.state is not State.DECEASED
-            ]
-        )
+        return model.counters.mask[wearing]
 
     def count_vaccinated(self, model: Model, vaccinated: bool) -> int:
         """Count agents who are vaccinated in the given model"""
-        return len(
-            [
-                a
-                for a in model.schedule.agents
-                if a.vaccinated == vaccinated and a.state is not State.DECEASED
-            ]
-        )
+        return model.counters.vaccinated[vaccinated]
+
+    def cell_counts(self) -> np.ndarray:
+        """Agents of each state in every cell, followed by the number of medics
+        in the cell, as a (width, height, NUM_STATES + 1) array
+        """
+        placed = [a for a in self.schedule.agents if a.pos is not None]
+        channels = NUM_STATES + 1
+        index = [(a.pos[0] * self.grid.height + a.pos[1]) * channels for a in placed]
+        index = np.array(index, dtype=np.int64)
+        state = np.array([a.state for a in placed], dtype=np.int64)
+        medic = np.array([a.isMedic for a in placed], dtype=bool)
+        size = self.grid.width * self.grid.height * channels
+        counts = np.bincount(index + state, minlength=size)
+        counts += np.bincount(index[medic] + NUM_STATES, minlength=size)
+        return counts.reshape(self.grid.width, self.grid.height, channels)
 
     def build_age_collector(self) -> dict:
         """Build a dict of age collectors for the data collector"""
         age_collector = {}
         for i in range(0, 100, 10):
-            age_collector[
-                f"{i}-{i+9}"
-            ] = lambda m, minAge=i, maxAge=i + 9: self.count_age(m, minAge, maxAge)
+            age_collector[f"{i}-{i+9}"] = (
+                lambda m, minAge=i, maxAge=i + 9: self.count_age(m, minAge, maxAge)
+            )
         return age_collector
 
     def build_death_collector(self) -> dict:
         """Build a dict of death collectors for the data collector"""
         death_collector = {}
-        for i in range(1, 30, 3):
-            death_collector[
-                f"{i}-{i+2}"
-            ] = lambda m, minDays=i, maxDays=i + 4: self.count_death(
-                m, minDays, maxDays
+        for i, label in enumerate(self.death_times.labels()):
+            death_collector[label] = lambda m, index=i: self.death_times.count_bins(
+                index, index
             )
         return death_collector
 
-    def add_agent(self, agent: InfectableAgent) -> None:
-        self.schedule.add(agent)
-        self.place_agent(agent)
-        self.try_to_infect_agent(agent)
-        return agent
+    def add_agents(
+        self,
+        count: int,
+        medic: bool = False,
+        attributes: dict[str, np.ndarray] | None = None,
+    ) -> list[InfectableAgent]:
+        """Create count agents at once and return them.
+        The agents are drawn unless their attributes are given, as from a population.
+        """
+        if attributes is None:
+            attributes = draw_attributes(
+                self.rng.generator,
+                count,
+                self.start_infection_rate,
+                self.wear_mask_chance,
+            )
+            attributes["x"], attributes["y"] = self.random_positions(count)
+        start = self.schedule.get_agent_count()
+        recovery_time = scale_recovery_times(
+            attributes["recovery_time"], self.recovery_time_multiplier
+        )
+        agents = [
+            InfectableAgent.from_attributes(start + i, self, medic, *values)
+            for i, values in enumerate(
+                zip(
+                    attributes["age"].tolist(),
+                    attributes["wear_mask"].tolist(),
+                    recovery_time.tolist(),
+                )
+            )
+        ]
+        self.schedule.add_agents(agents)
+        self.counters.add_susceptible(attributes["age"], attributes["wear_mask"])
+        self.unvaccinated.extend(agents)
+        self.grid.place_agents(agents, attributes["x"], attributes["y"])
+        for i in np.flatnonzero(attributes["infected"]).tolist():
+            self.infect(agents[i], self.schedule.time)
+        return agents
 
-    def place_agent(self, agent: InfectableAgent) -> None:
+    def random_positions(self, count: int) -> tuple[np.ndarray, np.ndarray]:
+        """Uniformly drawn cells for count new agents"""
+        x = self.rng.generator.integers(0, self.grid.width, count, dtype=np.int32)
+        y = self.rng.generator.integers(0, self.grid.height, count, dtype=np.int32)
+        return x, y
+
+    def random_position(self) -> tuple[int, int]:
         x = self.random.randrange(self.grid.width)
         y = self.random.randrange(self.grid.height)
-        self.grid.place_agent(agent, (x, y))
-
-    def try_to_infect_agent(self, agent: InfectableAgent) -> None:
-        infected = np.random.choice(
-            [0, 1], p=[1 - self.start_infection_rate, self.start_infection_rate]
-        )
-        if infected == 1:
-            agent.state = State.INFECTED
-            agent.infection_time = self.schedule.time
+        return x, y
 
     def check_end(self) -> bool:
-        return not any([a.state is State.INFECTED for a in self.schedule.agents])
+        return self.counters.state[State.INFECTED] == 0
 
     def register_death(self, agent: InfectableAgent) -> None:
         """Register the death of an agent"""
-        death_time = self.schedule.time - agent.infection_time
-        if death_time in self.death_time_freqs:
-            self.death_time_freqs[death_time] += 1
-        else:
-            self.death_time_freqs[death_time] = 1
+        self.death_times.add(self.schedule.time - agent.infection_time)
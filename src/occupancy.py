@@ -0,0 +1,121 @@
+from mesa import Agent
+from mesa.space import MultiGrid, Coordinate
+import numpy as np
+
+
+def window_offsets(size: int, radius: int, torus: bool) -> np.ndarray:
+    """Offsets along one axis covered by a Moore window of the given radius"""
+    if not torus:
+        return np.arange(-radius, radius + 1)
+    # mirror MultiGrid.get_neighborhood: the radius is clipped to half the grid
+    # and even dimensions drop the duplicated wrap-around column/row
+    clipped = min(radius, size // 2)
+    even = int(clipped == size // 2 and size % 2 == 0)
+    return np.arange(-clipped, clipped + 1 - even)
+
+
+def window_counts(occupied: np.ndarray, radius: int) -> np.ndarray:
+    """Number of occupied cells in the toroidal Moore window of each cell"""
+    width, height = occupied.shape
+    counts = np.zeros(occupied.shape, dtype=np.int32)
+    column_sums = np.zeros(occupied.shape, dtype=np.int32)
+    for dy in window_offsets(height, radius, True):
+        column_sums += np.roll(occupied, -dy, axis=1)
+    for dx in window_offsets(width, radius, True):
+        counts += np.roll(column_sums, -dx, axis=0)
+    return counts
+
+
+class OccupancyGrid(MultiGrid):
+    """MultiGrid that keeps per-cell agent counts and windowed occupancy counts.
+
+    For every radius that has been queried, the grid maintains the number of
+    occupied cells in the Moore window around each cell. The windows are updated
+    when a cell becomes occupied or empty, so count_occupied_cells is a lookup.
+    """
+
+    def __init__(self, width: int, height: int, torus: bool) -> None:
+        super().__init__(width, height, torus)
+        self.occupancy = np.zeros((width, height), dtype=np.int32)
+        self._windows: dict[int, np.ndarray] = {}
+        self._offsets: dict[int, tuple[int, int, int, int]] = {}
+
+    def place_agent(self, agent: Agent, pos: Coordinate) -> None:
+        """Place the agent at the specified location, and set its pos variable."""
+        x, y = pos
+        if agent.pos is not None and agent in self._grid[x][y]:
+            return
+        super().place_agent(agent, pos)
+        self.occupancy[x, y] += 1
+        if self.occupancy[x, y] == 1:
+            self._update_windows(pos, 1)
+
+    def place_agents(self, agents: list[Agent], x: np.ndarray, y: np.ndarray) -> None:
+        """Place new agents at the cells (x[i], y[i]) in bulk"""
+        grid = self._grid
+        for agent, ax, ay in zip(agents, x.tolist(), y.tolist()):
+            grid[ax][ay].append(agent)
+            agent.pos = (ax, ay)
+        np.add.at(self.occupancy, (x, y), 1)
+        if self._empties_built:
+            self._empties.difference_update(zip(x.tolist(), y.tolist()))
+        # rebuild the windows that have been queried from the new occupancy
+        for radius in list(self._windows):
+            del self._windows[radius]
+            self._build_window(radius)
+
+    def remove_agent(self, agent: Agent) -> None:
+        """Remove the agent from the given location and set its pos attribute to None."""
+        x, y = pos = agent.pos
+        super().remove_agent(agent)
+        self.occupancy[x, y] -= 1
+        if self.occupancy[x, y] == 0:
+            self._update_windows(pos, -1)
+
+    def count_occupied_cells(self, pos: Coordinate, radius: int) -> int:
+        """Number of occupied cells within the given radius of pos, pos included"""
+        window = self._windows.get(radius)
+        if window is None:
+            window = self._build_window(radius)
+        return int(window[pos])
+
+    def _build_window(self, radius: int) -> np.ndarray:
+        dx = window_offsets(self.width, radius, self.torus)
+        dy = window_offsets(self.height, radius, self.torus)
+        self._offsets[radius] = (int(dx[0]), int(dx[-1]), int(dy[0]), int(dy[-1]))
+        occupied = (self.occupancy > 0).astype(np.int32)
+        if self.torus:
+            window = window_counts(occupied, radius)
+        else:
+            window = np.zeros(occupied.shape, dtype=np.int32)
+            for x, y in zip(*np.nonzero(occupied)):
+                for block in self._window_blocks((x, y), radius):
+                    window[block] += 1
+        self._windows[radius] = window
+        return window
+
+    def _axis_slices(self, coord: int, low: int, high: int, size: int) -> list:
+        """Slices of the cells c along one axis with coord - c in [low, high]"""
+        start, stop = coord - high, coord - low + 1
+        if not self.torus:
+            return [slice(max(start, 0), min(stop, size))]
+        start %= size
+        stop = start + high - low + 1
+        if stop <= size:
+            return [slice(start, stop)]
+        return [slice(start, size), slice(0, stop - size)]
+
+    def _window_blocks(self, pos: Coordinate, radius: int) -> list:
+        """Blocks of cells whose window of the given radius contains pos"""
+        x, y = pos
+        low_x, high_x, low_y, high_y = self._offsets[radius]
+        return [
+            (xs, ys)
+            for xs in self._axis_slices(x, low_x, high_x, self.width)
+            for ys in self._axis_slices(y, low_y, high_y, self.height)
+        ]
+
+    def _update_windows(self, pos: Coordinate, delta: int) -> None:
+        for radius, window in self._windows.items():
+            for block in self._window_blocks(pos, radius):
+                window[block] += delta
@@ -0,0 +1,510 @@
+"""Spatially partitioned variant of the vectorized model for very large grids.
+
+The toroidal grid is split into strips of rows, each owned by a worker process
+that steps the agents inside it. Movement and contact are local, so the workers
+only need to exchange:
+
+- agents that leave their strip, after travelling and after moving,
+- the occupancy of the social_distance rows along each strip boundary, before
+  the movement phase.
+
+The workers report their population tallies after every step and the main
+process merges them for the collectors.
+"""
+
+import multiprocessing
+import multiprocessing.connection
+import os
+import traceback
+from collections import defaultdict
+from typing import Any
+
+import numpy as np
+from mesa import Model
+
+from agent import State
+from counters import NUM_AGE_BINS, NUM_STATES, PopulationCounters
+from histogram import BinnedHistogram
+from model import InfectionModel
+from occupancy import window_counts
+from vectorized import VectorizedInfectionModel
+
+# per-agent arrays of a tile, moved along with an agent that changes tiles
+TILE_FIELDS = {
+    "state": np.int8,
+    "age": np.float32,
+    "wear_mask": bool,
+    "vaccinated": bool,
+    "is_medic": bool,
+    "is_travelling": bool,
+    "infection_time": np.int32,
+    "recovery_time": np.int32,
+    "isolation_time": np.int32,
+    "x": np.int32,
+    "y": np.int32,
+}
+
+
+def strip_bounds(width: int, partitions: int) -> np.ndarray:
+    """First row of each of the given number of strips, followed by width"""
+    return np.linspace(0, width, partitions + 1).astype(np.int64)
+
+
+class Mailbox:
+    """Message exchange between the workers of a partitioned model.
+
+    Every worker reads from its own inbox queue. Messages are tagged with the
+    exchange round, so a worker that runs ahead cannot mix its next messages
+    into the current round of a slower one.
+    """
+
+    def __init__(self, index: int, inboxes: list) -> None:
+        self.index = index
+        self.inboxes = inboxes
+        self.round = 0
+        self._early = defaultdict(list)
+
+    def exchange(self, outgoing: dict[int, Any], sources: set[int]) -> list:
+        """Send a payload to each worker in outgoing, then wait for one message
+        from each worker in sources
+        """
+        self.round += 1
+        for dest, payload in outgoing.items():
+            self.inboxes[dest].put((self.round, payload))
+        received = self._early.pop(self.round, [])
+        while len(received) < len(sources):
+            round, payload = self.inboxes[self.index].get()
+            if round == self.round:
+                received.append(payload)
+            else:
+                self._early[round].append(payload)
+        return received
+
+    def all_to_all(self, outgoing: dict[int, Any]) -> list:
+        """Exchange with every other worker, sending None where there is nothing"""
+        others = set(range(len(self.inboxes))) - {self.index}
+        received = self.exchange({dest: outgoing.get(dest) for dest in others}, others)
+        return [payload for payload in received if payload is not None]
+
+
+class PartitionTile(VectorizedInfectionModel):
+    """The agents in the strip of rows [x0, x1) of a partitioned model.
+
+    Agents keep their global coordinates. Cell indices, and the social distance
+    windows, only cover the strip plus a halo of rows around it.
+    """
+
+    def __init__(
+        self, params: dict, bounds: np.ndarray, index: int, seed, mailbox: Mailbox
+    ) -> None:
+        Model.__init__(self)
+        for name, value in params.items():
+            setattr(self, name, value)
+        self.bounds = bounds
+        self.index = index
+        self.partitions = len(bounds) - 1
+        self.x0 = int(bounds[index])
+        self.x1 = int(bounds[index + 1])
+        # a single strip wraps onto itself and needs no halo
+        self.halo = self.social_distance if self.partitions > 1 else 0
+        self.mailbox = mailbox
+        self.rng = np.random.default_rng(seed)
+        self.time = 0
+        self.death_times = BinnedHistogram()
+        for field, dtype in TILE_FIELDS.items():
+            setattr(self, field, np.empty(0, dtype=dtype))
+        self._halo_occupancy = None
+        # agent ids are local to the tile, so contact layers do not apply
+        self.contacts = None
+
+    @property
+    def travelling_agents(self) -> np.ndarray:
+        return np.flatnonzero(self.is_travelling)
+
+    @property
+    def medic_agents(self) -> np.ndarray:
+        return np.flatnonzero(self.is_medic)
+
+    def add_tile_agents(self, count: int, medic: bool, travelling: bool) -> None:
+        self.add_agents(count, medic)
+        self.is_travelling = np.concatenate(
+            [self.is_travelling, np.full(count, travelling)]
+        )
+
+    def random_positions(self, count: int) -> tuple[np.ndarray, np.ndarray]:
+        x = self.rng.integers(self.x0, self.x1, count, dtype=np.int32)
+        y = self.rng.integers(0, self.height, count, dtype=np.int32)
+        return x, y
+
+    def step(self, vaccine_batch: int) -> None:
+        """Advance the tile by one step, in lockstep with the other tiles"""
+        self.deploy_vaccine(vaccine_batch)
+        if self.num_traveling_agents > 0:
+            self.travel()
+            self.migrate()
+        self.cure()
+
+        self.check_status()
+        moving = self.moving()
+        self.update_isolation()
+        if self.social_distance > 0:
+            self.exchange_halo()
+        self.move(np.flatnonzero(moving))
+        self.migrate()
+        self.contact()
+        self.time += 1
+
+    def deploy_vaccine(self, batch: int) -> None:
+        """Vaccinate batch living, not yet vaccinated agents of the tile"""
+        eligible = np.flatnonzero(~self.vaccinated & (self.state != State.DECEASED))
+        self.vaccinated[self.rng.choice(eligible, batch, False)] = True
+
+    def migrate(self) -> None:
+        """Hand the agents outside the strip over to the tiles that own them"""
+        if self.partitions == 1:
+            return
+        owner = np.searchsorted(self.bounds, self.x, side="right") - 1
+        leaving = owner != self.index
+        outgoing = {}
+        if leaving.any():
+            for dest in np.unique(owner[leaving]).tolist():
+                rows = owner == dest
+                outgoing[dest] = {f: getattr(self, f)[rows] for f in TILE_FIELDS}
+            for field in TILE_FIELDS:
+                setattr(self, field, getattr(self, field)[~leaving])
+
+        incoming = self.mailbox.all_to_all(outgoing)
+        if incoming:
+            for field in TILE_FIELDS:
+                arrays = [getattr(self, field)] + [agents[field] for agents in incoming]
+                setattr(self, field, np.concatenate(arrays))
+
+    def exchange_halo(self) -> None:
+        """Gather the occupancy of the strip and the halo rows around it"""
+        occupying = self.occupying()
+        occupied = np.zeros((self.x1 - self.x0, self.height), dtype=np.int32)
+        occupied[self.x[occupying] - self.x0, self.y[occupying]] = 1
+        if self.halo == 0:
+            self._halo_occupancy = occupied
+            return
+
+        previous = (self.index - 1) % self.partitions
+        next = (self.index + 1) % self.partitions
+        # with two strips the previous and next tile are the same one
+        outgoing = defaultdict(dict)
+        outgoing[previous]["after"] = occupied[: self.halo]
+        outgoing[next]["before"] = occupied[-self.halo :]
+        received = {}
+        for rows in self.mailbox.exchange(outgoing, {previous, next}):
+            received.update(rows)
+        self._halo_occupancy = np.concatenate(
+            [received["before"], occupied, received["after"]]
+        )
+
+    def distance_windows(self) -> tuple[list[np.ndarray], int]:
+        # rows more than social_distance - 1 away from the halo edge are wrong
+        # after the toroidal roll, but candidate cells never look at them
+        windows = [
+            window_counts(self._halo_occupancy, distance - 1)
+            for distance in range(self.social_distance, 0, -1)
+        ]
+        return windows, self.x0 - self.halo
+
+    def cell_index(self) -> np.ndarray:
+        return (self.x - self.x0) * self.height + self.y
+
+    def cell_count(self) -> int:
+        return (self.x1 - self.x0) * self.height
+
+    def tallies(self) -> dict[str, Any]:
+        """Population counts of the tile, merged by PartitionedInfectionModel"""
+        living = self.state != State.DECEASED
+        # same inclusive 10-year bins as counters.age_bin
+        age_bin = (self.age // 10).astype(np.int64)
+        in_bin = living & (self.age <= age_bin * 10 + 9) & (age_bin < NUM_AGE_BINS)
+        return {
+            "state": np.bincount(self.state, minlength=NUM_STATES),
+            "age": np.bincount(age_bin[in_bin], minlength=NUM_AGE_BINS),
+            "living": int(np.count_nonzero(living)),
+            "mask": int(np.count_nonzero(living & self.wear_mask)),
+            "vaccinated": int(np.count_nonzero(living & self.vaccinated)),
+            "deaths": self.death_times.counts,
+        }
+
+    def population(self) -> dict[str, np.ndarray]:
+        return {field: getattr(self, field) for field in TILE_FIELDS}
+
+
+def _serve(
+    index: int, bounds: np.ndarray, params: dict, seed, inboxes: list, conn
+) -> None:
+    """Worker process loop: run the commands sent by the main process"""
+    tile = PartitionTile(params, bounds, index, seed, Mailbox(index, inboxes))
+    try:
+        while True:
+            command, *args = conn.recv()
+            if command == "close":
+                break
+            elif command == "add":
+                tile.add_tile_agents(*args)
+                conn.send(("ok", tile.tallies()))
+            elif command == "step":
+                tile.step(*args)
+                conn.send(("ok", tile.tallies()))
+            elif command == "cell_counts":
+                conn.send(("ok", tile.cell_counts()))
+            elif command == "population":
+                conn.send(("ok", tile.population()))
+    except Exception:
+        conn.send(("error", traceback.format_exc()))
+    finally:
+        conn.close()
+
+
+class PartitionedInfectionModel(InfectionModel):
+    """InfectionModel split over worker processes by strips of grid rows.
+
+    Each worker steps its strip like VectorizedInfectionModel, so the dynamics
+    match the vectorized engine. Agents that change strips, including
+    travelling agents, migrate to the worker that owns their new cell.
+    Vaccine batches are split over the workers in proportion to their eligible
+    agents. Every strip needs more than social_distance rows. Results with a
+    given seed depend on the number of processes.
+    """
+
+    def __init__(
+        self,
+        num_agents: int = 10,
+        num_traveling_agents: int = 0,
+        num_medic_agents: int = 0,
+        width: int = 10,
+        height: int = 10,
+        infection_rate: float = 0.4,
+        death_rate: float = 0.02,
+        start_infection_rate: float = 0.02,
+        wear_mask_chance: float = 0.5,
+        mask_effectiveness: float = 0.5,
+        recovery_time_multiplier: float = 1.0,
+        social_distance: int = 0,
+        social_distance_chance: float = 0.5,
+        isolation_duration: int = 7,
+        isolation_chance: float = 0.1,
+        curing_chance: float = 0.9,
+        vaccine_ready_time: int = 15,
+        vaccine_batch_size: int = 10,
+        vaccine_effectiveness: float = 0.5,
+        dead_occupy_cells: bool = True,
+        processes: int | None = None,
+        output_dir: str | None = None,
+        sample_interval: int = 1,
+        seed: int | None = None,
+    ) -> None:
+        Model.__init__(self)
+        self.reset_randomizer(seed)
+        params = {
+            "num_agents": num_agents,
+            "num_traveling_agents": num_traveling_agents,
+            "num_medic_agents": num_medic_agents,
+            "width": width,
+            "height": height,
+            "infection_rate": infection_rate,
+            "death_rate": death_rate,
+            "start_infection_rate": start_infection_rate,
+            "wear_mask_chance": wear_mask_chance,
+            "mask_effectiveness": mask_effectiveness,
+            "recovery_time_multiplier": recovery_time_multiplier,
+            "social_distance": social_distance,
+            "social_distance_chance": social_distance_chance,
+            "isolation_duration": isolation_duration,
+            "isolation_chance": isolation_chance,
+            "curing_chance": curing_chance,
+            "vaccine_ready_time": vaccine_ready_time,
+            "vaccine_batch_size": vaccine_batch_size,
+            "vaccine_effectiveness": vaccine_effectiveness,
+            "dead_occupy_cells": dead_occupy_cells,
+        }
+        for name, value in params.items():
+            setattr(self, name, value)
+        self.output_dir = output_dir
+        self.sample_interval = sample_interval
+        self.running = True
+        self.time = 0
+        self.death_times = BinnedHistogram()
+        self.counters = PopulationCounters()
+
+        if processes is None:
+            # as many strips as there are cores, as long as they are thick enough
+            processes = max(1, min(os.cpu_count(), width // (social_distance + 1)))
+        self.processes = processes
+        self.bounds = strip_bounds(width, processes)
+        if processes > 1 and np.diff(self.bounds).min() <= social_distance:
+            raise ValueError(
+                f"strips of {width} rows over {processes} processes are too thin "
+                f"for a social distance of {social_distance}"
+            )
+
+        seeds = np.random.SeedSequence(seed).spawn(processes + 1)
+        self.rng = np.random.default_rng(seeds[0])
+        context = multiprocessing.get_context()
+        inboxes = [context.Queue() for _ in range(processes)]
+        self._connections = []
+        self._workers = []
+        for index in range(processes):
+            conn, worker_conn = context.Pipe()
+            worker = context.Process(
+                target=_serve,
+                args=(
+                    index,
+                    self.bounds,
+                    params,
+                    seeds[index + 1],
+                    inboxes,
+                    worker_conn,
+                ),
+                daemon=True,
+            )
+            worker.start()
+            worker_conn.close()
+            self._connections.append(conn)
+            self._workers.append(worker)
+
+        self.stateDataCollector = self.create_collector(
+            "stateDataCollector",
+            {
+                "Susceptible": lambda m: self.count_state(m, State.SUSCEPTIBLE),
+                "Infected": lambda m: self.count_state(m, State.INFECTED),
+                "Isolated": lambda m: self.count_state(m, State.ISOLATED),
+                "Recovered": lambda m: self.count_state(m, State.RECOVERED),
+                "Deceased": lambda m: self.count_state(m, State.DECEASED),
+            },
+        )
+        self.protectionDataCollector = self.create_collector(
+            "protectionDataCollector",
+            {
+                "Wearing Mask": lambda m: self.count_mask(m, True),
+                "Not Wearing Mask": lambda m: self.count_mask(m, False),
+                "Vaccinated": lambda m: self.count_vaccinated(m, True),
+                "Not Vaccinated": lambda m: self.count_vaccinated(m, False),
+            },
+        )
+        self.ageDataCollector = self.create_collector(
+            "ageDataCollector", self.build_age_collector()
+        )
+        self.deathDataCollector = self.create_collector(
+            "deathDataCollector", self.build_death_collector()
+        )
+
+        self.add_agents(self.num_agents)
+        self.add_agents(self.num_traveling_agents, travelling=True)
+
+        self.stateDataCollector.collect(self)
+        self.protectionDataCollector.collect(self)
+        self.ageDataCollector.collect(self)
+        self.deathDataCollector.collect(self)
+
+        self.add_agents(self.num_medic_agents, medic=True)
+
+    def add_agents(
+        self, count: int, medic: bool = False, travelling: bool = False
+    ) -> None:
+        """Place count agents uniformly over the grid, split over the strips"""
+        rows = np.diff(self.bounds)
+        counts = self.rng.multinomial(count, rows / rows.sum())
+        self.merge_tallies(
+            self.broadcast([("add", int(n), medic, travelling) for n in counts])
+        )
+
+    def step(self) -> None:
+        """Advance the model by one step."""
+        self.stateDataCollector.collect(self)
+        self.protectionDataCollector.collect(self)
+        self.ageDataCollector.collect(self)
+        self.deathDataCollector.collect(self)
+
+        batches = np.zeros(self.processes, dtype=np.int64)
+        if self.vaccine_ready_time != 0:
+            self.vaccine_ready_time -= 1
+        else:
+            batches = self.vaccine_batches()
+
+        self.merge_tallies(self.broadcast([("step", int(n)) for n in batches]))
+        self.time += 1
+        if self.check_end():
+            self.running = False
+            self.flush_collectors()
+
+    def vaccine_batches(self) -> np.ndarray:
+        """Split a vaccine batch over the strips like a draw from all eligible agents"""
+        eligible = np.array(self._eligible, dtype=np.int64)
+        batch = min(self.vaccine_batch_size, int(eligible.sum()))
+        return self.rng.multivariate_hypergeometric(eligible, batch)
+
+    def broadcast(self, commands: list[tuple]) -> list:
+        """Send one command to each worker and wait for all replies"""
+        for conn, command in zip(self._connections, commands):
+            conn.send(command)
+        replies = {}
+        # a failed worker leaves the others waiting for its messages, so
+        # replies are read as they arrive and a failure stops every worker
+        while len(replies) < len(self._connections):
+            waiting = [c for c in self._connections if c not in replies]
+            for conn in multiprocessing.connection.wait(waiting):
+                try:
+                    status, payload = conn.recv()
+                except EOFError:
+                    status, payload = "error", "worker exited"
+                if status == "error":
+                    for worker in self._workers:
+                        worker.terminate()
+                    self.close()
+                    raise RuntimeError(f"Partition worker failed:\n{payload}")
+                replies[conn] = payload
+        return [replies[conn] for conn in self._connections]
+
+    def merge_tallies(self, tallies: list[dict]) -> None:
+        """Rebuild the population counters from the tallies of every strip"""
+        counters = PopulationCounters()
+        counters.state = np.sum([t["state"] for t in tallies], axis=0).tolist()
+        counters.age = np.sum([t["age"] for t in tallies], axis=0).tolist()
+        living = sum(t["living"] for t in tallies)
+        wearing = sum(t["mask"] for t in tallies)
+        vaccinated = sum(t["vaccinated"] for t in tallies)
+        counters.mask = [living - wearing, wearing]
+        counters.vaccinated = [living - vaccinated, vaccinated]
+        self.counters = counters
+        self._eligible = [t["living"] - t["vaccinated"] for t in tallies]
+        self.death_times.set_counts(np.sum([t["deaths"] for t in tallies], axis=0))
+
+    def population(self) -> dict[str, np.ndarray]:
+        """Agent arrays of all strips, concatenated in strip order"""
+        tiles = self.broadcast([("population",)] * self.processes)
+        return {
+            field: np.concatenate([tile[field] for tile in tiles])
+            for field in TILE_FIELDS
+        }
+
+    def cell_counts(self) -> np.ndarray:
+        # every strip counts its own rows of the grid
+        strips = self.broadcast([("cell_counts",)] * self.processes)
+        return np.concatenate(strips)
+
+    def close(self) -> None:
+        """Stop the worker processes"""
+        for conn, worker in zip(self._connections, self._workers):
+            if worker.is_alive():
+                try:
+                    conn.send(("close",))
+                except OSError:
+                    pass
+            worker.join(timeout=5)
+            if worker.is_alive():
+                worker.terminate()
+            conn.close()
+        self._connections = []
+        self._workers = []
+
+    def __enter__(self) -> "PartitionedInfectionModel":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
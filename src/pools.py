@@ -0,0 +1,74 @@
+from mesa import Agent
+from rng import BlockRandom
+import numpy as np
+
+
+class SamplingPool:
+    """Set of agents that supports O(1) insertion, removal and random picks.
+
+    Agents are kept in a list with a position index; removal swaps the last agent
+    into the freed slot. The index is an array indexed by unique_id, so agent ids
+    are expected to be small non-negative integers.
+    """
+
+    def __init__(self) -> None:
+        self._agents: list[Agent] = []
+        self._positions = np.full(1024, -1, dtype=np.int32)
+
+    def __len__(self) -> int:
+        return len(self._agents)
+
+    def __contains__(self, agent: Agent) -> bool:
+        return (
+            agent.unique_id < len(self._positions)
+            and self._positions[agent.unique_id] >= 0
+        )
+
+    def add(self, agent: Agent) -> None:
+        if agent in self:
+            return
+        if agent.unique_id >= len(self._positions):
+            grown = np.full(2 * agent.unique_id + 1, -1, dtype=np.int32)
+            grown[: len(self._positions)] = self._positions
+            self._positions = grown
+        self._positions[agent.unique_id] = len(self._agents)
+        self._agents.append(agent)
+
+    def extend(self, agents: list[Agent]) -> None:
+        """Add many agents at once"""
+        ids = np.array([agent.unique_id for agent in agents], dtype=np.int64)
+        if len(ids) == 0:
+            return
+        if ids.max() >= len(self._positions):
+            grown = np.full(2 * int(ids.max()) + 1, -1, dtype=np.int32)
+            grown[: len(self._positions)] = self._positions
+            self._positions = grown
+        new = np.flatnonzero(self._positions[ids] < 0)
+        self._positions[ids[new]] = np.arange(
+            len(self._agents), len(self._agents) + len(new)
+        )
+        self._agents.extend(agents[i] for i in new.tolist())
+
+    def discard(self, agent: Agent) -> None:
+        if agent not in self:
+            return
+        position = self._positions[agent.unique_id]
+        self._positions[agent.unique_id] = -1
+        last = self._agents.pop()
+        if position < len(self._agents):
+            self._agents[position] = last
+            self._positions[last.unique_id] = position
+
+    def sample(self, k: int, rng: BlockRandom) -> list[Agent]:
+        """k distinct random agents, or all of them if the pool is smaller"""
+        k = min(k, len(self._agents))
+        # partial Fisher-Yates shuffle of the first k slots
+        for i in range(k):
+            j = rng.randint(i, len(self._agents) - 1)
+            self._swap(i, j)
+        return self._agents[:k]
+
+    def _swap(self, i: int, j: int) -> None:
+        a, b = self._agents[i], self._agents[j]
+        self._agents[i], self._agents[j] = b, a
+        self._positions[a.unique_id], self._positions[b.unique_id] = j, i
@@ -0,0 +1,183 @@
+"""Synthetic populations drawn in bulk, and population files.
+
+A population holds what the engines draw for every agent when they build a
+model: its age, mask, unscaled recovery time, cell and initial infection. The
+regular agents come first, then the traveling agents, then the medics. A
+population file is a directory with one .npy array per attribute and a
+meta.json. Loading memory-maps the arrays, so runs that share a population skip
+drawing it and read the pages from the OS cache.
+"""
+
+import argparse
+import hashlib
+import json
+import os
+
+import numpy as np
+
+# upper age bounds of the recovery time brackets and their recovery time ranges
+RECOVERY_AGE_EDGES = np.array([12, 19, 29, 39, 59, 79])
+RECOVERY_TIME_LOW = np.array([2, 4, 5, 7, 8, 14, 14])
+RECOVERY_TIME_HIGH = np.array([7, 11, 14, 14, 21, 21, 28])
+
+FIELDS = {
+    "age": np.float32,
+    "infected": np.bool_,
+    "wear_mask": np.bool_,
+    "recovery_time": np.int32,
+    "x": np.int32,
+    "y": np.int32,
+}
+GROUPS = ("num_agents", "num_traveling_agents", "num_medic_agents")
+
+
+def draw_base_recovery_times(rng: np.random.Generator, age: np.ndarray) -> np.ndarray:
+    """Recovery times drawn by age bracket, before the recovery time multiplier"""
+    bracket = np.searchsorted(RECOVERY_AGE_EDGES, age, side="left")
+    return rng.integers(RECOVERY_TIME_LOW[bracket], RECOVERY_TIME_HIGH[bracket] + 1)
+
+
+def scale_recovery_times(recovery_time: np.ndarray, multiplier: float) -> np.ndarray:
+    """Apply the recovery time multiplier, truncating to whole steps"""
+    return (recovery_time * multiplier).astype(np.int32)
+
+
+def draw_attributes(
+    rng: np.random.Generator,
+    count: int,
+    start_infection_rate: float,
+    wear_mask_chance: float,
+) -> dict[str, np.ndarray]:
+    """Attributes of count new agents, except for their cells"""
+    age = rng.uniform(0, 99, count).astype(np.float32)
+    infected = rng.random(count) < start_infection_rate
+    wear_mask = rng.random(count) < wear_mask_chance
+    recovery_time = draw_base_recovery_times(rng, age).astype(np.int32)
+    return {
+        "age": age,
+        "infected": infected,
+        "wear_mask": wear_mask,
+        "recovery_time": recovery_time,
+    }
+
+
+class Population:
+    """Attribute arrays of a whole population, with its group sizes and grid"""
+
+    def __init__(
+        self,
+        arrays: dict[str, np.ndarray],
+        num_agents: int,
+        num_traveling_agents: int,
+        num_medic_agents: int,
+        width: int,
+        height: int,
+        digest: str | None = None,
+    ) -> None:
+        size = num_agents + num_traveling_agents + num_medic_agents
+        for field in FIELDS:
+            if len(arrays[field]) != size:
+                raise ValueError(f"{field} holds {len(arrays[field])} of {size} agents")
+        self.arrays = arrays
+        self.num_agents = num_agents
+        self.num_traveling_agents = num_traveling_agents
+        self.num_medic_agents = num_medic_agents
+        self.width = width
+        self.height = height
+        self.digest = digest
+
+    def __len__(self) -> int:
+        return self.num_agents + self.num_traveling_agents + self.num_medic_agents
+
+    def group(self, name: str) -> dict[str, np.ndarray]:
+        """Attributes of one of the GROUPS, as views of the population arrays"""
+        start = sum(getattr(self, g) for g in GROUPS[: GROUPS.index(name)])
+        stop = start + getattr(self, name)
+        return {field: array[start:stop] for field, array in self.arrays.items()}
+
+    def save(self, path: str) -> None:
+        """Write the population to a population file"""
+        os.makedirs(path, exist_ok=True)
+        digest = hashlib.sha256()
+        for field, dtype in FIELDS.items():
+            array = np.ascontiguousarray(self.arrays[field], dtype=dtype)
+            digest.update(field.encode())
+            digest.update(array.tobytes())
+            np.save(os.path.join(path, f"{field}.npy"), array)
+        self.digest = digest.hexdigest()
+        meta = {name: getattr(self, name) for name in GROUPS}
+        meta.update(width=self.width, height=self.height, digest=self.digest)
+        # the meta file comes last, so a population without one is incomplete
+        with open(os.path.join(path, "meta.json"), "w") as f:
+            json.dump(meta, f)
+
+    @classmethod
+    def load(cls, path: str, mmap: bool = True) -> "Population":
+        """Read a population file, memory-mapping its arrays unless mmap is off"""
+        meta = read_meta(path)
+        mode = "r" if mmap else None
+        arrays = {
+            field: np.load(os.path.join(path, f"{field}.npy"), mmap_mode=mode)
+            for field in FIELDS
+        }
+        return cls(
+            arrays,
+            *(meta[name] for name in GROUPS),
+            meta["width"],
+            meta["height"],
+            meta["digest"],
+        )
+
+
+def read_meta(path: str) -> dict:
+    """Group sizes, grid size and content digest of a population file"""
+    with open(os.path.join(path, "meta.json")) as f:
+        return json.load(f)
+
+
+def draw_population(
+    num_agents: int = 10,
+    num_traveling_agents: int = 0,
+    num_medic_agents: int = 0,
+    width: int = 10,
+    height: int = 10,
+    start_infection_rate: float = 0.02,
+    wear_mask_chance: float = 0.5,
+    seed: int | None = None,
+) -> Population:
+    """Draw a population like the engines do for the same parameters"""
+    rng = np.random.default_rng(seed)
+    count = num_agents + num_traveling_agents + num_medic_agents
+    arrays = draw_attributes(rng, count, start_infection_rate, wear_mask_chance)
+    arrays["x"] = rng.integers(0, width, count, dtype=np.int32)
+    arrays["y"] = rng.integers(0, height, count, dtype=np.int32)
+    return Population(
+        arrays, num_agents, num_traveling_agents, num_medic_agents, width, height
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Draw and save a population file")
+    parser.add_argument("path", help="output directory")
+    parser.add_argument("--num_agents", type=int, default=10)
+    parser.add_argument("--num_traveling_agents", type=int, default=0)
+    parser.add_argument("--num_medic_agents", type=int, default=0)
+    parser.add_argument("--width", type=int, default=10)
+    parser.add_argument("--height", type=int, default=10)
+    parser.add_argument("--start_infection_rate", type=float, default=0.02)
+    parser.add_argument("--wear_mask_chance", type=float, default=0.5)
+    parser.add_argument("-s", "--seed", type=int)
+    args = parser.parse_args()
+
+    population = draw_population(
+        args.num_agents,
+        args.num_traveling_agents,
+        args.num_medic_agents,
+        args.width,
+        args.height,
+        args.start_infection_rate,
+        args.wear_mask_chance,
+        args.seed,
+    )
+    population.save(args.path)
+    print(f"{len(population)} agents written to {args.path}")
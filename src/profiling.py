@@ -0,0 +1,169 @@
+"""Opt-in instrumentation of where the time of a model step goes.
+
+instrument(model) wraps the step phases of a model instance, the methods of its
+agents and the grid neighbourhood queries. A model that is never instrumented
+runs the plain methods, so profiling costs nothing when it is off. Wall time
+and call counts are recorded per tick in two collectors next to the model's own:
+profileTimeDataCollector (microseconds) and profileCallDataCollector (calls).
+Times are inclusive. For example, "schedule" contains the agent methods,
+the transitions and spread_infection, and agent.move_with_distance contains the
+agent.check_social_distance calls it makes.
+"""
+
+import time
+from collections import defaultdict
+from typing import Callable
+
+from agent import InfectableAgent
+from runner import COLLECTORS
+
+# model methods timed as phases, where the engine has them
+MODEL_PHASES = [
+    "deploy_vaccine",
+    "travel",
+    "cure",
+    "check_status",
+    "update_isolation",
+    "move",
+    "move_with_distance",
+    "contact",
+    "fire_transitions",
+    "release_isolated",
+    "spread_infection",
+]
+
+# InfectableAgent methods timed inside the agent loop
+AGENT_METHODS = ["move", "move_with_distance", "check_social_distance"]
+
+# grid queries that are only counted, as they are too short to time on their own
+GRID_QUERIES = ["get_neighborhood", "count_occupied_cells"]
+
+
+class PhaseProfiler:
+    """Wall time and call counts per phase, for the current tick and the run"""
+
+    def __init__(self) -> None:
+        self.names: list[str] = []
+        self.seconds = defaultdict(float)
+        self.calls = defaultdict(int)
+        self.total_seconds = defaultdict(float)
+        self.total_calls = defaultdict(int)
+
+    def timed(self, name: str, function: Callable) -> Callable:
+        """Wrap a function so that its wall time and calls count towards name"""
+        if name not in self.names:
+            self.names.append(name)
+        seconds = self.seconds
+        calls = self.calls
+        perf_counter = time.perf_counter
+
+        def wrapper(*args, **kwargs):
+            start = perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                seconds[name] += perf_counter() - start
+                calls[name] += 1
+
+        return wrapper
+
+    def counted(self, name: str, function: Callable) -> Callable:
+        """Wrap a function so that its calls count towards name"""
+        if name not in self.names:
+            self.names.append(name)
+        calls = self.calls
+
+        def wrapper(*args, **kwargs):
+            calls[name] += 1
+            return function(*args, **kwargs)
+
+        return wrapper
+
+    def end_tick(self) -> None:
+        """Add the current tick to the run totals and start a new one"""
+        for name, value in self.seconds.items():
+            self.total_seconds[name] += value
+        for name, value in self.calls.items():
+            self.total_calls[name] += value
+        self.seconds.clear()
+        self.calls.clear()
+
+    def summary(self) -> list[dict]:
+        """Run totals per phase, slowest first"""
+        rows = [
+            {
+                "phase": name,
+                "seconds": self.total_seconds.get(name),
+                "calls": self.total_calls.get(name, 0),
+            }
+            for name in self.names
+        ]
+        return sorted(rows, key=lambda row: -(row["seconds"] or 0))
+
+
+def instrument(model) -> PhaseProfiler:
+    """Start profiling a model and return the profiler that records it"""
+    profiler = PhaseProfiler()
+
+    for name in COLLECTORS:
+        collector = getattr(model, name)
+        collector.collect = profiler.timed("collect", collector.collect)
+
+    for name in MODEL_PHASES:
+        if hasattr(model, name):
+            setattr(model, name, profiler.timed(name, getattr(model, name)))
+
+    schedule = getattr(model, "schedule", None)
+    if schedule is not None:
+        schedule.step = profiler.timed("schedule", schedule.step)
+        agent_class = profiled_agent_class(profiler)
+        for agent in schedule.agents:
+            if type(agent) is InfectableAgent:
+                agent.__class__ = agent_class
+
+    grid = getattr(model, "grid", None)
+    for name in GRID_QUERIES:
+        if hasattr(grid, name):
+            query = f"grid.{name}"
+            setattr(grid, name, profiler.counted(query, getattr(grid, name)))
+
+    step = profiler.timed("step", model.step)
+    seconds = profiler.seconds
+    calls = profiler.calls
+    time_reporters = {
+        name: lambda m, name=name: int(seconds.get(name, 0.0) * 1e6)
+        for name in profiler.names
+        if not name.startswith("grid.")
+    }
+    call_reporters = {
+        name: lambda m, name=name: calls.get(name, 0) for name in profiler.names
+    }
+    model.profileTimeDataCollector = model.create_collector(
+        "profileTimeDataCollector", time_reporters
+    )
+    model.profileCallDataCollector = model.create_collector(
+        "profileCallDataCollector", call_reporters
+    )
+
+    def profiled_step() -> None:
+        step()
+        model.profileTimeDataCollector.collect(model)
+        model.profileCallDataCollector.collect(model)
+        profiler.end_tick()
+        if not model.running:
+            model.profileTimeDataCollector.flush()
+            model.profileCallDataCollector.flush()
+
+    model.step = profiled_step
+    return profiler
+
+
+def profiled_agent_class(profiler: PhaseProfiler) -> type:
+    """InfectableAgent subclass whose methods report to the profiler.
+    It adds no slots, so existing agents can switch to it in place.
+    """
+    methods = {
+        name: profiler.timed(f"agent.{name}", getattr(InfectableAgent, name))
+        for name in AGENT_METHODS
+    }
+    return type("ProfiledAgent", (InfectableAgent,), {"__slots__": (), **methods})
@@ -0,0 +1,214 @@
+"""ModularServer whose models run in worker processes, one per browser session.
+
+Mesa's ModularServer keeps one model for all sessions and steps it inside the
+Tornado event loop, so a slow step blocks every connected browser. Here each
+websocket gets its own model, with its own parameters, in a worker process.
+The worker steps and renders up to `prefetch` frames ahead of the viewer, so
+"step" and "play" are answered from a buffer. The event loop only moves
+messages between the pipe and the websocket.
+
+The worker and the event loop exchange credits. The worker may send as many
+frames as it holds credits, and every frame the viewer takes returns one. Each
+reset starts a new generation, and frames of older generations are dropped.
+"""
+
+import multiprocessing
+import traceback
+from collections import deque
+
+import tornado.escape
+import tornado.ioloop
+import tornado.web
+from mesa.visualization.ModularVisualization import (
+    ModularServer,
+    SocketHandler,
+    is_user_param,
+)
+
+
+def _serve_session(connection, model_cls, elements: list, prefetch: int) -> None:
+    """Worker loop: build, step and render the model of one session"""
+    model = None
+    generation = 0
+    credit = 0
+    ended = False
+    try:
+        while True:
+            if model is None or ended or credit == 0 or connection.poll():
+                command, *args = connection.recv()
+                if command == "close":
+                    return
+                if command == "reset":
+                    generation, params = args
+                    model = model_cls(**params)
+                    model.running = True
+                    ended = False
+                    # the initial frame takes one of the credits
+                    credit = prefetch - 1
+                    message = {"type": "viz_state", "data": _render(model, elements)}
+                    connection.send(
+                        ("frame", generation, tornado.escape.json_encode(message))
+                    )
+                elif command == "credit" and args[0] == generation:
+                    credit += args[1]
+                continue
+
+            if not model.running:
+                connection.send(("end", generation, None))
+                ended = True
+                continue
+            model.step()
+            message = {"type": "viz_state", "data": _render(model, elements)}
+            connection.send(("frame", generation, tornado.escape.json_encode(message)))
+            credit -= 1
+    except (EOFError, KeyboardInterrupt):
+        pass
+    except Exception:
+        connection.send(("error", generation, traceback.format_exc()))
+    finally:
+        if model is not None and hasattr(model, "close"):
+            model.close()
+
+
+def _render(model, elements: list) -> list:
+    return [element.render(model) for element in elements]
+
+
+class RemoteSession:
+    """Event loop side of a session: the worker process and the frame buffer"""
+
+    def __init__(self, application: "RemoteModularServer", write) -> None:
+        self.write = write
+        self.connection, worker_connection = multiprocessing.Pipe()
+        self.process = multiprocessing.Process(
+            target=_serve_session,
+            args=(
+                worker_connection,
+                application.model_cls,
+                application.visualization_elements,
+                application.prefetch,
+            ),
+            daemon=True,
+        )
+        self.process.start()
+        worker_connection.close()
+        self.generation = 0
+        self.frames: deque[str] = deque()
+        self.ended = False
+        self.waiting = 0
+        self.loop = tornado.ioloop.IOLoop.current()
+        self.loop.add_handler(
+            self.connection.fileno(), self._on_readable, tornado.ioloop.IOLoop.READ
+        )
+
+    def reset(self, params: dict) -> None:
+        """Start a new model; its initial frame answers the reset"""
+        self.generation += 1
+        self.frames.clear()
+        self.ended = False
+        self.waiting = 1
+        self.connection.send(("reset", self.generation, params))
+
+    def request(self) -> None:
+        """Answer a get_step with the next frame, now or when it arrives"""
+        self.waiting += 1
+        self._serve()
+
+    def _serve(self) -> None:
+        while self.waiting and self.frames:
+            self.waiting -= 1
+            self.write(self.frames.popleft())
+            self.connection.send(("credit", self.generation, 1))
+        if self.waiting and self.ended:
+            self.waiting = 0
+            self.write({"type": "end"})
+
+    def _on_readable(self, fd, events) -> None:
+        try:
+            while self.connection.poll():
+                kind, generation, payload = self.connection.recv()
+                if generation != self.generation:
+                    continue
+                if kind == "frame":
+                    self.frames.append(payload)
+                elif kind == "end":
+                    self.ended = True
+                elif kind == "error":
+                    print(payload)
+                    self.ended = True
+        except (EOFError, OSError):
+            # the worker is gone; stop the viewer instead of leaving it waiting
+            self.loop.remove_handler(fd)
+            self.ended = True
+        self._serve()
+
+    def close(self) -> None:
+        self.loop.remove_handler(self.connection.fileno())
+        try:
+            self.connection.send(("close",))
+        except OSError:
+            pass
+        self.process.join(timeout=1)
+        if self.process.is_alive():
+            self.process.terminate()
+        self.connection.close()
+
+
+class RemoteSocketHandler(SocketHandler):
+    """Websocket of one browser session, with its own parameters and worker"""
+
+    def open(self) -> None:
+        super().open()
+        self.params = self.application.model_parameters()
+        self.session = RemoteSession(self.application, self.write_message)
+
+    def on_message(self, message) -> None:
+        if self.application.verbose:
+            print(message)
+        msg = tornado.escape.json_decode(message)
+
+        if msg["type"] == "get_step":
+            self.session.request()
+        elif msg["type"] == "reset":
+            self.session.reset(self.params)
+        elif msg["type"] == "submit_params":
+            # only this session's next reset uses the new value
+            if msg["param"] in self.application.user_params:
+                self.params[msg["param"]] = msg["value"]
+        elif self.application.verbose:
+            print("Unexpected message!")
+
+    def on_close(self) -> None:
+        self.session.close()
+
+
+class RemoteModularServer(ModularServer):
+    """ModularServer with one model per session, each in a worker process that
+    prefetches up to `prefetch` frames
+    """
+
+    def __init__(self, *args, prefetch: int = 8, **kwargs) -> None:
+        self.prefetch = max(1, prefetch)
+        super().__init__(*args, **kwargs)
+        # ModularServer hard-codes its socket handler, so route /ws again
+        self.handlers = [
+            (r"/ws", RemoteSocketHandler) if handler[0] == r"/ws" else handler
+            for handler in self.handlers
+        ]
+        tornado.web.Application.__init__(self, self.handlers, **self.settings)
+
+    def model_parameters(self) -> dict:
+        """Current values of the model parameters, as reset_model resolves them"""
+        params = {}
+        for key, value in self.model_kwargs.items():
+            if is_user_param(value):
+                if value.param_type == "static_text":
+                    continue
+                params[key] = value.value
+            else:
+                params[key] = value
+        return params
+
+    def reset_model(self) -> None:
+        # models only live in the session workers
+        self.model = None
@@ -0,0 +1,62 @@
+import math
+import numpy as np
+
+
+class BlockRandom:
+    """Seedable random stream that pre-draws uniforms in large blocks.
+
+    Scalar draws are served from a buffer of Python floats, which avoids the
+    per-call overhead of np.random for the per-agent hot paths.
+    """
+
+    def __init__(self, seed: int | None = None, block_size: int = 8192) -> None:
+        self.generator = np.random.default_rng(seed)
+        self.block_size = block_size
+        self._block = []
+        self._index = 0
+
+    def get_state(self) -> dict:
+        """State of the stream, including the undrawn part of the current block"""
+        return {
+            "generator": self.generator.bit_generator.state,
+            "block": self._block[self._index :],
+        }
+
+    def set_state(self, state: dict) -> None:
+        self.generator.bit_generator.state = state["generator"]
+        self._block = list(state["block"])
+        self._index = 0
+
+    def _refill(self) -> None:
+        self._block = self.generator.random(self.block_size).tolist()
+        self._index = 0
+
+    def random(self) -> float:
+        """Uniform float in [0, 1)"""
+        if self._index == len(self._block):
+            self._refill()
+        value = self._block[self._index]
+        self._index += 1
+        return value
+
+    def bernoulli(self, p: float) -> bool:
+        """True with probability p"""
+        return self.random() < p
+
+    def uniform(self, a: float, b: float) -> float:
+        """Uniform float in [a, b)"""
+        return a + (b - a) * self.random()
+
+    def randint(self, a: int, b: int) -> int:
+        """Uniform integer in [a, b], both included"""
+        return a + int(self.random() * (b - a + 1))
+
+    def geometric(self, p: float) -> int | None:
+        """Number of Bernoulli(p) trials up to and including the first success,
+        or None if there never is one
+        """
+        if p >= 1:
+            return 1
+        if p <= 0:
+            return None
+        return 1 + int(math.log(1.0 - self.random()) / math.log1p(-p))
@@ -0,0 +1,105 @@
+"""Headless entry point: run a single simulation without the visualization server.
+
+Model parameters are given as --<name> <value> flags (e.g. --num_agents 500) or in
+a JSON config file; flags take precedence over the config file.
+"""
+import argparse
+import json
+import sys
+
+
+def build_parser(description: str) -> argparse.ArgumentParser:
+    """Parser with the options shared by the headless entry points"""
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument("-c", "--config", help="JSON file with model parameters")
+    parser.add_argument("-n", "--steps", type=int, help="maximum number of steps")
+    parser.add_argument("-s", "--seed", type=int)
+    parser.add_argument(
+        "-e",
+        "--engine",
+        default="agent",
+        help="agent, vectorized, partitioned or hybrid",
+    )
+    parser.add_argument("-o", "--output", help="JSON file for the results")
+    return parser
+
+
+def add_cache_arguments(parser: argparse.ArgumentParser) -> None:
+    """Options of the entry points that can reuse runs from a cache.ResultCache"""
+    parser.add_argument(
+        "--cache",
+        nargs="?",
+        const="",
+        help="reuse seeded runs from this result cache directory "
+        "(default ~/.cache/asma_sim)",
+    )
+    parser.add_argument(
+        "--cache-size", type=int, default=512, help="result cache size cap in MB"
+    )
+
+
+def open_cache(args: argparse.Namespace):
+    """The result cache selected by --cache, or None"""
+    if args.cache is None:
+        return None
+    from cache import DEFAULT_DIRECTORY, ResultCache
+
+    return ResultCache(args.cache or DEFAULT_DIRECTORY, args.cache_size * 1024**2)
+
+
+def parse_value(value: str):
+    """A JSON value, or the raw string for plain strings such as paths"""
+    try:
+        return json.loads(value)
+    except json.JSONDecodeError:
+        return value
+
+
+def parse_args(
+    argv: list[str], parser: argparse.ArgumentParser | None = None
+) -> tuple[argparse.Namespace, dict]:
+    if parser is None:
+        parser = build_parser(__doc__)
+        parser.add_argument(
+            "-p",
+            "--profile",
+            action="store_true",
+            help="print the time spent per phase",
+        )
+        add_cache_arguments(parser)
+    args, extra = parser.parse_known_args(argv)
+
+    params = {}
+    if args.config:
+        with open(args.config) as f:
+            params.update(json.load(f))
+    if len(extra) % 2 != 0:
+        parser.error("model parameters must be given as --<name> <value>")
+    for flag, value in zip(extra[::2], extra[1::2]):
+        if not flag.startswith("--"):
+            parser.error(f"unexpected argument: {flag}")
+        params[flag[2:].replace("-", "_")] = parse_value(value)
+    return args, params
+
+
+def main(argv: list[str] | None = None) -> None:
+    args, params = parse_args(sys.argv[1:] if argv is None else argv)
+
+    # imported here so --help and argument errors do not load the model
+    from runner import run_model
+
+    result = run_model(
+        params, args.steps, args.seed, args.engine, args.profile, open_cache(args)
+    )
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(result, f)
+    print(json.dumps(result["summary"]))
+    if args.profile:
+        for row in result["profile"]["summary"]:
+            seconds = "" if row["seconds"] is None else f"{row['seconds']:10.4f} s"
+            print(f"{row['phase']:30} {seconds:>12} {row['calls']:10d} calls")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+from typing import Any
+
+COLLECTORS = [
+    "stateDataCollector",
+    "protectionDataCollector",
+    "ageDataCollector",
+    "deathDataCollector",
+]
+
+
+def model_class(engine: str = "agent") -> type:
+    """Model class of the given engine"""
+    # imported lazily so that scripts only pay for the engine they use
+    if engine == "agent":
+        from model import InfectionModel
+
+        return InfectionModel
+    if engine == "vectorized":
+        from vectorized import VectorizedInfectionModel
+
+        return VectorizedInfectionModel
+    if engine == "partitioned":
+        from partitioned import PartitionedInfectionModel
+
+        return PartitionedInfectionModel
+    if engine == "hybrid":
+        from hybrid import HybridInfectionModel
+
+        return HybridInfectionModel
+    raise ValueError(f"Unknown engine: {engine}")
+
+
+def create_model(params: dict, seed: int | None = None, engine: str = "agent"):
+    """Create a model of the given engine from a parameter dict"""
+    return model_class(engine)(**params, seed=seed)
+
+
+def collect_results(model, steps: int) -> dict[str, Any]:
+    """Collector series and final summary of a model"""
+    series = {
+        name: {
+            label: list(values)
+            for label, values in getattr(model, name).model_vars.items()
+        }
+        for name in COLLECTORS
+    }
+    # the collectors record at the start of a step, so the state after the last
+    # step is taken from the reporters directly
+    final = {
+        label: int(reporter(model))
+        for label, reporter in model.stateDataCollector.model_reporters.items()
+    }
+    infected = series["stateDataCollector"]["Infected"]
+    peak = max(range(len(infected)), key=infected.__getitem__)
+    peak_infected, peak_step = infected[peak], peak * model.sample_interval
+    if final["Infected"] > peak_infected:
+        peak_infected, peak_step = final["Infected"], steps
+    summary = {
+        "steps": steps,
+        "peak_infected": peak_infected,
+        "peak_step": peak_step,
+        **final,
+    }
+    return {"series": series, "summary": summary}
+
+
+def run_model(
+    params: dict,
+    max_steps: int | None = None,
+    seed: int | None = None,
+    engine: str = "agent",
+    profile: bool = False,
+    cache=None,
+) -> dict[str, Any]:
+    """Run a model until it stops or max_steps is reached.
+    With profile, the result also holds the per-phase timings of profiling.instrument.
+    With a cache.ResultCache, seeded runs are looked up in and added to the cache.
+    """
+    key = None
+    if cache is not None and not profile:
+        from cache import cache_key, is_cacheable
+
+        if is_cacheable(params, seed):
+            key = cache_key(params, max_steps, seed, engine)
+            result = cache.get(key)
+            if result is not None:
+                return {**result, "params": params}
+
+    model = create_model(params, seed, engine)
+    if profile:
+        from profiling import instrument
+
+        profiler = instrument(model)
+    steps = 0
+    try:
+        while model.running and (max_steps is None or steps < max_steps):
+            model.step()
+            steps += 1
+        model.flush_collectors()
+        result = {"params": params, "seed": seed, **collect_results(model, steps)}
+        if profile:
+            result["profile"] = {
+                "summary": profiler.summary(),
+                "series": {
+                    name: {
+                        label: list(values)
+                        for label, values in getattr(model, name).model_vars.items()
+                    }
+                    for name in ("profileTimeDataCollector", "profileCallDataCollector")
+                },
+            }
+        if key is not None:
+            cache.put(key, result)
+        return result
+    finally:
+        model.close()
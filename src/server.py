@@ -1,19 +1,21 @@
-from mesa.visualization.ModularVisualization import ModularServer
 from mesa.visualization.UserParam import Slider
 
 from model import InfectionModel
-from agent import InfectableAgent, State
 from mesa.visualization.modules import (
-    CanvasGrid,
     ChartModule,
     BarChartModule,
     PieChartModule,
 )
 from TitleElement import TitleElement
+from CellGridElement import CellGridElement
+from histogram import BinnedHistogram
+from remote_server import RemoteModularServer
 
 NUM_CELLS = 25
 CANVAS_SIZE_X = 800
 CANVAS_SIZE_Y = 800
+# frames each session's worker computes ahead of the browser
+PREFETCH = 8
 
 sim_params = {
     "num_agents": Slider(
@@ -135,40 +137,40 @@ sim_params = {
         max_value=1,
         step=0.1,
     ),
+    "steps_per_frame": Slider(
+        "Steps per frame",
+        value=1,
+        min_value=1,
+        max_value=20,
+        step=1,
+    ),
     "width": NUM_CELLS,
     "height": NUM_CELLS,
 }
 
 
-def agent_display(agent: InfectableAgent) -> dict:
-    """Display agent with infection state"""
-    display = {"Shape": "circle", "Filled": "true", "Layer": 0}
-    if agent.isMedic == True:
-        display["Color"] = "Grey"
-        display["r"] = 0.6
-    elif agent.state is State.SUSCEPTIBLE:
-        display["Color"] = "Blue"
-        display["r"] = 0.5
-    elif agent.state is State.INFECTED:
-        display["Color"] = "Red"
-        display["Layer"] = 3
-        display["r"] = 0.2
-    elif agent.state is State.ISOLATED:
-        display["Color"] = "Yellow"
-        display["Layer"] = 4
-        display["r"] = 0.3
-    elif agent.state is State.RECOVERED:
-        display["Color"] = "Green"
-        display["Layer"] = 1
-        display["r"] = 0.4
-    elif agent.state is State.DECEASED:
-        display["Color"] = "Black"
-        display["Layer"] = 2
-        display["r"] = 0.3
-    return display
-
-
-grid = CanvasGrid(agent_display, NUM_CELLS, NUM_CELLS, CANVAS_SIZE_X, CANVAS_SIZE_Y)
+class ServerInfectionModel(InfectionModel):
+    """InfectionModel that runs several steps for every frame the browser draws"""
+
+    def __init__(self, steps_per_frame: int = 1, **params) -> None:
+        super().__init__(**params)
+        self.steps_per_frame = steps_per_frame
+
+    def step(self) -> None:
+        for _ in range(self.steps_per_frame):
+            if not self.running:
+                break
+            super().step()
+
+
+# indexed by State, as the cell counts are
+grid = CellGridElement(
+    ["Blue", "Red", "Yellow", "Black", "Green"],
+    NUM_CELLS,
+    NUM_CELLS,
+    CANVAS_SIZE_X,
+    CANVAS_SIZE_Y,
+)
 
 stateChart = ChartModule(
     [
@@ -183,7 +185,7 @@ stateChart = ChartModule(
 )
 
 timeToDieBarChart = BarChartModule(
-    [{"Label": f"{i}-{i+2}", "Color": "#ff726f"} for i in range(1, 30, 3)],
+    [{"Label": label, "Color": "#ff726f"} for label in BinnedHistogram().labels()],
     canvas_width=1000,
     data_collector_name="deathDataCollector",
 )
@@ -212,8 +214,8 @@ vaccinationChart = PieChartModule(
     data_collector_name="protectionDataCollector",
 )
 
-server = ModularServer(
-    InfectionModel,
+server = RemoteModularServer(
+    ServerInfectionModel,
     [
         TitleElement("The World"),
         grid,
@@ -230,6 +232,9 @@ server = ModularServer(
     ],
     "Infection Model",
     sim_params,
+    prefetch=PREFETCH,
 )
 server.port = 8521
-server.launch()
+
+if __name__ == "__main__":
+    server.launch()
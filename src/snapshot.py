@@ -0,0 +1,267 @@
+"""Binary snapshots of a running model that can be restored, and forked, later.
+
+A snapshot holds the agent attributes, grid placement, scheduler order and time,
+queued transitions, vaccine countdown, death histogram, collector history and
+random number state.
+restore() rebuilds the model from it; keyword overrides change model parameters
+for the restored branch, so several scenarios can fork from one warm state.
+"""
+
+import inspect
+import io
+import json
+
+import numpy as np
+
+from agent import InfectableAgent
+from collector import ColumnarDataCollector
+from hybrid import HybridInfectionModel
+from model import InfectionModel
+from partitioned import PartitionedInfectionModel
+from runner import COLLECTORS
+from vectorized import VectorizedInfectionModel
+
+AGENT_FIELDS = [
+    "isMedic",
+    "vaccinated",
+    "_state",
+    "age",
+    "infection_time",
+    "wear_mask",
+    "recovery_time",
+]
+
+ARRAY_FIELDS = [
+    "state",
+    "age",
+    "wear_mask",
+    "vaccinated",
+    "is_medic",
+    "infection_time",
+    "recovery_time",
+    "isolation_time",
+    "x",
+    "y",
+]
+
+# parameters that fix the population and the grid, which a fork cannot change
+FIXED_PARAMS = ["num_agents", "num_traveling_agents", "width", "height", "population"]
+
+
+def model_params(model: InfectionModel) -> dict:
+    """Constructor parameters of a model, with the vaccine countdown as it is now"""
+    params = {}
+    for name in inspect.signature(type(model).__init__).parameters:
+        if name == "self":
+            continue
+        if name == "seed":
+            params[name] = model._seed
+        elif name == "dead_occupy_cells" and not isinstance(
+            model, VectorizedInfectionModel
+        ):
+            params[name] = model.schedule.dead_occupy_cells
+        elif name in ("width", "height") and hasattr(model, "grid"):
+            params[name] = getattr(model.grid, name)
+        else:
+            params[name] = getattr(model, name)
+    return params
+
+
+def snapshot(model: InfectionModel) -> bytes:
+    """Serialize the full state of a model"""
+    if isinstance(model, HybridInfectionModel):
+        # the folded regional counts and the mode have no place in a snapshot
+        raise ValueError("hybrid models cannot be snapshotted")
+    if isinstance(model, PartitionedInfectionModel):
+        # the agents live in the worker processes of the tiles
+        raise ValueError("partitioned models cannot be snapshotted")
+    vectorized = isinstance(model, VectorizedInfectionModel)
+    meta = {
+        "engine": "vectorized" if vectorized else "agent",
+        "params": model_params(model),
+        "running": model.running,
+        "random": model.random.getstate(),
+        "collector_calls": [getattr(model, name)._calls for name in COLLECTORS],
+    }
+    arrays = {
+        f"collector.{name}": getattr(model, name).history() for name in COLLECTORS
+    }
+    arrays["death_times"] = model.death_times.counts
+
+    if vectorized:
+        meta["time"] = model.time
+        meta["rng"] = model.rng.bit_generator.state
+        arrays.update({field: getattr(model, field) for field in ARRAY_FIELDS})
+        arrays["travelling_agents"] = model.travelling_agents
+        arrays["medic_agents"] = model.medic_agents
+    else:
+        snapshot_agents(model, meta, arrays)
+
+    buffer = io.BytesIO()
+    meta_bytes = np.frombuffer(json.dumps(meta).encode(), dtype=np.uint8)
+    np.savez(buffer, meta=meta_bytes, **arrays)
+    return buffer.getvalue()
+
+
+def snapshot_agents(model: InfectionModel, meta: dict, arrays: dict) -> None:
+    agents = sorted(model.schedule.agents, key=lambda a: a.unique_id)
+    arrays["unique_id"] = np.array([a.unique_id for a in agents], dtype=np.int64)
+    for field in AGENT_FIELDS:
+        arrays[f"agent.{field}"] = np.array([getattr(a, field) for a in agents])
+
+    # orders that decide which random draw goes to which agent
+    arrays["active_order"] = np.array(
+        [a.unique_id for a in model.schedule.active_agents], dtype=np.int64
+    )
+    arrays["unvaccinated_order"] = np.array(
+        [a.unique_id for a in model.unvaccinated._agents], dtype=np.int64
+    )
+    # agents in grid order, so cell contents keep their order when placed again
+    placed = [(agent, x, y) for cell, x, y in model.grid.coord_iter() for agent in cell]
+    arrays["placed_id"] = np.array([a.unique_id for a, _, _ in placed], np.int64)
+    arrays["placed_pos"] = np.array([(x, y) for _, x, y in placed], np.int64)
+    arrays["travelling_agents"] = np.array(
+        [a.unique_id for a in model.travelling_agents], dtype=np.int64
+    )
+    arrays["medic_agents"] = np.array(
+        [a.unique_id for a in model.medic_agents], dtype=np.int64
+    )
+    # (tick, kind, unique_id) rows, in firing order
+    for name in ("transitions", "releases"):
+        entries = [(t, k, a.unique_id) for t, k, a in getattr(model, name).entries()]
+        arrays[name] = np.array(entries, dtype=np.int64).reshape(-1, 3)
+
+    rng_state = model.rng.get_state()
+    arrays["rng_block"] = np.array(rng_state["block"], dtype=np.float64)
+    meta["rng"] = rng_state["generator"]
+    meta["steps"] = model.schedule.steps
+    meta["time"] = model.schedule.time
+
+
+def restore(data: bytes, **overrides) -> InfectionModel:
+    """Rebuild a model from a snapshot.
+
+    Keyword arguments override model parameters. Rates, chances, durations and
+    the vaccine countdown can take any value. num_medic_agents can grow, which
+    adds new medics. A snapshot of a model with an output_dir must be given a
+    new output_dir, or None to keep the series in memory. A new seed reseeds the
+    random streams, so branches forked from the same snapshot no longer share
+    their random numbers. Transitions that were already queued keep their drawn
+    times.
+    """
+    with np.load(io.BytesIO(data)) as npz:
+        arrays = {name: npz[name] for name in npz.files}
+    meta = json.loads(arrays.pop("meta").tobytes())
+    params = dict(meta["params"])
+
+    for name in FIXED_PARAMS:
+        if name in overrides and overrides[name] != params.get(name):
+            raise ValueError(f"{name} cannot be changed when restoring a snapshot")
+    # the collectors of the restored model clear their directories, which would
+    # delete the series of the run the snapshot was taken from
+    output_dir = params.get("output_dir")
+    if output_dir is not None and overrides.get("output_dir", output_dir) == output_dir:
+        raise ValueError(
+            "restoring a snapshot with an output_dir needs a new output_dir"
+        )
+    medics = overrides.get("num_medic_agents", params["num_medic_agents"])
+    if medics < params["num_medic_agents"]:
+        raise ValueError("num_medic_agents cannot shrink when restoring a snapshot")
+    params.update(overrides)
+
+    # build an empty model and fill it in from the snapshot
+    empty = {
+        "num_agents": 0,
+        "num_traveling_agents": 0,
+        "num_medic_agents": 0,
+        "population": None,
+        "contact_layers": None,
+    }
+    if meta["engine"] == "vectorized":
+        model = VectorizedInfectionModel(**{**params, **empty})
+        restore_arrays(model, meta, arrays)
+    else:
+        model = InfectionModel(**{**params, **empty})
+        restore_agents(model, meta, arrays)
+    model.population = params.get("population")
+    model.num_agents = params["num_agents"]
+    model.num_traveling_agents = params["num_traveling_agents"]
+    model.num_medic_agents = meta["params"]["num_medic_agents"]
+    model.contact_layers = params.get("contact_layers")
+    model.contact_weights = params.get("contact_weights")
+    model.contacts = model.load_contacts()
+    model.running = meta["running"]
+    model.death_times.set_counts(arrays["death_times"])
+    for name, calls in zip(COLLECTORS, meta["collector_calls"]):
+        collector: ColumnarDataCollector = getattr(model, name)
+        collector.load_history(arrays[f"collector.{name}"], calls)
+
+    if "seed" not in overrides:
+        version, internal, gauss = meta["random"]
+        model.random.setstate((version, tuple(internal), gauss))
+        if meta["engine"] == "vectorized":
+            model.rng.bit_generator.state = meta["rng"]
+        else:
+            state = {"generator": meta["rng"], "block": arrays["rng_block"]}
+            model.rng.set_state(state)
+
+    add_medics(model, medics - model.num_medic_agents)
+    return model
+
+
+def restore_arrays(model: VectorizedInfectionModel, meta: dict, arrays: dict) -> None:
+    for field in ARRAY_FIELDS:
+        setattr(model, field, arrays[field])
+    model.travelling_agents = arrays["travelling_agents"]
+    model.medic_agents = arrays["medic_agents"]
+    model.time = meta["time"]
+
+
+def restore_agents(model: InfectionModel, meta: dict, arrays: dict) -> None:
+    agents = {}
+    for i, unique_id in enumerate(arrays["unique_id"].tolist()):
+        agent = InfectableAgent.__new__(InfectableAgent)
+        agent.unique_id = unique_id
+        agent.model = model
+        agent.pos = None
+        for field in AGENT_FIELDS:
+            setattr(agent, field, arrays[f"agent.{field}"][i].item())
+        agents[unique_id] = agent
+
+    active = set(arrays["active_order"].tolist())
+    for unique_id in arrays["active_order"].tolist():
+        model.schedule.add(agents[unique_id])
+    for unique_id, agent in agents.items():
+        if unique_id not in active:
+            model.schedule.add(agent)
+            model.schedule.retire(agent)
+    for unique_id, (x, y) in zip(
+        arrays["placed_id"].tolist(), arrays["placed_pos"].tolist()
+    ):
+        model.grid.place_agent(agents[unique_id], (x, y))
+    for agent in agents.values():
+        model.counters.add(agent)
+    for unique_id in arrays["unvaccinated_order"].tolist():
+        model.unvaccinated.add(agents[unique_id])
+
+    travelling = arrays["travelling_agents"].tolist()
+    model.travelling_agents = [agents[i] for i in travelling]
+    model.medic_agents = [agents[i] for i in arrays["medic_agents"].tolist()]
+    for name in ("transitions", "releases"):
+        queue = getattr(model, name)
+        for tick, kind, unique_id in arrays[name].tolist():
+            queue.push(tick, kind, agents[unique_id])
+    model.schedule.steps = meta["steps"]
+    model.schedule.time = meta["time"]
+
+
+def add_medics(model: InfectionModel, count: int) -> None:
+    """Add new medic agents to a restored model"""
+    if count <= 0:
+        return
+    medics = model.add_agents(count, True)
+    if isinstance(model, VectorizedInfectionModel):
+        model.medic_agents = np.concatenate([model.medic_agents, medics])
+    else:
+        model.medic_agents.extend(medics)
+    model.num_medic_agents += count
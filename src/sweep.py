@@ -0,0 +1,167 @@
+import argparse
+import hashlib
+import inspect
+import itertools
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Any, Iterator
+
+import numpy as np
+
+from run import parse_value
+from runner import model_class, run_model
+
+
+def model_parameters(engine: str = "agent") -> list[str]:
+    """Names of the engine's constructor parameters that can be swept"""
+    names = list(inspect.signature(model_class(engine).__init__).parameters)
+    return [name for name in names if name not in ("self", "seed")]
+
+
+def expand_values(values: Any) -> list:
+    """Turn a (start, stop, step) range or a single value into a list of values"""
+    if isinstance(values, tuple) and len(values) == 3:
+        start, stop, step = values
+        if step == 0:
+            raise ValueError(f"Range {start}:{stop}:{step} has a step of 0")
+        # include the stop value, like the sliders do
+        count = int(round((stop - start) / step)) + 1
+        values = [round(start + i * step, 10) for i in range(count)]
+        if all(isinstance(v, int) for v in (start, stop, step)):
+            values = [int(v) for v in values]
+    if not isinstance(values, list):
+        values = [values]
+    return values
+
+
+def expand_grid(space: dict[str, Any], engine: str = "agent") -> list[dict]:
+    """All parameter combinations of the given space"""
+    unknown = set(space) - set(model_parameters(engine))
+    if unknown:
+        raise ValueError(f"Unknown model parameters: {', '.join(sorted(unknown))}")
+    names = list(space)
+    grids = [expand_values(space[name]) for name in names]
+    return [dict(zip(names, combination)) for combination in itertools.product(*grids)]
+
+
+def run_id(
+    params: dict, replicate: int, engine: str = "agent", max_steps: int | None = 200
+) -> str:
+    """Stable identifier of a run, used as its file name"""
+    key = json.dumps(
+        {
+            "params": params,
+            "replicate": replicate,
+            "engine": engine,
+            "max_steps": max_steps,
+        },
+        sort_keys=True,
+    )
+    return hashlib.sha1(key.encode()).hexdigest()[:16]
+
+
+def _run(job: tuple) -> tuple[str, dict]:
+    identifier, params, replicate, seed, max_steps, engine, cache = job
+    result = run_model(params, max_steps, seed, engine, cache=cache)
+    result["replicate"] = replicate
+    return identifier, result
+
+
+def _write_result(output_dir: str, identifier: str, result: dict) -> None:
+    # write to a temporary file first so a crash never leaves a partial run behind
+    path = os.path.join(output_dir, f"{identifier}.json")
+    with open(path + ".tmp", "w") as f:
+        json.dump(result, f)
+    os.replace(path + ".tmp", path)
+
+
+def sweep(
+    space: dict[str, Any],
+    output_dir: str,
+    replicates: int = 1,
+    max_steps: int | None = 200,
+    seed: int = 0,
+    engine: str = "agent",
+    processes: int | None = None,
+    cache=None,
+) -> int:
+    """Run every parameter combination of the space on a process pool.
+
+    Each finished run is written to its own file in output_dir as soon as it
+    completes. Runs that already have a file are skipped, so an interrupted sweep
+    resumes where it left off. With a cache.ResultCache, runs that were done
+    before, by any entry point, are read from the cache instead. Returns the
+    number of runs executed.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    seeds = np.random.SeedSequence(seed)
+    jobs = []
+    for params in expand_grid(space, engine):
+        for replicate in range(replicates):
+            identifier = run_id(params, replicate, engine, max_steps)
+            if os.path.exists(os.path.join(output_dir, f"{identifier}.json")):
+                continue
+            # derive the seed from the run itself so resumed runs are reproducible
+            run_seed = int(
+                np.random.SeedSequence(
+                    [seeds.entropy, int(identifier, 16)]
+                ).generate_state(1)[0]
+            )
+            jobs.append(
+                (identifier, params, replicate, run_seed, max_steps, engine, cache)
+            )
+
+    with ProcessPoolExecutor(processes) as executor:
+        futures = [executor.submit(_run, job) for job in jobs]
+        for future in as_completed(futures):
+            identifier, result = future.result()
+            _write_result(output_dir, identifier, result)
+    return len(jobs)
+
+
+def load_results(output_dir: str) -> Iterator[dict]:
+    """Iterate over the finished runs of a sweep"""
+    for name in sorted(os.listdir(output_dir)):
+        if name.endswith(".json"):
+            with open(os.path.join(output_dir, name)) as f:
+                yield json.load(f)
+
+
+def parse_space(assignments: list[str]) -> dict[str, Any]:
+    """Parse name=a,b,c value lists and name=start:stop:step ranges"""
+    space = {}
+    for assignment in assignments:
+        name, values = assignment.split("=", 1)
+        if ":" in values:
+            space[name] = tuple(json.loads(v) for v in values.split(":"))
+        else:
+            space[name] = [parse_value(v) for v in values.split(",")]
+    return space
+
+
+if __name__ == "__main__":
+    from run import add_cache_arguments, open_cache
+
+    parser = argparse.ArgumentParser(description="Run a parameter sweep")
+    parser.add_argument("params", nargs="+", help="name=a,b,c or name=start:stop:step")
+    parser.add_argument("-o", "--output", required=True, help="output directory")
+    parser.add_argument("-r", "--replicates", type=int, default=1)
+    parser.add_argument("-n", "--steps", type=int, default=200)
+    parser.add_argument("-s", "--seed", type=int, default=0)
+    parser.add_argument("-e", "--engine", default="agent")
+    parser.add_argument("-j", "--processes", type=int)
+    add_cache_arguments(parser)
+    args = parser.parse_args()
+
+    executed = sweep(
+        parse_space(args.params),
+        args.output,
+        args.replicates,
+        args.steps,
+        args.seed,
+        args.engine,
+        args.processes,
+        open_cache(args),
+    )
+    print(f"{executed} runs executed")
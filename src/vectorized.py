@@ -0,0 +1,482 @@
+from mesa.model import Model
+from agent import State
+from counters import NUM_STATES
+from model import InfectionModel
+from occupancy import window_counts
+from histogram import BinnedHistogram
+from population import (
+    GROUPS,
+    Population,
+    draw_attributes,
+    draw_base_recovery_times,
+    scale_recovery_times,
+)
+import numpy as np
+
+# Moore neighbourhood without the center, as used by InfectableAgent.move
+MOORE_DX = np.array([-1, -1, -1, 0, 0, 1, 1, 1], dtype=np.int32)
+MOORE_DY = np.array([-1, 0, 1, -1, 1, -1, 0, 1], dtype=np.int32)
+
+# number of social distancing agents whose candidate cells are evaluated at once
+DISTANCING_CHUNK_SIZE = 1 << 16
+
+
+def draw_recovery_times(
+    rng: np.random.Generator, age: np.ndarray, multiplier: float
+) -> np.ndarray:
+    """Recovery times of agents of the given ages, with the multiplier applied"""
+    return scale_recovery_times(draw_base_recovery_times(rng, age), multiplier)
+
+
+def infection_rates(
+    model: Model, wear_mask: np.ndarray, vaccinated: np.ndarray
+) -> np.ndarray:
+    """Vectorized equivalent of InfectableAgent.get_infection_rate"""
+    reduction = (
+        vaccinated * model.vaccine_effectiveness + wear_mask * model.mask_effectiveness
+    )
+    return np.clip(model.infection_rate * (1 - reduction), 0.0, 1.0)
+
+
+class VectorizedInfectionModel(InfectionModel):
+    """Array-backed variant of InfectionModel.
+
+    Agent attributes live in NumPy arrays indexed by agent id and every phase of a
+    step is applied to the whole population at once. Agents act simultaneously
+    within a step: movement and social distancing use the occupancy at the start
+    of the movement phase and every susceptible agent gets a single infection
+    draw against the combined probability of the infected agents in its cell.
+    """
+
+    def __init__(
+        self,
+        num_agents: int = 10,
+        num_traveling_agents: int = 0,
+        num_medic_agents: int = 0,
+        width: int = 10,
+        height: int = 10,
+        infection_rate: float = 0.4,
+        death_rate: float = 0.02,
+        start_infection_rate: float = 0.02,
+        wear_mask_chance: float = 0.5,
+        mask_effectiveness: float = 0.5,
+        recovery_time_multiplier: float = 1.0,
+        social_distance: int = 0,
+        social_distance_chance: float = 0.5,
+        isolation_duration: int = 7,
+        isolation_chance: float = 0.1,
+        curing_chance: float = 0.9,
+        vaccine_ready_time: int = 15,
+        vaccine_batch_size: int = 10,
+        vaccine_effectiveness: float = 0.5,
+        dead_occupy_cells: bool = True,
+        population: str | None = None,
+        contact_layers: str | None = None,
+        contact_weights: dict[str, float] | None = None,
+        output_dir: str | None = None,
+        sample_interval: int = 1,
+        seed: int | None = None,
+    ) -> None:
+        Model.__init__(self)
+        self.reset_randomizer(seed)
+        self.population = population
+        source = None
+        if population is not None:
+            source = Population.load(population)
+            num_agents = source.num_agents
+            num_traveling_agents = source.num_traveling_agents
+            num_medic_agents = source.num_medic_agents
+            width, height = source.width, source.height
+        self.num_agents = num_agents
+        self.num_traveling_agents = num_traveling_agents
+        self.num_medic_agents = num_medic_agents
+        self.width = width
+        self.height = height
+        self.infection_rate = infection_rate
+        self.death_rate = death_rate
+        self.start_infection_rate = start_infection_rate
+        self.wear_mask_chance = wear_mask_chance
+        self.mask_effectiveness = mask_effectiveness
+        self.recovery_time_multiplier = recovery_time_multiplier
+        self.social_distance = social_distance
+        self.social_distance_chance = social_distance_chance
+        self.isolation_duration = isolation_duration
+        self.isolation_chance = isolation_chance
+        self.curing_chance = curing_chance
+        self.vaccine_ready_time = vaccine_ready_time
+        self.vaccine_batch_size = vaccine_batch_size
+        self.vaccine_effectiveness = vaccine_effectiveness
+        self.dead_occupy_cells = dead_occupy_cells
+        self.output_dir = output_dir
+        self.sample_interval = sample_interval
+        self.rng = np.random.default_rng(seed)
+        self.time = 0
+        self.running = True
+        self.death_times = BinnedHistogram()
+
+        self.state = np.empty(0, dtype=np.int8)
+        self.age = np.empty(0, dtype=np.float32)
+        self.wear_mask = np.empty(0, dtype=bool)
+        self.vaccinated = np.empty(0, dtype=bool)
+        self.is_medic = np.empty(0, dtype=bool)
+        self.infection_time = np.empty(0, dtype=np.int32)
+        self.recovery_time = np.empty(0, dtype=np.int32)
+        self.isolation_time = np.empty(0, dtype=np.int32)
+        self.x = np.empty(0, dtype=np.int32)
+        self.y = np.empty(0, dtype=np.int32)
+
+        self.stateDataCollector = self.create_collector(
+            "stateDataCollector",
+            {
+                "Susceptible": lambda m: self.count_state(m, State.SUSCEPTIBLE),
+                "Infected": lambda m: self.count_state(m, State.INFECTED),
+                "Isolated": lambda m: self.count_state(m, State.ISOLATED),
+                "Recovered": lambda m: self.count_state(m, State.RECOVERED),
+                "Deceased": lambda m: self.count_state(m, State.DECEASED),
+            },
+        )
+        self.protectionDataCollector = self.create_collector(
+            "protectionDataCollector",
+            {
+                "Wearing Mask": lambda m: self.count_mask(m, True),
+                "Not Wearing Mask": lambda m: self.count_mask(m, False),
+                "Vaccinated": lambda m: self.count_vaccinated(m, True),
+                "Not Vaccinated": lambda m: self.count_vaccinated(m, False),
+            },
+        )
+        self.ageDataCollector = self.create_collector(
+            "ageDataCollector", self.build_age_collector()
+        )
+        self.deathDataCollector = self.create_collector(
+            "deathDataCollector", self.build_death_collector()
+        )
+
+        groups = {}
+        if source is not None:
+            groups = {name: source.group(name) for name in GROUPS}
+        self.add_agents(self.num_agents, attributes=groups.get("num_agents"))
+        self.travelling_agents = self.add_agents(
+            self.num_traveling_agents, attributes=groups.get("num_traveling_agents")
+        )
+
+        self.stateDataCollector.collect(self)
+        self.protectionDataCollector.collect(self)
+        self.ageDataCollector.collect(self)
+        self.deathDataCollector.collect(self)
+
+        self.medic_agents = self.add_agents(
+            self.num_medic_agents, True, groups.get("num_medic_agents")
+        )
+
+        self.contact_layers = contact_layers
+        self.contact_weights = contact_weights
+        self.contacts = self.load_contacts()
+
+    def add_agents(
+        self,
+        count: int,
+        medic: bool = False,
+        attributes: dict[str, np.ndarray] | None = None,
+    ) -> np.ndarray:
+        """Append count agents to the population arrays and return their ids.
+        The agents are drawn unless their attributes are given, as from a population.
+        """
+        start = len(self.state)
+        if attributes is None:
+            attributes = draw_attributes(
+                self.rng, count, self.start_infection_rate, self.wear_mask_chance
+            )
+            attributes["x"], attributes["y"] = self.random_positions(count)
+
+        self.state = np.concatenate(
+            [
+                self.state,
+                np.where(attributes["infected"], State.INFECTED, State.SUSCEPTIBLE),
+            ]
+        ).astype(np.int8)
+        self.age = np.concatenate([self.age, attributes["age"]])
+        self.wear_mask = np.concatenate([self.wear_mask, attributes["wear_mask"]])
+        self.vaccinated = np.concatenate([self.vaccinated, np.zeros(count, bool)])
+        self.is_medic = np.concatenate([self.is_medic, np.full(count, medic)])
+        self.infection_time = np.concatenate(
+            [self.infection_time, np.full(count, self.time, np.int32)]
+        )
+        self.recovery_time = np.concatenate(
+            [
+                self.recovery_time,
+                scale_recovery_times(
+                    attributes["recovery_time"], self.recovery_time_multiplier
+                ),
+            ]
+        )
+        self.isolation_time = np.concatenate(
+            [self.isolation_time, np.zeros(count, np.int32)]
+        )
+        self.x = np.concatenate([self.x, attributes["x"]])
+        self.y = np.concatenate([self.y, attributes["y"]])
+        return np.arange(start, start + count)
+
+    def random_positions(self, count: int) -> tuple[np.ndarray, np.ndarray]:
+        """Uniformly drawn cells for count new agents"""
+        x = self.rng.integers(0, self.width, count, dtype=np.int32)
+        y = self.rng.integers(0, self.height, count, dtype=np.int32)
+        return x, y
+
+    def step(self) -> None:
+        """Advance the model by one step."""
+        self.stateDataCollector.collect(self)
+        self.protectionDataCollector.collect(self)
+        self.ageDataCollector.collect(self)
+        self.deathDataCollector.collect(self)
+
+        if self.vaccine_ready_time != 0:
+            self.vaccine_ready_time -= 1
+        else:
+            self.deploy_vaccine()
+
+        if len(self.travelling_agents) > 0:
+            self.travel()
+        if len(self.medic_agents) > 0:
+            self.cure()
+
+        self.check_status()
+        moving = self.moving()
+        self.update_isolation()
+        self.move(np.flatnonzero(moving))
+        self.contact()
+
+        self.time += 1
+        if self.check_end():
+            self.running = False
+            self.flush_collectors()
+
+    def deploy_vaccine(self) -> None:
+        """Vaccinate a batch of living, not yet vaccinated agents"""
+        eligible = np.flatnonzero(~self.vaccinated & (self.state != State.DECEASED))
+        batch = min(self.vaccine_batch_size, len(eligible))
+        self.vaccinated[self.rng.choice(eligible, batch, False)] = True
+
+    def travel(self) -> None:
+        """Move the traveling agents that can still change state to random
+        locations
+        """
+        state = self.state[self.travelling_agents]
+        agents = self.travelling_agents[
+            (state != State.RECOVERED) & (state != State.DECEASED)
+        ]
+        self.x[agents] = self.rng.integers(0, self.width, len(agents))
+        self.y[agents] = self.rng.integers(0, self.height, len(agents))
+
+    def cure(self) -> None:
+        """Let infected medics cure the agents sharing their cell"""
+        medics = self.medic_agents[self.state[self.medic_agents] == State.INFECTED]
+        if len(medics) == 0:
+            return
+        cells = self.cell_index()
+        medics_per_cell = np.bincount(cells[medics], minlength=self.cell_count())
+        # only the living agents in a cell with an infected medic get a draw
+        medics_per_agent = medics_per_cell[cells]
+        candidates = np.flatnonzero(
+            (medics_per_agent > 0) & (self.state != State.DECEASED)
+        )
+        # each medic in the cell gets an independent curing attempt
+        cure_chance = 1 - (1 - self.curing_chance) ** medics_per_agent[candidates]
+        cured = candidates[self.rng.random(len(candidates)) < cure_chance]
+        self.state[cured] = State.RECOVERED
+
+    def check_status(self) -> None:
+        """Apply isolation, death and recovery to every infected agent"""
+        infected = np.flatnonzero(self.state == State.INFECTED)
+        isolated = infected[self.rng.random(len(infected)) < self.isolation_chance]
+        self.state[isolated] = State.ISOLATED
+        self.isolation_time[isolated] = 0
+
+        sick = np.flatnonzero(
+            (self.state == State.INFECTED) | (self.state == State.ISOLATED)
+        )
+        dead = self.rng.random(len(sick)) < self.death_rate
+        self.register_deaths(sick[dead])
+        self.state[sick[dead]] = State.DECEASED
+
+        alive = sick[~dead]
+        recovered = alive[
+            self.time - self.infection_time[alive] >= self.recovery_time[alive]
+        ]
+        self.state[recovered] = State.RECOVERED
+
+    def moving(self) -> np.ndarray:
+        """Mask of the agents that move: the susceptible and infected ones.
+        Like retired agents in the agent engine, the recovered and deceased stay put.
+        """
+        return (self.state == State.SUSCEPTIBLE) | (self.state == State.INFECTED)
+
+    def occupying(self) -> np.ndarray:
+        """Mask of the agents that take up their cell, which leaves out the
+        deceased unless dead_occupy_cells is set
+        """
+        if self.dead_occupy_cells:
+            return np.ones(len(self.state), dtype=bool)
+        return self.state != State.DECEASED
+
+    def update_isolation(self) -> None:
+        """Release agents that completed their isolation"""
+        isolated = np.flatnonzero(self.state == State.ISOLATED)
+        self.isolation_time[isolated] += 1
+        released = isolated[self.isolation_time[isolated] == self.isolation_duration]
+        self.state[released] = State.INFECTED
+
+    def move(self, agents: np.ndarray) -> None:
+        """Move the given agents to a random cell of their Moore neighbourhood"""
+        if self.social_distance > 0:
+            distancing = self.rng.random(len(agents)) <= self.social_distance_chance
+            self.move_with_distance(agents[distancing])
+            agents = agents[~distancing]
+        direction = self.rng.integers(0, len(MOORE_DX), len(agents))
+        self.x[agents] = (self.x[agents] + MOORE_DX[direction]) % self.width
+        self.y[agents] = (self.y[agents] + MOORE_DY[direction]) % self.height
+
+    def move_with_distance(self, agents: np.ndarray) -> None:
+        """Move the given agents with concern to social distance.
+        Mirrors InfectableAgent.move_with_distance against the occupancy at the start of the phase.
+        """
+        if len(agents) == 0:
+            return
+        windows, origin = self.distance_windows()
+        # bound the temporary candidate arrays on large populations
+        for start in range(0, len(agents), DISTANCING_CHUNK_SIZE):
+            self.move_chunk_with_distance(
+                agents[start : start + DISTANCING_CHUNK_SIZE], windows, origin
+            )
+
+    def distance_windows(self) -> tuple[list[np.ndarray], int]:
+        """Occupied cell counts around every cell for each distance from
+        social_distance down to 1, and the grid row their first row stands for
+        """
+        occupying = self.occupying()
+        occupied = np.zeros((self.width, self.height), dtype=np.int32)
+        occupied[self.x[occupying], self.y[occupying]] = 1
+        windows = [
+            window_counts(occupied, distance - 1)
+            for distance in range(self.social_distance, 0, -1)
+        ]
+        return windows, 0
+
+    def move_chunk_with_distance(
+        self, agents: np.ndarray, windows: list[np.ndarray], origin: int = 0
+    ) -> None:
+        count = len(agents)
+        # the current cell followed by the 8 shuffled neighbours: like the agent
+        # engine, an agent stays whenever its own cell satisfies the distance
+        order = self.rng.permuted(
+            np.tile(np.arange(len(MOORE_DX), dtype=np.int8), (count, 1)), axis=1
+        )
+        x, y = self.x[agents, None], self.y[agents, None]
+        cand_x = np.concatenate([x, x + MOORE_DX[order]], axis=1) % self.width
+        cand_y = np.concatenate([y, y + MOORE_DY[order]], axis=1) % self.height
+
+        rows = (cand_x - origin) % self.width
+
+        new_x = np.full(count, -1, dtype=np.int32)
+        new_y = np.full(count, -1, dtype=np.int32)
+        for counts in windows:
+            pending = np.flatnonzero(new_x < 0)
+            if len(pending) == 0:
+                break
+            # only the agent itself may be within the distance
+            ok = counts[rows[pending], cand_y[pending]] == 1
+            found = ok.any(axis=1)
+            choice = ok.argmax(axis=1)[found]
+            chosen = pending[found]
+            new_x[chosen] = cand_x[chosen, choice]
+            new_y[chosen] = cand_y[chosen, choice]
+
+        resolved = new_x >= 0
+        self.x[agents[resolved]] = new_x[resolved]
+        self.y[agents[resolved]] = new_y[resolved]
+        # agents that found no spot at any distance move randomly
+        unresolved = agents[~resolved]
+        direction = self.rng.integers(0, len(MOORE_DX), len(unresolved))
+        self.x[unresolved] = (self.x[unresolved] + MOORE_DX[direction]) % self.width
+        self.y[unresolved] = (self.y[unresolved] + MOORE_DY[direction]) % self.height
+
+    def contact(self) -> None:
+        """Infect susceptible agents sharing a cell or a contact layer with
+        infected agents
+        """
+        infected = np.flatnonzero(self.state == State.INFECTED)
+        if len(infected) == 0:
+            return
+        cells = self.cell_index()
+        rates = infection_rates(
+            self, self.wear_mask[infected], self.vaccinated[infected]
+        )
+        with np.errstate(divide="ignore"):
+            log_escape = np.bincount(
+                cells[infected],
+                weights=np.log1p(-rates),
+                minlength=self.cell_count(),
+            )
+        susceptible = np.flatnonzero(self.state == State.SUSCEPTIBLE)
+        log_escape = log_escape[cells[susceptible]]
+        if self.contacts is not None:
+            layers = self.contacts.log_escape(infected, rates, len(self.state))
+            log_escape += layers[susceptible]
+        chance = -np.expm1(log_escape)
+        newly_infected = susceptible[self.rng.random(len(susceptible)) < chance]
+        self.state[newly_infected] = State.INFECTED
+        self.infection_time[newly_infected] = self.time
+
+    def cell_index(self) -> np.ndarray:
+        """Flat cell index of every agent"""
+        return self.x * self.height + self.y
+
+    def cell_count(self) -> int:
+        """Number of distinct values returned by cell_index"""
+        return self.width * self.height
+
+    def cell_counts(self) -> np.ndarray:
+        channels = NUM_STATES + 1
+        occupying = self.occupying()
+        index = self.cell_index()[occupying].astype(np.int64) * channels
+        size = self.cell_count() * channels
+        counts = np.bincount(index + self.state[occupying], minlength=size)
+        medics = self.is_medic[occupying]
+        counts += np.bincount(index[medics] + NUM_STATES, minlength=size)
+        return counts.reshape(-1, self.height, channels)
+
+    def count_state(self, model: Model, state: State) -> int:
+        """Count agents with a given state in the given model"""
+        return int(np.count_nonzero(self.state == state))
+
+    def count_age(self, model: Model, minAge: int, maxAge: int) -> int:
+        """Count agents with a given age in the given model"""
+        return int(
+            np.count_nonzero(
+                (self.age >= minAge)
+                & (self.age <= maxAge)
+                & (self.state != State.DECEASED)
+            )
+        )
+
+    def count_mask(self, model: Model, wearing: bool) -> int:
+        """Count agents who are wearing/not wearing a mask in the given model"""
+        return int(
+            np.count_nonzero(
+                (self.wear_mask == wearing) & (self.state != State.DECEASED)
+            )
+        )
+
+    def count_vaccinated(self, model: Model, vaccinated: bool) -> int:
+        """Count agents who are vaccinated in the given model"""
+        return int(
+            np.count_nonzero(
+                (self.vaccinated == vaccinated) & (self.state != State.DECEASED)
+            )
+        )
+
+    def check_end(self) -> bool:
+        return not np.any(self.state == State.INFECTED)
+
+    def register_deaths(self, agents: np.ndarray) -> None:
+        """Register the death of the given agents"""
+        self.death_times.add_many(self.time - self.infection_time[agents])